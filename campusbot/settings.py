@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chatbot.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,12 +79,124 @@ WSGI_APPLICATION = 'campusbot.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# Configured from the environment. DB_ENGINE is 'sqlite' (the default) or 'postgres'.
+#
+# SQLite runs in WAL mode, so readers never wait for a writer and writers only
+# queue behind each other, for up to DB_TIMEOUT seconds. Write transactions
+# start IMMEDIATE, so two of them can't deadlock upgrading read locks (which
+# fails at once with "database is locked" instead of waiting). synchronous=NORMAL
+# is safe under WAL: a power cut may lose the last commits but never corrupts the
+# file. DB_SQLITE_MMAP_MB of the file is memory-mapped for reads.
+#
+# PostgreSQL reads DB_NAME, DB_USER, DB_PASSWORD, DB_HOST and DB_PORT. With
+# DB_POOL_MAX_SIZE > 0 connections come from psycopg's pool (needs
+# `pip install "psycopg[pool]"`) rather than being kept per thread.
+#
+# DB_CONN_MAX_AGE is how long, in seconds, a worker keeps its connection between
+# requests (0 closes it after every request). Check the effect of a change with
+# `manage.py db_load_test`.
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+DB_CONN_MAX_AGE = _env_int('DB_CONN_MAX_AGE', 60)
+
+if DB_ENGINE == 'postgres':
+    DB_POOL_MAX_SIZE = _env_int('DB_POOL_MAX_SIZE', 0)
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'campusbot'),
+            'USER': os.environ.get('DB_USER', 'campusbot'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # The pool replaces persistent connections; Django refuses both at once
+            'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': _env_int('DB_POOL_MIN_SIZE', 2),
+                    'max_size': DB_POOL_MAX_SIZE,
+                    'timeout': _env_int('DB_TIMEOUT', 10),
+                },
+            } if DB_POOL_MAX_SIZE else {},
+        }
+    }
+elif DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'timeout': _env_int('DB_TIMEOUT', 20),
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    f"PRAGMA mmap_size={_env_int('DB_SQLITE_MMAP_MB', 256) * 1024 * 1024};"
+                    'PRAGMA cache_size=-20000;'
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+            },
+        }
+    }
+else:
+    raise ValueError(f"DB_ENGINE must be 'sqlite' or 'postgres', not {DB_ENGINE!r}")
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# With REDIS_URL set (e.g. redis://localhost:6379/0) every worker shares one
+# Redis cache; otherwise each process has its own in-memory cache.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
     }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
+# Sessions
+# https://docs.djangoproject.com/en/5.2/topics/http/sessions/#configuring-the-session-engine
+#
+# SESSION_BACKEND picks where sessions live:
+#   'db'             a database row read on every authenticated request (Django's default)
+#   'cached_db'      read from the cache, written through to the database
+#   'cache'          cache only; needs REDIS_URL so all workers see the same sessions
+#   'signed_cookies' the session is the cookie itself, so no server-side storage at all
+# Anything but 'db' takes session reads off the database during a login storm.
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
 }
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'db')
+if SESSION_BACKEND not in SESSION_ENGINES:
+    raise ValueError(f"SESSION_BACKEND must be one of {', '.join(SESSION_ENGINES)}, not {SESSION_BACKEND!r}")
+SESSION_ENGINE = SESSION_ENGINES[SESSION_BACKEND]
+
+
+# Logins may be an email or a username, looked up in a single query
+AUTHENTICATION_BACKENDS = [
+    'chatbot.backends.EmailOrUsernameBackend',
+]
 
 
 # Password validation
@@ -121,7 +235,6 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
-import os
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static/frontend"),
 ]
@@ -134,3 +247,217 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 SITE_ID = 1
+
+
+# Chatbot retrieval
+
+# SBERT model used for FAQ and question embeddings. It is loaded on first use;
+# set CHATBOT_WARM_UP_MODEL in server processes to load it (and run a dummy
+# encode) at startup instead of on the first request.
+CHATBOT_EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+CHATBOT_WARM_UP_MODEL = False
+
+# CPU inference backend for the encoder: 'torch' (fp32), 'int8' (dynamic
+# quantization of the Linear layers) or 'onnx' (needs optimum[onnxruntime]).
+# Check parity and speed with `manage.py compare_encoders` before switching.
+CHATBOT_ENCODER = {
+    'BACKEND': 'torch',
+    'OPTIONS': {},
+}
+
+# Background embedding. With ENABLED, FAQ and variant writes only queue an
+# EmbeddingJob and `manage.py embedding_worker` encodes the queue in batches of
+# BATCH_SIZE, so no request waits for the model. Until its job is done a new
+# FAQ is only found by the lexical (CHATBOT_HYBRID) search and an edited one is
+# matched by its previous embedding. The worker also re-embeds the whole corpus
+# when CHATBOT_EMBEDDING_MODEL changes; queries keep using the old model and
+# vectors until every row has a new one, then all workers switch together.
+# Only enable it where a worker runs.
+CHATBOT_EMBEDDING_QUEUE = {
+    'ENABLED': False,
+    'BATCH_SIZE': 64,
+    'POLL_INTERVAL': 1.0,
+    'LEASE_SECONDS': 300,
+}
+
+# Seconds between checks of the shared FAQ index version stamp
+CHATBOT_INDEX_CHECK_INTERVAL = 1.0
+
+# Memory-mapped copy of the FAQ embedding matrix, shared by all worker processes.
+# `manage.py rebuild_faq_embeddings` publishes a new version atomically; workers
+# map the newest version read-only whenever they reload the index, so the OS
+# page cache holds one copy for all of them and no restart is needed. Rows
+# changed since a version was written are read from the database and kept next
+# to the mapped file rather than merged into a private copy of it. DTYPE
+# 'float16' halves the file at a small cost in precision. Set PATH to None to
+# load embeddings from the database in every worker instead.
+CHATBOT_EMBEDDING_STORE = {
+    'PATH': BASE_DIR / 'embedding_store',
+    'DTYPE': 'float32',
+    'KEEP': 2,
+}
+
+# Nearest-neighbour backend over the FAQ embedding matrix. BruteForceBackend is an
+# exact scan; for large corpora switch to the approximate IVF backend, e.g.
+#   'BACKEND': 'chatbot.retrieval.IVFBackend',
+#   'OPTIONS': {'nlist': 256, 'nprobe': 16},
+# where a higher nprobe gives better recall at the cost of latency. Backends, and
+# the per-category backends used for routing, index the (possibly memory-mapped)
+# matrix in place and gather the rows they score per query, so the shared
+# embedding store is never duplicated in a worker's memory.
+CHATBOT_RETRIEVAL = {
+    'BACKEND': 'chatbot.retrieval.BruteForceBackend',
+    'OPTIONS': {},
+}
+
+# Hybrid lexical retrieval with a BM25 inverted index over FAQ questions and answers.
+# MODE is one of:
+#   'off'          semantic search only
+#   'shortcircuit' answer straight from BM25 when the top hit's normalized score
+#                  reaches SHORTCIRCUIT_SCORE and beats the runner-up by
+#                  SHORTCIRCUIT_MARGIN, without encoding the question. With a
+#                  request category only that category's FAQs are considered.
+#                  SHORTCIRCUIT_SCORE replaces MATCH_THRESHOLD for these answers,
+#                  which report the BM25 score as `lexical_score`, not `score`
+#   'rerank'       score only the top CANDIDATES BM25 hits semantically, falling
+#                  back to the full search when no FAQ shares a keyword
+#   'rrf'          reciprocal rank fusion of the semantic and BM25 top CANDIDATES
+CHATBOT_HYBRID = {
+    'MODE': 'off',
+    'CANDIDATES': 50,
+    'SHORTCIRCUIT_SCORE': 0.9,
+    'SHORTCIRCUIT_MARGIN': 1.5,
+    'RRF_K': 60,
+}
+
+# Category routing: a request may pass a FAQ `category` to score only that
+# category's FAQs. With AUTO, questions without one are routed to the category
+# whose centroid is closer than the runner-up's by at least MIN_MARGIN. A best
+# in-category score below FALLBACK_SCORE falls back to the whole index.
+CHATBOT_CATEGORY_ROUTING = {
+    'AUTO': False,
+    'MIN_MARGIN': 0.05,
+    'FALLBACK_SCORE': 0.6,
+}
+
+# Answer selection. The bi-encoder retrieves the TOP_K best FAQs; the best one is
+# the answer if its cosine score exceeds MATCH_THRESHOLD, and up to ALTERNATIVES
+# others scoring at least ALTERNATIVE_THRESHOLD are returned as "alternatives"
+# (set ALTERNATIVES to 0 to omit them).
+CHATBOT_RANKING = {
+    'TOP_K': 5,
+    'MATCH_THRESHOLD': 0.6,
+    'ALTERNATIVES': 3,
+    'ALTERNATIVE_THRESHOLD': 0.45,
+}
+
+# With ENABLED, every question answered is logged to QueryLog, for `manage.py
+# unanswered_report`. Requests only append to an in-process ring buffer of MAX_SIZE
+# entries (the oldest are dropped if the database falls that far behind); a
+# background thread writes them with bulk_create every FLUSH_INTERVAL seconds, or
+# once BATCH_SIZE are waiting. Off by default, so tests, benchmarks and load tests
+# do not fill the table; enable it in the settings the web servers run with.
+CHATBOT_QUERY_LOG = {
+    'ENABLED': False,
+    'MAX_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+}
+
+# Handbooks and circulars imported with `manage.py ingest_documents` (HTML, text,
+# or PDF with `pip install pypdf`) are split into passages of up to CHUNK_WORDS
+# words, each repeating the last OVERLAP_WORDS of the one before; shorter than
+# MIN_WORDS are dropped. When no FAQ clears its threshold, the best passage
+# answers if its cosine score exceeds MATCH_THRESHOLD (question-to-passage scores
+# run lower than question-to-question ones).
+CHATBOT_DOCUMENTS = {
+    'ENABLED': True,
+    'MATCH_THRESHOLD': 0.5,
+    'CHUNK_WORDS': 120,
+    'OVERLAP_WORDS': 30,
+    'MIN_WORDS': 5,
+    'BATCH_SIZE': 64,
+}
+
+# Optional second stage: a small cross-encoder re-scores the TOP_K candidates
+# against each FAQ's question and variants. Its scores (0-1 for the default STS
+# model) replace the cosine scores, so it has its own thresholds. Pair scores are
+# cached in a per-process LRU of CACHE_SIZE entries.
+CHATBOT_RERANKER = {
+    'ENABLED': False,
+    'MODEL': 'cross-encoder/stsb-TinyBERT-L-4',
+    'MATCH_THRESHOLD': 0.5,
+    'ALTERNATIVE_THRESHOLD': 0.3,
+    'CACHE_SIZE': 4096,
+    'BATCH_SIZE': 32,
+}
+
+# Micro-batching of concurrent question encodings: questions arriving within
+# MAX_WAIT_MS of each other share one SentenceTransformer.encode call.
+CHATBOT_ENCODE_BATCHING = {
+    'ENABLED': True,
+    'MAX_BATCH_SIZE': 32,
+    'MAX_WAIT_MS': 5,
+}
+
+# Serve /api/chatbot/ from the async view. Enable when running under ASGI, e.g.
+#   uvicorn campusbot.asgi:application
+# so one worker holds many in-flight requests while inference runs in a bounded
+# thread pool. Requests beyond WORKERS + MAX_QUEUE get an immediate 503.
+# /api/chatbot/stream/ (Server-Sent Events) is always async and shares this pool;
+# it only streams under ASGI, since WSGI servers buffer async responses.
+CHATBOT_ASYNC_API = False
+CHATBOT_INFERENCE_POOL = {
+    'WORKERS': 4,
+    'MAX_QUEUE': 64,
+}
+
+# Largest number of questions accepted by /api/chatbot/batch/ in one request
+CHATBOT_BATCH_MAX_QUESTIONS = 64
+
+# Cache of answers keyed by the normalized question text (case-folded, punctuation
+# stripped, whitespace collapsed). LocalAnswerCache is a per-process LRU with TTL;
+# use 'chatbot.cache.DjangoAnswerCache' with OPTIONS {'cache_alias': 'default', 'ttl': 300}
+# to share entries through settings.CACHES. Set BACKEND to None to disable.
+CHATBOT_ANSWER_CACHE = {
+    'BACKEND': 'chatbot.cache.LocalAnswerCache',
+    'OPTIONS': {'max_size': 1024, 'ttl': 300},
+}
+
+# Second cache tier: a question whose embedding is within MAX_DISTANCE cosine
+# distance of a recently answered one reuses that match without scanning the index.
+CHATBOT_SEMANTIC_CACHE = {
+    'ENABLED': True,
+    'MAX_SIZE': 512,
+    'MAX_DISTANCE': 0.05,
+}
+
+# Bulk FAQ import over HTTP (/api/import-faqs/). Only staff users and requests
+# carrying "Authorization: Bearer <TOKEN>" may import (TOKEN is read from the
+# CHATBOT_IMPORT_TOKEN environment variable). Bodies over MAX_UPLOAD_BYTES and
+# inputs of more than MAX_RECORDS records are refused with a 413 and nothing is
+# saved; `manage.py import_faqs` has no limits.
+CHATBOT_IMPORT = {
+    'TOKEN': os.environ.get('CHATBOT_IMPORT_TOKEN'),
+    'MAX_UPLOAD_BYTES': 10 * 1024 * 1024,
+    'MAX_RECORDS': 5000,
+}
+
+# Request instrumentation. MetricsMiddleware counts and times every request and
+# the answering stages (index check, answer cache, encode, retrieve, rerank,
+# serialize), exported in Prometheus text format at /metrics and per request in a
+# Server-Timing header. Requests slower than SLOW_REQUEST_MS are logged with their
+# stage breakdown; a PROFILE_SAMPLE_RATE share of requests runs under cProfile and
+# slow ones are dumped to PROFILE_DIR (None: BASE_DIR / 'profiles').
+# /metrics only answers staff users, requests carrying "Authorization: Bearer <TOKEN>"
+# (TOKEN is read from the CHATBOT_METRICS_TOKEN environment variable) and clients
+# whose address is in ALLOWED_IPS; everyone else gets a 403. Behind a reverse proxy
+# REMOTE_ADDR is the proxy's, so only list addresses that reach the app directly.
+CHATBOT_METRICS = {
+    'ENABLED': True,
+    'SLOW_REQUEST_MS': 500,
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'PROFILE_DIR': None,
+    'TOKEN': os.environ.get('CHATBOT_METRICS_TOKEN'),
+    'ALLOWED_IPS': [],
+}
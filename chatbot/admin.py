@@ -1,6 +1,33 @@
 from django.contrib import admin
-from .models import FAQ
+from .models import FAQ, Document, FAQVariant, QueryLog
 
-admin.site.register(FAQ)
 
-# Register your models here.
+class FAQVariantInline(admin.TabularInline):
+    model = FAQVariant
+    extra = 1
+
+
+@admin.register(FAQ)
+class FAQAdmin(admin.ModelAdmin):
+    list_display = ('question', 'category')
+    list_filter = ('category',)
+    search_fields = ('question', 'variants__question')
+    inlines = [FAQVariantInline]
+
+
+@admin.register(Document)
+class DocumentAdmin(admin.ModelAdmin):
+    # Documents are written by `manage.py ingest_documents`; they can be reviewed and deleted here
+    list_display = ('title', 'source', 'active', 'imported_at')
+    list_filter = ('active',)
+    search_fields = ('title', 'source')
+    readonly_fields = ('source', 'content_hash', 'active', 'imported_at')
+
+
+@admin.register(QueryLog)
+class QueryLogAdmin(admin.ModelAdmin):
+    # Questions that found no answer are the ones worth turning into FAQs; see `manage.py unanswered_report`
+    list_display = ('question', 'answered', 'score', 'latency_ms', 'created_at')
+    list_filter = ('answered', 'category')
+    search_fields = ('question',)
+    date_hierarchy = 'created_at'
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ChatbotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatbot'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import signals  # noqa: F401
+
+        # Opt-in, so management commands that never answer questions stay fast
+        if getattr(settings, 'CHATBOT_WARM_UP_MODEL', False):
+            from .embeddings import warm_up
+            warm_up()
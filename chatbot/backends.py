@@ -0,0 +1,24 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models import Q
+
+
+class EmailOrUsernameBackend(ModelBackend):
+    """
+    ModelBackend that accepts either the email or the username as the login,
+    looking both up in a single query; an email match wins over a username match.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or password is None:
+            return None
+        UserModel = get_user_model()
+        candidates = list(UserModel._default_manager.filter(Q(email=username) | Q(username=username))[:2])
+        if not candidates:
+            # Hash anyway, so an unknown login takes as long as a wrong password
+            UserModel().set_password(password)
+            return None
+        user = next((candidate for candidate in candidates if candidate.email == username), candidates[0])
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
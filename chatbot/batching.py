@@ -0,0 +1,146 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class EncodeBatcher:
+    """
+    Collects questions from concurrent requests and encodes them in one forward pass.
+
+    A background thread takes the first queued question, then keeps collecting for
+    at most `max_wait_ms` or until `max_batch_size` questions are gathered. It only
+    waits while other callers are actually in flight, so a lone request is encoded
+    immediately and p50 latency does not pay the batching window.
+
+    Callers name the model to encode with, so the thread never has to ask the
+    database which model is active; `encode_fn(sentences, model_name)` runs once
+    per model present in a batch.
+    """
+
+    def __init__(self, encode_fn, max_batch_size=32, max_wait_ms=5.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # Callers that have asked for an encoding that no batch has picked up yet
+        self._pending = 0
+        self._thread = None
+        self._stats = {
+            'batches': 0,
+            'items': 0,
+            'max_batch_size': 0,
+            'queue_seconds_total': 0.0,
+            'queue_seconds_max': 0.0,
+            'batch_size_buckets': {bucket: 0 for bucket in BATCH_SIZE_BUCKETS},
+        }
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='chatbot-encode-batcher', daemon=True)
+                    self._thread.start()
+
+    def encode(self, sentence, model_name):
+        """Encode one sentence with `model_name`; blocks until the batch containing it has been encoded."""
+        self._ensure_started()
+        future = Future()
+        with self._lock:
+            self._pending += 1
+        self._queue.put((sentence, model_name, future, time.perf_counter()))
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = batch[0][3] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            # Nobody else is waiting for an answer, so there is nothing to batch with
+            if self._pending <= len(batch):
+                break
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            with self._lock:
+                self._pending -= len(batch)
+            # Only while the corpus switches to a new model do questions for two models meet
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            for model_name, items in groups.items():
+                started = time.perf_counter()
+                try:
+                    vectors = self.encode_fn([sentence for sentence, _, _, _ in items], model_name)
+                except Exception as exc:
+                    for _, _, future, _ in items:
+                        future.set_exception(exc)
+                    continue
+                self._record(items, started)
+                for (_, _, future, _), vector in zip(items, vectors):
+                    future.set_result(vector)
+
+    def _record(self, batch, started):
+        waits = [started - enqueued for _, _, _, enqueued in batch]
+        with self._lock:
+            stats = self._stats
+            stats['batches'] += 1
+            stats['items'] += len(batch)
+            stats['max_batch_size'] = max(stats['max_batch_size'], len(batch))
+            stats['queue_seconds_total'] += sum(waits)
+            stats['queue_seconds_max'] = max(stats['queue_seconds_max'], max(waits))
+            for bucket in BATCH_SIZE_BUCKETS:
+                if len(batch) <= bucket:
+                    stats['batch_size_buckets'][bucket] += 1
+                    break
+        logger.debug("Encoded batch of %d (max queue wait %.1fms)", len(batch), max(waits) * 1000)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, batch_size_buckets=dict(self._stats['batch_size_buckets']))
+        stats['mean_batch_size'] = stats['items'] / stats['batches'] if stats['batches'] else 0.0
+        stats['mean_queue_seconds'] = stats['queue_seconds_total'] / stats['items'] if stats['items'] else 0.0
+        return stats
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """Process-wide batcher configured by settings.CHATBOT_ENCODE_BATCHING, or None when disabled."""
+    global _batcher
+    config = getattr(settings, 'CHATBOT_ENCODE_BATCHING', {})
+    if not config.get('ENABLED', False):
+        return None
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                from .embeddings import encode, get_model
+                _batcher = EncodeBatcher(
+                    lambda sentences, model_name: encode(sentences, model=get_model(model_name)),
+                    max_batch_size=config.get('MAX_BATCH_SIZE', 32),
+                    max_wait_ms=config.get('MAX_WAIT_MS', 5.0),
+                )
+    return _batcher
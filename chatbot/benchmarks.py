@@ -0,0 +1,279 @@
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from .retrieval import BruteForceBackend
+
+
+def synthetic_embeddings(n, dim=384, n_topics=None, noise=0.35, seed=0):
+    """Clustered, normalized vectors that mimic FAQs grouped around a number of topics."""
+    rng = np.random.default_rng(seed)
+    n_topics = n_topics or max(1, int(np.sqrt(n)))
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    rows = topics[rng.integers(n_topics, size=n)] + noise * rng.standard_normal((n, dim)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def perturbed_queries(matrix, n_queries, noise=0.15, seed=1):
+    """Queries made by jittering random rows, standing in for paraphrases of existing questions."""
+    rng = np.random.default_rng(seed)
+    targets = rng.integers(len(matrix), size=n_queries)
+    queries = matrix[targets] + noise * rng.standard_normal((n_queries, matrix.shape[1])).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries.astype(matrix.dtype, copy=False), targets
+
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q) * 1000) if len(latencies) else 0.0
+
+
+def run_backend(backend, queries, k):
+    """Search every query; return (result positions per query, latency per query in seconds)."""
+    results = []
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        positions, _ = backend.search(query, k=k)
+        latencies.append(time.perf_counter() - started)
+        results.append(positions)
+    return results, np.array(latencies)
+
+
+def recall_at_k(exact_results, approx_results, k):
+    """Mean fraction of the exact top-k that the approximate search also returned."""
+    if not exact_results:
+        return 0.0
+    hits = 0
+    total = 0
+    for exact, approx in zip(exact_results, approx_results):
+        expected = set(exact[:k].tolist())
+        hits += len(expected & set(approx[:k].tolist()))
+        total += len(expected)
+    return hits / total if total else 0.0
+
+
+def compare_backends(matrix, queries, backends, k=5):
+    """
+    Benchmark each (name, backend) against an exact scan of `matrix`.
+
+    Returns one dict per backend with build time, latency percentiles and recall@1/@k.
+    """
+    exact = BruteForceBackend()
+    exact.build(matrix)
+    exact_results, exact_latencies = run_backend(exact, queries, k)
+
+    report = [{
+        'backend': 'exact',
+        'build_s': 0.0,
+        'p50_ms': percentile_ms(exact_latencies, 50),
+        'p95_ms': percentile_ms(exact_latencies, 95),
+        'recall@1': 1.0,
+        f'recall@{k}': 1.0,
+    }]
+    for name, backend in backends:
+        started = time.perf_counter()
+        backend.build(matrix)
+        build_s = time.perf_counter() - started
+        results, latencies = run_backend(backend, queries, k)
+        report.append({
+            'backend': name,
+            'build_s': build_s,
+            'p50_ms': percentile_ms(latencies, 50),
+            'p95_ms': percentile_ms(latencies, 95),
+            'recall@1': recall_at_k(exact_results, results, 1),
+            f'recall@{k}': recall_at_k(exact_results, results, k),
+        })
+    return report
+
+
+# ----------------- End-to-end suite -----------------
+# Synthetic FAQs are built from SUBJECTS x ASPECTS x places ("block 1", "block 2", ...),
+# so any corpus size can be generated and every FAQ has known paraphrases.
+SUBJECTS = [
+    'library', 'hostel', 'canteen', 'gym', 'computer lab', 'auditorium', 'exam cell', 'transport office',
+    'placement cell', 'sports complex', 'admissions office', 'accounts section', 'medical centre',
+    'chemistry lab', 'physics lab', 'workshop', 'seminar hall', 'bookstore', 'parking area', 'swimming pool',
+]
+ASPECTS = [
+    ("What are the opening hours of the {subject} in {place}?",
+     ["When does the {subject} at {place} open?", "{place} {subject} timings"]),
+    ("How much is the fee for the {subject} in {place}?",
+     ["What does the {subject} at {place} cost?", "{subject} charges {place}"]),
+    ("Who do I contact about the {subject} in {place}?",
+     ["Whom should I call regarding the {place} {subject}?", "{subject} {place} contact person"]),
+    ("Where exactly is the {subject} in {place}?",
+     ["How do I find the {subject} at {place}?", "directions to {place} {subject}"]),
+    ("How can I book the {subject} in {place}?",
+     ["Is there a way to reserve the {place} {subject}?", "{subject} reservation {place}"]),
+    ("What are the rules of the {subject} in {place}?",
+     ["Which regulations apply at the {place} {subject}?", "{subject} guidelines {place}"]),
+    ("Is the {subject} in {place} open on holidays?",
+     ["Does the {place} {subject} work during vacations?", "{subject} holiday schedule {place}"]),
+    ("How many people fit in the {subject} in {place}?",
+     ["What is the capacity of the {place} {subject}?", "{subject} seating {place}"]),
+    ("Does the {subject} in {place} have wifi?",
+     ["Is internet available at the {place} {subject}?", "{subject} wifi {place}"]),
+    ("How do I report a problem with the {subject} in {place}?",
+     ["Where can I complain about the {place} {subject}?", "{subject} issue reporting {place}"]),
+]
+
+
+def _combination(i):
+    per_place = len(SUBJECTS) * len(ASPECTS)
+    place = f'block {i // per_place + 1}'
+    subject = SUBJECTS[i % per_place // len(ASPECTS)]
+    return subject, place, ASPECTS[i % len(ASPECTS)]
+
+
+def synthetic_faqs(n):
+    """n distinct FAQ dicts (question, answer, category); FAQ i is always the same for a given i."""
+    faqs = []
+    for i in range(n):
+        subject, place, (template, _) = _combination(i)
+        faqs.append({
+            'question': template.format(subject=subject, place=place),
+            'answer': f'Answer {i}: see the {subject} notice board in {place}.',
+            'category': subject,
+        })
+    return faqs
+
+
+def paraphrase_queries(n_faqs, n_queries, seed=0):
+    """(query text, index of the FAQ it paraphrases) pairs for a synthetic_faqs(n_faqs) corpus."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for target in rng.integers(n_faqs, size=n_queries).tolist():
+        subject, place, (_, paraphrases) = _combination(target)
+        template = paraphrases[int(rng.integers(len(paraphrases)))]
+        queries.append((template.format(subject=subject, place=place), target))
+    return queries
+
+
+def latency_summary(latencies):
+    """p50/p95/p99 and mean in milliseconds for a list of latencies in seconds."""
+    latencies = np.asarray(latencies)
+    return {
+        'p50_ms': percentile_ms(latencies, 50),
+        'p95_ms': percentile_ms(latencies, 95),
+        'p99_ms': percentile_ms(latencies, 99),
+        'mean_ms': float(latencies.mean() * 1000) if len(latencies) else 0.0,
+    }
+
+
+def labelled_recall(ranked, targets, k):
+    """Fraction of queries whose labelled target is among the first k of its ranking."""
+    if not targets:
+        return 0.0
+    return sum(target in list(ranking)[:k] for ranking, target in zip(ranked, targets)) / len(targets)
+
+
+def rss_mb():
+    """Resident set size of this process in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def default_backends(n_rows):
+    """Retrieval backend configs (CHATBOT_RETRIEVAL format) benchmarked for a corpus of n_rows."""
+    return {
+        'brute': {'BACKEND': 'chatbot.retrieval.BruteForceBackend', 'OPTIONS': {}},
+        'ivf': {'BACKEND': 'chatbot.retrieval.IVFBackend',
+                'OPTIONS': {'nlist': max(1, int(np.sqrt(n_rows))), 'nprobe': 8, 'min_train_size': 0}},
+    }
+
+
+# Answer cache / semantic cache combinations for the end-to-end runs
+CACHE_MODES = {
+    'none': {'CHATBOT_ANSWER_CACHE': {'BACKEND': None}, 'CHATBOT_SEMANTIC_CACHE': {'ENABLED': False}},
+    'answer': {'CHATBOT_ANSWER_CACHE': {'BACKEND': 'chatbot.cache.LocalAnswerCache',
+                                        'OPTIONS': {'max_size': 1024, 'ttl': 300}},
+               'CHATBOT_SEMANTIC_CACHE': {'ENABLED': False}},
+    'semantic': {'CHATBOT_ANSWER_CACHE': {'BACKEND': None},
+                 'CHATBOT_SEMANTIC_CACHE': {'ENABLED': True, 'MAX_SIZE': 512, 'MAX_DISTANCE': 0.05}},
+    'both': {'CHATBOT_ANSWER_CACHE': {'BACKEND': 'chatbot.cache.LocalAnswerCache',
+                                      'OPTIONS': {'max_size': 1024, 'ttl': 300}},
+             'CHATBOT_SEMANTIC_CACHE': {'ENABLED': True, 'MAX_SIZE': 512, 'MAX_DISTANCE': 0.05}},
+}
+
+
+def measure_encoding(questions, queries, batch_size=64):
+    """Corpus encode throughput and single-query encode latency; returns (report, corpus matrix, query matrix)."""
+    from .embeddings import encode
+
+    started = time.perf_counter()
+    matrix = encode(questions, batch_size=batch_size)
+    corpus_s = time.perf_counter() - started
+
+    latencies = []
+    vectors = []
+    for text, _ in queries:
+        started = time.perf_counter()
+        vectors.append(encode([text])[0])
+        latencies.append(time.perf_counter() - started)
+    report = {
+        'corpus_s': corpus_s,
+        'corpus_rows_per_s': len(questions) / corpus_s if corpus_s else 0.0,
+        'query': latency_summary(latencies),
+    }
+    return report, matrix, np.vstack(vectors)
+
+
+def measure_retrieval(matrix, query_vectors, targets, backend, k=5):
+    """Build time, per-query latency and labelled recall@1/@k of one backend over `matrix`."""
+    started = time.perf_counter()
+    backend.build(matrix)
+    build_s = time.perf_counter() - started
+    results, latencies = run_backend(backend, query_vectors, k)
+    ranked = [positions.tolist() for positions in results]
+    return {
+        'build_s': build_s,
+        **latency_summary(latencies),
+        'queries_per_s': len(latencies) / latencies.sum() if latencies.sum() else 0.0,
+        'recall@1': labelled_recall(ranked, targets, 1),
+        f'recall@{k}': labelled_recall(ranked, targets, k),
+    }
+
+
+def measure_endpoint(client, queries, faq_ids, k=5, passes=2, url='/api/chatbot/'):
+    """
+    POST every query to the chatbot API `passes` times, in order.
+
+    Repeating the query set lets the cache modes show their effect. Recall@1
+    counts answers from the labelled FAQ; recall@k also accepts it among the
+    alternatives. Both are computed on the first pass only.
+    """
+    from .index import faq_index
+
+    latencies = []
+    hits_1 = hits_k = 0
+    for pass_number in range(passes):
+        for text, target in queries:
+            body = json.dumps({'question': text})
+            started = time.perf_counter()
+            payload = client.post(url, body, content_type='application/json').json()
+            latencies.append(time.perf_counter() - started)
+            if pass_number:
+                continue
+            expected = faq_index.get(faq_ids[target])
+            answered = expected is not None and payload.get('answer') == expected.answer
+            alternatives = [alt['question'] for alt in payload.get('alternatives', [])][:k - 1]
+            hits_1 += answered
+            hits_k += answered or (expected is not None and expected.question in alternatives)
+
+    total_s = sum(latencies)
+    return {
+        **latency_summary(latencies),
+        'requests_per_s': len(latencies) / total_s if total_s else 0.0,
+        'recall@1': hits_1 / len(queries) if queries else 0.0,
+        f'recall@{k}': hits_k / len(queries) if queries else 0.0,
+    }
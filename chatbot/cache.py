@@ -0,0 +1,243 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_question(question):
+    """Case-fold, strip punctuation and collapse whitespace, so trivially different repeats share a key."""
+    return _WHITESPACE.sub(' ', _PUNCTUATION.sub(' ', question.casefold())).strip()
+
+
+class LocalAnswerCache:
+    """In-process LRU cache whose entries also expire `ttl` seconds after being stored."""
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoAnswerCache:
+    """Stores answers in one of settings.CACHES, e.g. to share them between worker processes."""
+
+    def __init__(self, cache_alias='default', ttl=300, key_prefix='chatbot:answer'):
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    def _key(self, key):
+        # Cache backends restrict key characters and length, so hash the question
+        return f'{self.key_prefix}:{hashlib.sha1(repr(key).encode()).hexdigest()}'
+
+    def get(self, key):
+        return caches[self.cache_alias].get(self._key(key))
+
+    def set(self, key, value):
+        caches[self.cache_alias].set(self._key(key), value, self.ttl)
+
+    def clear(self):
+        # Keys carry the FAQ index version, so entries from before a change can no longer be hit
+        pass
+
+
+class AnswerCache:
+    """
+    Answer payloads keyed by (index versions, category filter, normalized question).
+
+    Including the FAQ and passage index versions means any FAQ change or
+    document import, in this or another process, makes older entries unreachable; the local backend is also
+    cleared outright by the FAQ signals to free memory.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version, question, category=None):
+        value = self.backend.get((version, category, normalize_question(question)))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, version, question, payload, category=None):
+        self.backend.set((version, category, normalize_question(question)), payload)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class SemanticCache:
+    """
+    Ring buffer of recent query embeddings and the ranked FAQs each one resolved to.
+
+    A query within `max_distance` cosine distance of a cached query reuses its
+    ranking instead of scanning the FAQ matrix. Unanswered queries are cached
+    too, with an empty ranking. Entries are tied to the FAQ index version: this
+    process's own FAQ writes are applied by `advance()`, which drops only what
+    they affect; a version moved by another process clears the cache.
+    """
+
+    NO_FAQ = -1
+
+    def __init__(self, max_size=512, max_distance=0.05):
+        self.max_size = max_size
+        self.min_similarity = 1.0 - max_distance
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Allocated on the first add, once the embedding size and ranking depth are known
+        self._matrix = None
+        self._faq_ids = None
+        self._scores = None
+        self._valid = np.zeros(max_size, dtype=bool)
+        self._next = 0
+
+    def _sync(self, version):
+        if version != self.version:
+            self._valid[:] = False
+            self.version = version
+
+    def lookup(self, version, vector, k=1):
+        """Return the cached [(faq_id, score), ...] of a near-identical query, or None on a miss."""
+        with self._lock:
+            self._sync(version)
+            if (self._matrix is None or not self._valid.any() or k > self._faq_ids.shape[1]
+                    or len(vector) != self._matrix.shape[1]):
+                self.misses += 1
+                return None
+            similarities = np.where(self._valid, self._matrix @ vector, -np.inf)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.min_similarity:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return [(faq_id, score) for faq_id, score
+                    in zip(self._faq_ids[best, :k].tolist(), self._scores[best, :k].tolist())
+                    if faq_id != self.NO_FAQ]
+
+    def add(self, version, vector, ranked, k=1):
+        """Cache the ranking [(faq_id, score), ...] found for `vector` by a top-k search."""
+        with self._lock:
+            self._sync(version)
+            depth = max(len(ranked), k)
+            if self._matrix is None or depth > self._faq_ids.shape[1] or len(vector) != self._matrix.shape[1]:
+                # A deeper ranking than seen so far, or a new embedding model: start over
+                self._matrix = np.zeros((self.max_size, len(vector)), dtype=np.float32)
+                self._faq_ids = np.full((self.max_size, depth), self.NO_FAQ, dtype=np.int64)
+                self._scores = np.zeros((self.max_size, depth), dtype=np.float32)
+                self._valid[:] = False
+                self._next = 0
+            # Oldest entry is overwritten once the buffer is full
+            slot = self._next
+            self._matrix[slot] = vector
+            self._faq_ids[slot] = self.NO_FAQ
+            self._scores[slot] = 0.0
+            for rank, (faq_id, score) in enumerate(ranked):
+                self._faq_ids[slot, rank] = faq_id
+                self._scores[slot, rank] = score
+            self._valid[slot] = True
+            self._next = (slot + 1) % self.max_size
+
+    def advance(self, version, reset=False, dropped_faq_id=None):
+        """
+        Apply a FAQ write from this process that moved the index to `version`.
+
+        A new or re-embedded FAQ may beat any cached result, so it needs `reset`;
+        a deleted FAQ only drops the entries whose ranking includes it; an edit
+        that kept the embedding needs neither, because answers are read from the index.
+        """
+        with self._lock:
+            if reset or self.version is None or version != self.version + 1:
+                self._valid[:] = False
+            elif dropped_faq_id is not None and self._faq_ids is not None:
+                self._valid &= ~(self._faq_ids == dropped_faq_id).any(axis=1)
+            self.version = version
+
+    def clear(self):
+        with self._lock:
+            self._valid[:] = False
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': int(self._valid.sum())}
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Process-wide answer cache configured by settings.CHATBOT_ANSWER_CACHE, or None when disabled."""
+    global _answer_cache
+    config = getattr(settings, 'CHATBOT_ANSWER_CACHE', {})
+    if not config.get('BACKEND'):
+        return None
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                backend_class = import_string(config['BACKEND'])
+                _answer_cache = AnswerCache(backend_class(**config.get('OPTIONS', {})))
+    return _answer_cache
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """Process-wide semantic cache configured by settings.CHATBOT_SEMANTIC_CACHE, or None when disabled."""
+    global _semantic_cache
+    config = getattr(settings, 'CHATBOT_SEMANTIC_CACHE', {})
+    if not config.get('ENABLED', False):
+        return None
+    if _semantic_cache is None:
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                _semantic_cache = SemanticCache(
+                    max_size=config.get('MAX_SIZE', 512),
+                    max_distance=config.get('MAX_DISTANCE', 0.05),
+                )
+    return _semantic_cache
@@ -0,0 +1,265 @@
+import hashlib
+import logging
+import os
+import re
+from html.parser import HTMLParser
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import normalize_question
+from .models import Document, Passage
+from .store import text_hash
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('html', 'pdf', 'text')
+EXTENSIONS = {'html': 'html', 'htm': 'html', 'pdf': 'pdf', 'txt': 'text', 'md': 'text'}
+READ_CHUNK = 65536
+
+_BLANK_LINE = re.compile(r'\n\s*\n')
+
+
+class DocumentFormatError(ValueError):
+    pass
+
+
+def _documents_config():
+    return getattr(settings, 'CHATBOT_DOCUMENTS', {})
+
+
+def detect_format(name):
+    """Guess the document format from a file name."""
+    extension = os.path.splitext(name)[1].lower().lstrip('.')
+    if extension not in EXTENSIONS:
+        raise DocumentFormatError(f"Unsupported document type {name!r}; expected .html, .htm, .pdf, .txt or .md.")
+    return EXTENSIONS[extension]
+
+
+def file_hash(path):
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(READ_CHUNK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ----------------- Extraction -----------------
+# Each extractor yields the document's text blocks (paragraphs, list items, headings)
+# in order, reading the file incrementally, and stores what it learns about the
+# document, such as its title, in `meta`.
+
+class _HTMLBlocks(HTMLParser):
+    SKIPPED = {'script', 'style', 'noscript', 'template', 'svg'}
+    BLOCKS = {'p', 'div', 'li', 'ul', 'ol', 'br', 'tr', 'table', 'section', 'article', 'header', 'footer',
+              'main', 'aside', 'blockquote', 'pre', 'dt', 'dd', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr'}
+
+    def __init__(self):
+        super().__init__()
+        self.blocks = []
+        self.title = ''
+        self._text = []
+        self._skipping = 0
+        self._in_title = False
+
+    def _flush(self):
+        text = ' '.join(''.join(self._text).split())
+        if text:
+            self.blocks.append(text)
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED:
+            self._skipping += 1
+        elif tag == 'title':
+            self._in_title = True
+        elif tag in self.BLOCKS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag == 'title':
+            self._in_title = False
+        elif tag in self.BLOCKS:
+            self._flush()
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skipping:
+            self._text.append(data)
+
+
+def extract_html(path, meta):
+    parser = _HTMLBlocks()
+    with open(path, encoding='utf-8', errors='replace') as stream:
+        for chunk in iter(lambda: stream.read(READ_CHUNK), ''):
+            parser.feed(chunk)
+            yield from parser.blocks
+            parser.blocks = []
+    parser.close()
+    parser._flush()
+    yield from parser.blocks
+    if parser.title.strip():
+        meta['title'] = ' '.join(parser.title.split())
+
+
+def extract_pdf(path, meta):
+    try:
+        from pypdf import PdfReader
+    except ImportError as exc:
+        raise ImportError("Importing PDF documents needs `pip install pypdf`.") from exc
+
+    # Pages are parsed one at a time as they are read
+    reader = PdfReader(path)
+    if reader.metadata is not None and reader.metadata.title:
+        meta['title'] = reader.metadata.title
+    for page in reader.pages:
+        for paragraph in _BLANK_LINE.split(page.extract_text() or ''):
+            text = ' '.join(paragraph.split())
+            if text:
+                yield text
+
+
+def extract_text(path, meta):
+    paragraph = []
+    with open(path, encoding='utf-8', errors='replace') as stream:
+        for line in stream:
+            if line.strip():
+                paragraph.append(line.strip())
+            elif paragraph:
+                yield ' '.join(paragraph)
+                paragraph = []
+    if paragraph:
+        yield ' '.join(paragraph)
+
+
+EXTRACTORS = {'html': extract_html, 'pdf': extract_pdf, 'text': extract_text}
+
+
+# ----------------- Chunking -----------------
+def dedupe(texts):
+    """Drop texts already seen (after normalization), such as headers and footers repeated on every page."""
+    seen = set()
+    for text in texts:
+        key = text_hash(normalize_question(text))
+        if key not in seen:
+            seen.add(key)
+            yield text
+
+
+def chunk_blocks(blocks, max_words=120, overlap=30, min_words=5):
+    """
+    Pack consecutive text blocks into passages of at most `max_words` words,
+    breaking between blocks once a passage is at least half full of new words.
+    A passage repeats the last `overlap` words of the one before, so a sentence
+    cut at a boundary is whole in one of them. Passages under `min_words` words
+    (page numbers, stray labels) are dropped.
+    """
+    if not 0 <= overlap < max_words:
+        raise ValueError("overlap must be smaller than max_words.")
+    window = []
+    # Words at the end of `window` not yet part of any emitted passage
+    fresh = 0
+    for block in blocks:
+        words = block.split()
+        if not words:
+            continue
+        if fresh >= max_words // 2 and len(window) + len(words) > max_words:
+            if len(window) >= min_words:
+                yield ' '.join(window)
+            window, fresh = (window[-overlap:] if overlap else []), 0
+        window.extend(words)
+        fresh += len(words)
+        while len(window) > max_words:
+            yield ' '.join(window[:max_words])
+            fresh = min(fresh, len(window) - max_words)
+            window = window[max_words - overlap:]
+    if fresh and len(window) >= min_words:
+        yield ' '.join(window)
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_passages(path, fmt=None, meta=None):
+    """Yield the deduplicated passages of the document at `path`, reading it incrementally."""
+    config = _documents_config()
+    blocks = EXTRACTORS[fmt or detect_format(path)](path, {} if meta is None else meta)
+    chunks = chunk_blocks(dedupe(blocks), max_words=config.get('CHUNK_WORDS', 120),
+                          overlap=config.get('OVERLAP_WORDS', 30), min_words=config.get('MIN_WORDS', 5))
+    return dedupe(chunks)
+
+
+# ----------------- Ingestion -----------------
+def ingest_document(path, source=None, fmt=None, batch_size=64, force=False):
+    """
+    Import the document at `path` as passages searchable by the chatbot.
+
+    A document whose file hash matches the imported one, with every passage
+    embedded by the index's current model, is skipped unless `force`. Otherwise
+    passages are extracted, chunked, embedded and written `batch_size` at a time
+    under a new inactive Document, which then replaces the old one in a single
+    transaction, so searches never see a half-imported document.
+
+    Returns {'status': 'imported' or 'unchanged', 'passages': count}.
+    """
+    from .embeddings import encode, get_model, to_bytes
+    from .index import bump_version, recorded_model_name
+    from .passages import PASSAGE_INDEX_KEY, passage_index
+
+    source = source or os.path.abspath(path)
+    fmt = fmt or detect_format(path)
+    digest = file_hash(path)
+    model_name = recorded_model_name()
+
+    current = Document.objects.filter(source=source, active=True).first()
+    if (current is not None and not force and current.content_hash == digest
+            and not current.passages.exclude(embedding_model=model_name).exists()):
+        return {'status': 'unchanged', 'passages': current.passages.count()}
+
+    # Left behind by an interrupted import
+    Document.objects.filter(source=source, active=False).delete()
+    model = get_model(model_name)
+    document = Document.objects.create(source=source, content_hash=digest)
+    meta = {}
+    count = 0
+    try:
+        for batch in _batches(iter_passages(path, fmt, meta), batch_size):
+            vectors = encode(batch, model=model)
+            Passage.objects.bulk_create([
+                Passage(document=document, position=count + i, text=text,
+                        embedding=to_bytes(vector), embedding_model=model_name)
+                for i, (text, vector) in enumerate(zip(batch, vectors))
+            ])
+            count += len(batch)
+    except BaseException:
+        document.delete()
+        raise
+
+    with transaction.atomic():
+        Document.objects.filter(source=source, active=True).delete()
+        document.title = (meta.get('title') or os.path.splitext(os.path.basename(path))[0])[:255]
+        document.active = True
+        document.save(update_fields=['title', 'active', 'imported_at'])
+        bump_version(PASSAGE_INDEX_KEY)
+        transaction.on_commit(passage_index.invalidate)
+    logger.info("Imported %s as %d passages", source, count)
+    return {'status': 'imported', 'passages': count}
+
+
+def remove_document(source):
+    """Delete an imported document and its passages; returns whether it existed."""
+    # The post_delete signal moves the passage index on
+    deleted, _ = Document.objects.filter(source=source).delete()
+    return bool(deleted)
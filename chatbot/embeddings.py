@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_DTYPE = np.float32
+
+# (model name, encoder) of the process-wide encoder
+_loaded = None
+_model_lock = threading.Lock()
+
+
+def _load_torch(model_name, **options):
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name, **options)
+
+
+def _load_int8(model_name, **options):
+    # Dynamic quantization: Linear weights stored as int8, activations quantized on the fly
+    import torch
+
+    model = _load_torch(model_name, **{'device': 'cpu', **options})
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _load_onnx(model_name, **options):
+    # Pass e.g. model_kwargs={'file_name': 'onnx/model_qint8_avx2.onnx'} to pick an exported graph
+    try:
+        import optimum.onnxruntime  # noqa: F401
+    except ImportError as exc:
+        raise ImportError("The 'onnx' encoder backend needs `pip install sentence-transformers[onnx]`.") from exc
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name, backend='onnx', **options)
+
+
+ENCODER_BACKENDS = {
+    'torch': _load_torch,
+    'int8': _load_int8,
+    'onnx': _load_onnx,
+}
+
+
+def load_model(model_name=None, backend=None, **options):
+    """Build an encoder exposing SentenceTransformer.encode with the given inference backend."""
+    config = getattr(settings, 'CHATBOT_ENCODER', {})
+    model_name = model_name or configured_model_name()
+    if backend is None:
+        backend = config.get('BACKEND', 'torch')
+        options = {**config.get('OPTIONS', {}), **options}
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend!r}; expected one of {', '.join(ENCODER_BACKENDS)}")
+
+    started = time.perf_counter()
+    model = ENCODER_BACKENDS[backend](model_name, **options)
+    logger.info("Loaded %s (%s) in %.1fs", model_name, backend, time.perf_counter() - started)
+    return model
+
+
+def configured_model_name():
+    return getattr(settings, 'CHATBOT_EMBEDDING_MODEL', DEFAULT_MODEL_NAME)
+
+
+def active_model_name():
+    """
+    The model the indexed FAQ embeddings were made with, which questions must be
+    encoded with too. It trails CHATBOT_EMBEDDING_MODEL while the embedding
+    worker re-embeds the corpus for a new model.
+    """
+    from .index import active_model_name
+
+    return active_model_name()
+
+
+def get_model(model_name=None):
+    """
+    Return the process-wide encoder for `model_name` (default: the active model),
+    loading it on first use and replacing it when another model is asked for.
+
+    sentence_transformers (and with it torch) is only imported here, so commands
+    that never encode, such as migrate or the admin, do not pay for it.
+    """
+    global _loaded
+    model_name = model_name or active_model_name()
+    loaded = _loaded
+    if loaded is None or loaded[0] != model_name:
+        with _model_lock:
+            loaded = _loaded
+            if loaded is None or loaded[0] != model_name:
+                loaded = _loaded = (model_name, load_model(model_name))
+    return loaded[1]
+
+
+def warm_up():
+    """Load the model and run one dummy encode, so the first real question is not slow."""
+    # Runs during app loading, so the configured model is used rather than asking the database
+    encode(['warm up'], model=get_model(configured_model_name()))
+
+
+def encode(sentences, batch_size=64, model=None):
+    """Encode a list of sentences into L2-normalized float32 vectors (one row each)."""
+    vectors = (model or get_model()).encode(
+        list(sentences),
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    )
+    return np.asarray(vectors, dtype=EMBEDDING_DTYPE)
+
+
+def encode_one(sentence):
+    return encode([sentence])[0]
+
+
+def encode_query(sentence):
+    """Encode a user question, sharing the forward pass with concurrent requests when batching is enabled."""
+    from .batching import get_batcher
+
+    batcher = get_batcher()
+    if batcher is None:
+        return encode_one(sentence)
+    # Resolved in the request's thread, which may read the index stamp; the batcher's thread never does
+    return batcher.encode(sentence, active_model_name())
+
+
+def to_bytes(vector):
+    return np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def from_bytes(data):
+    return np.frombuffer(bytes(data), dtype=EMBEDDING_DTYPE)
@@ -0,0 +1,330 @@
+import csv
+import json
+import os
+import re
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import FAQ, FAQVariant
+
+FORMATS = ('json', 'jsonl', 'csv')
+MAX_REPORTED_ERRORS = 50
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class ImportLimitError(ImportFormatError):
+    """The input is larger than CHATBOT_IMPORT allows through the API."""
+
+
+def import_limits():
+    return getattr(settings, 'CHATBOT_IMPORT', {})
+
+
+class CappedReader:
+    """Binary stream wrapper that raises ImportLimitError once more than `max_bytes` have been read."""
+
+    def __init__(self, stream, max_bytes):
+        self.stream = stream
+        self.remaining = max_bytes
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            raise ImportLimitError("Upload is too large; use `manage.py import_faqs` for large files.")
+        return data
+
+
+def detect_format(name='', content_type=''):
+    """Guess the input format from a file name or content type."""
+    extension = os.path.splitext(name or '')[1].lower().lstrip('.')
+    if extension == 'ndjson':
+        extension = 'jsonl'
+    if extension in FORMATS:
+        return extension
+    if 'csv' in content_type:
+        return 'csv'
+    if 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'jsonl'
+    return 'json'
+
+
+# Characters that may continue a number cut off at the end of the buffer
+_NUMBER_TAIL = re.compile(r'[0-9.eE+\-]*\Z')
+_LITERALS = ('true', 'false', 'null', 'NaN', 'Infinity', '-Infinity')
+
+
+def _incomplete(buffer, exc):
+    """Whether `buffer` failed to decode only because it ends part-way through a value."""
+    rest = buffer[exc.pos:]
+    if exc.pos >= len(buffer) or exc.msg.startswith('Unterminated string'):
+        return True
+    if exc.msg.startswith('Invalid \\uXXXX escape') and len(rest) < 6:
+        return True
+    if any(literal.startswith(rest) for literal in _LITERALS):
+        return True
+    # A number such as `1.` or `2e` whose digits are still to come
+    return exc.pos > 0 and buffer[exc.pos - 1].isdigit() and _NUMBER_TAIL.match(rest) is not None
+
+
+def iter_json_array(stream, chunk_size=65536):
+    """
+    Yield the items of a top-level JSON array without reading the whole document into memory.
+
+    Raises ImportFormatError as soon as the input stops being a well-formed
+    array (a missing or extra comma, a bad value, data after the closing
+    bracket), without buffering the rest of the stream.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    # What may come next: '[' to open the array, a value or ']', a ',' or ']' after an item, or a value after ','
+    expected = 'start'
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            if eof:
+                raise ImportFormatError("Truncated JSON array." if expected != 'start'
+                                        else "Expected a JSON array of FAQ objects.")
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+
+        if expected == 'start':
+            if not buffer.startswith('['):
+                raise ImportFormatError("Expected a JSON array of FAQ objects.")
+            buffer = buffer[1:]
+            expected = 'item or end'
+            continue
+        if buffer.startswith(']') and expected in ('item or end', 'comma or end'):
+            # Only whitespace may follow the array
+            rest = buffer[1:]
+            while not rest.strip():
+                if eof:
+                    return
+                rest = stream.read(chunk_size)
+                eof = not rest
+            raise ImportFormatError("Unexpected data after the JSON array.")
+        if expected == 'comma or end':
+            if not buffer.startswith(','):
+                raise ImportFormatError("Expected ',' or ']' after an item of the JSON array.")
+            buffer = buffer[1:]
+            expected = 'item'
+            continue
+        if buffer[0] in ',]':
+            raise ImportFormatError("Expected an item of the JSON array.")
+
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError as exc:
+            if eof or not _incomplete(buffer, exc):
+                raise ImportFormatError(f"Invalid JSON array: {exc.msg}.")
+            # An item split across chunks; read more and retry
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        # A number or literal at the end of the buffer may continue in the next chunk
+        if not eof and not isinstance(item, (dict, list, str)) and _NUMBER_TAIL.match(buffer, end):
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        buffer = buffer[end:]
+        expected = 'comma or end'
+        yield item
+
+
+def iter_jsonl(stream):
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield ImportFormatError(f"line {line_number}: {exc.msg}")
+
+
+def iter_csv(stream):
+    # Columns: question, answer, and optionally category, extra_data (as a JSON object)
+    # and variants (alternate phrasings separated by "|")
+    reader = csv.DictReader(stream)
+    for row in reader:
+        if row.get('variants'):
+            row['variants'] = row['variants'].split('|')
+        extra_data = row.get('extra_data')
+        if extra_data:
+            try:
+                row['extra_data'] = json.loads(extra_data)
+            except json.JSONDecodeError:
+                yield ImportFormatError(f"line {reader.line_num}: extra_data is not valid JSON")
+                continue
+        yield row
+
+
+def iter_records(stream, fmt):
+    if fmt == 'json':
+        return iter_json_array(stream)
+    if fmt == 'jsonl':
+        return iter_jsonl(stream)
+    if fmt == 'csv':
+        return iter_csv(stream)
+    raise ImportFormatError(f"Unsupported format {fmt!r}; expected one of {', '.join(FORMATS)}.")
+
+
+def clean_variants(variants, question=''):
+    """Strip and deduplicate alternate phrasings, dropping blanks and repeats of `question`."""
+    if variants is None:
+        return []
+    if isinstance(variants, str):
+        variants = [variants]
+    if not isinstance(variants, list):
+        raise ValueError("variants must be a list of strings")
+    max_length = FAQVariant._meta.get_field('question').max_length
+    cleaned = []
+    for variant in variants:
+        variant = str(variant).strip()
+        if len(variant) > max_length:
+            raise ValueError("variant is too long")
+        if variant and variant != question and variant not in cleaned:
+            cleaned.append(variant)
+    return cleaned
+
+
+def _text(record, name):
+    # The stripped string in `record[name]` ('' if missing), checked against the FAQ column's max_length
+    value = record.get(name)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise ValueError(f"{name} must be a string")
+    value = value.strip()
+    max_length = FAQ._meta.get_field(name).max_length
+    if max_length is not None and len(value) > max_length:
+        raise ValueError(f"{name} is too long (at most {max_length} characters)")
+    return value
+
+
+def _clean(record):
+    # Returns the unsaved FAQ and its list of variant phrasings
+    if not isinstance(record, dict):
+        raise ValueError("record is not an object")
+    question = _text(record, 'question')
+    answer = _text(record, 'answer')
+    if not question or not answer:
+        raise ValueError("both question and answer are required")
+    faq = FAQ(
+        question=question,
+        answer=answer,
+        category=_text(record, 'category') or 'general',
+        extra_data=record.get('extra_data') or None,
+        message_type=_text(record, 'message_type') or None,
+    )
+    return faq, clean_variants(record.get('variants'), question)
+
+
+def add_variants(faq, questions):
+    """
+    Attach alternate phrasings to a saved FAQ.
+
+    All phrasings are encoded in one call before saving, so the pre_save signal
+    does not encode them one by one; the post_save signals index each row. With
+    the embedding queue enabled they are saved bare and the signal queues them.
+    """
+    from .embeddings import encode, get_model, to_bytes
+    from .index import recorded_model_name
+    from .jobs import queue_enabled
+
+    questions = clean_variants(questions, faq.question)
+    if not questions:
+        return []
+    if queue_enabled():
+        variants = [FAQVariant(faq=faq, question=question) for question in questions]
+    else:
+        model_name = recorded_model_name()
+        variants = [FAQVariant(faq=faq, question=question, embedding=to_bytes(vector), embedding_model=model_name)
+                    for question, vector in zip(questions, encode(questions, model=get_model(model_name)))]
+    with transaction.atomic():
+        for variant in variants:
+            variant.save()
+    return variants
+
+
+def import_faqs(records, batch_size=500, max_records=None):
+    """
+    Insert FAQ records in batches, skipping questions that already exist.
+
+    Existing questions are fetched once and the input is deduplicated in memory;
+    each batch, variant phrasings included, is encoded in one call and written
+    with bulk_create, all inside a single transaction. With the embedding queue
+    enabled nothing is encoded; the new rows are queued for the worker instead.
+    More than `max_records` records raise ImportLimitError and nothing is saved.
+    Returns counts of inserted, skipped and failed records.
+    """
+    from .embeddings import encode, get_model, to_bytes
+    from .index import recorded_model_name
+    from .jobs import enqueue, queue_enabled
+    from .signals import faqs_changed_in_bulk
+
+    queued = queue_enabled()
+    model_name = None if queued else recorded_model_name()
+
+    result = {'inserted': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+
+    def fail(position, message):
+        result['failed'] += 1
+        if len(result['errors']) < MAX_REPORTED_ERRORS:
+            result['errors'].append(f"record {position}: {message}")
+
+    def flush(batch):
+        faqs = [faq for faq, _ in batch]
+        variants = [FAQVariant(faq=faq, question=variant) for faq, phrasings in batch for variant in phrasings]
+        if not queued:
+            texts = [faq.question for faq in faqs] + [variant.question for variant in variants]
+            for row, vector in zip(faqs + variants, encode(texts, model=get_model(model_name))):
+                row.embedding = to_bytes(vector)
+                row.embedding_model = model_name
+        FAQ.objects.bulk_create(faqs)
+        # bulk_create sets the primary keys (SQLite 3.35+, PostgreSQL), so the variants can point at them
+        FAQVariant.objects.bulk_create(variants)
+        if queued:
+            enqueue('faq', [faq.pk for faq in faqs])
+            enqueue('variant', [variant.pk for variant in variants])
+        result['inserted'] += len(batch)
+
+    with transaction.atomic():
+        seen = set(FAQ.objects.values_list('question', flat=True))
+        batch = []
+        for position, record in enumerate(records, start=1):
+            if max_records is not None and position > max_records:
+                raise ImportLimitError(f"Imports through the API are limited to {max_records} records; "
+                                       f"use `manage.py import_faqs` for larger files.")
+            if isinstance(record, Exception):
+                fail(position, record)
+                continue
+            try:
+                faq, variants = _clean(record)
+            except ValueError as exc:
+                fail(position, exc)
+                continue
+            if faq.question in seen:
+                result['skipped'] += 1
+                continue
+            seen.add(faq.question)
+            batch.append((faq, variants))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+        if result['inserted']:
+            faqs_changed_in_bulk()
+
+    return result
@@ -0,0 +1,758 @@
+import logging
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, F
+
+from .embeddings import EMBEDDING_DTYPE, configured_model_name, encode, from_bytes, get_model, to_bytes
+from .jobs import queue_enabled
+from .lexical import BM25Index
+from .metrics import span
+from .models import FAQ, FAQVariant, IndexVersion
+from .retrieval import StackedRows, create_backend
+from .store import get_embedding_store, text_hash
+
+logger = logging.getLogger(__name__)
+
+FAQ_INDEX_KEY = 'faq'
+
+# Index rows are keyed by (kind, primary key): a FAQ's own question or one of its variants
+FAQ_ROW = 'faq'
+VARIANT_ROW = 'variant'
+
+# FAQ id of a tombstoned row: a row of the mapped embedding store that is stale, or
+# a removed or replaced row. Searches look this many rows deeper, so tombstones never cost a result.
+DEAD_ROW = -1
+# Past this many tombstones the live rows are compacted into a private copy
+MAX_DEAD_ROWS = 256
+# Rows the write buffer first makes room for; it doubles whenever it fills
+MIN_BUFFER_ROWS = 64
+
+
+def current_version(key=FAQ_INDEX_KEY):
+    version = IndexVersion.objects.filter(key=key).values_list('version', flat=True).first()
+    return version or 0
+
+
+def current_state(key=FAQ_INDEX_KEY):
+    """(version, embedding model) of the shared stamp; the model is '' until the first embedding is recorded."""
+    state = IndexVersion.objects.filter(key=key).values_list('version', 'embedding_model').first()
+    return state or (0, '')
+
+
+def active_model_name():
+    """The model questions are encoded with: the one the FAQ index's embeddings come from."""
+    if faq_index.version is not None and not faq_index.is_stale:
+        model_name = faq_index.model_name
+    else:
+        model_name = current_state()[1]
+    # Nothing has been embedded yet, so any model is consistent with the index
+    return model_name or configured_model_name()
+
+
+def recorded_model_name():
+    """
+    The model new embeddings must be made with: the one stamped in the database,
+    even if this process's index is behind. An unstamped index is stamped here,
+    at its first embedding.
+    """
+    return current_state()[1] or seed_model_stamp()
+
+
+def rows_model_name():
+    """The model most FAQ and variant rows record for their embedding, or '' if none records one."""
+    counts = Counter()
+    for model in (FAQ, FAQVariant):
+        counts.update(dict(model.objects.filter(embedding__isnull=False).exclude(embedding_model='')
+                           .values_list('embedding_model').annotate(rows=Count('pk'))))
+    return counts.most_common(1)[0][0] if counts else ''
+
+
+def seed_model_stamp(key=FAQ_INDEX_KEY):
+    """
+    Stamp an index that has no model yet and return its model. The model comes
+    from the rows' own records; CHATBOT_EMBEDDING_MODEL is only used when no row
+    has an embedding, since only then can it not disagree with one.
+    """
+    model_name = rows_model_name()
+    if not model_name:
+        model_name = configured_model_name()
+        if any(model.objects.filter(embedding__isnull=False).exists() for model in (FAQ, FAQVariant)):
+            # Vectors written without a model (raw SQL, old fixtures) cannot be attributed; leave the stamp alone
+            logger.error("FAQ embeddings without a recorded model; run `manage.py rebuild_faq_embeddings` "
+                         "to re-embed them with %s", model_name)
+            return model_name
+    IndexVersion.objects.get_or_create(key=key)
+    IndexVersion.objects.filter(key=key, embedding_model='').update(embedding_model=model_name)
+    return current_state(key)[1]
+
+
+def bump_version(key=FAQ_INDEX_KEY):
+    """Increment the shared version stamp and return the new value."""
+    if not IndexVersion.objects.filter(key=key).update(version=F('version') + 1):
+        IndexVersion.objects.get_or_create(key=key)
+        IndexVersion.objects.filter(key=key).update(version=F('version') + 1)
+    return current_version(key)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(EMBEDDING_DTYPE, copy=False)
+
+
+def _hybrid_config():
+    return getattr(settings, 'CHATBOT_HYBRID', {})
+
+
+def _routing_config():
+    return getattr(settings, 'CHATBOT_CATEGORY_ROUTING', {})
+
+
+def _lexical_text(faq):
+    return f'{faq.question} {faq.answer}'
+
+
+def _index_copy(faq):
+    # Keep only what an answer needs, so the raw embedding bytes are not held twice
+    return FAQ(
+        id=faq.id,
+        question=faq.question,
+        answer=faq.answer,
+        category=faq.category,
+        extra_data=faq.extra_data,
+        message_type=faq.message_type,
+    )
+
+
+def pool_by_faq(ids, positions, scores, k=None):
+    """
+    (FAQ id, score) for ranked row `positions`, best first, each FAQ listed once.
+
+    A FAQ takes the rank and score of its best row, i.e. scores are max-pooled
+    over a FAQ's question and variants.
+    """
+    seen = {DEAD_ROW}
+    ranked = []
+    for faq_id, score in zip(ids[positions].tolist(), np.asarray(scores).tolist()):
+        if faq_id not in seen:
+            seen.add(faq_id)
+            ranked.append((faq_id, score))
+            if len(ranked) == k:
+                break
+    return ranked
+
+
+class CategoryPartitions:
+    """
+    Per-category views of one index snapshot: a retrieval backend over each
+    category's rows and a centroid per category for routing questions.
+
+    Both are built on first use, so categories nobody asks about cost nothing.
+    """
+
+    def __init__(self, matrix, categories):
+        self.matrix = matrix
+        self.categories = categories
+        self._lock = threading.Lock()
+        self._members = {}
+        self._backends = {}
+        self._centroids = None
+
+    def members(self, category):
+        """Global row positions of `category`."""
+        members = self._members.get(category)
+        if members is None:
+            members = np.flatnonzero(self.categories == category)
+            self._members[category] = members
+        return members
+
+    def search(self, query, category, k=1):
+        """Return (global row positions, scores) of the k best rows in `category`, or None if it has no rows."""
+        backend = self._backends.get(category)
+        if backend is None:
+            members = self.members(category)
+            if not len(members):
+                return None
+            with self._lock:
+                backend = self._backends.get(category)
+                if backend is None:
+                    # Searches the category's rows of the shared matrix in place
+                    backend = create_backend()
+                    backend.build(self.matrix, rows=members)
+                    self._backends[category] = backend
+        positions, scores = backend.search(query, k=k)
+        if not len(positions):
+            return None
+        return self.members(category)[positions], scores
+
+    def classify(self, queries, min_margin):
+        """
+        Closest category centroid for each query, or None where the runner-up
+        is within `min_margin` cosine similarity of it.
+        """
+        if self._centroids is None:
+            with self._lock:
+                if self._centroids is None:
+                    # Tombstoned rows have no category
+                    names = sorted(set(self.categories.tolist()) - {None})
+                    centroids = _normalize(np.vstack([self.matrix[self.members(name)].sum(axis=0, dtype=np.float32)
+                                                      for name in names]))
+                    self._centroids = (names, centroids)
+        names, centroids = self._centroids
+        if len(names) < 2:
+            return [None] * len(queries)
+
+        similarities = queries @ centroids.T
+        routes = []
+        for row in similarities:
+            first, second = np.argpartition(-row, 1)[:2]
+            routes.append(names[first] if row[first] - row[second] >= min_margin else None)
+        return routes
+
+
+class RowBuffer:
+    """
+    The rows of the FAQ index: a FAQ id, a category and a normalized embedding each.
+
+    The leading rows may be a read-only `base` matrix, the mapped embedding
+    store, which is never copied. The rows after it live in buffers that double
+    when they fill, so adding a row writes it in place at amortized O(1) cost,
+    and a view taken earlier never reaches the rows added since. Rows are never
+    overwritten, as readers may be scanning them: a removed or replaced row is
+    tombstoned (FAQ id DEAD_ROW, no category) until compacted() drops it.
+    """
+
+    def __init__(self, ids, categories, base=None, tail=None):
+        self.base = base
+        self.size = len(ids)
+        self.dead = int(np.count_nonzero(ids == DEAD_ROW))
+        self._ids = ids
+        self._categories = categories
+        self._tail = tail
+
+    @property
+    def dim(self):
+        matrix = self.base if self.base is not None else self._tail
+        return None if matrix is None else matrix.shape[1]
+
+    @property
+    def _base_size(self):
+        return 0 if self.base is None else len(self.base)
+
+    def view(self):
+        """(ids, matrix, categories) of the current rows; the matrix is None when there are none."""
+        n, n_tail = self.size, self.size - self._base_size
+        if not n:
+            matrix = None
+        elif self.base is None:
+            matrix = self._tail[:n_tail]
+        elif not n_tail:
+            matrix = self.base
+        else:
+            matrix = StackedRows(self.base, self._tail[:n_tail])
+        return self._ids[:n], matrix, self._categories[:n]
+
+    def row(self, pos):
+        split = self._base_size
+        return self.base[pos] if pos < split else self._tail[pos - split]
+
+    def append(self, faq_id, category, vector):
+        """Add a row and return its position."""
+        n_tail = self.size - self._base_size
+        if self._tail is None or n_tail == len(self._tail):
+            self._reserve(max(2 * n_tail, MIN_BUFFER_ROWS), len(vector))
+        pos = self.size
+        self._tail[n_tail] = vector
+        self._ids[pos] = faq_id
+        self._categories[pos] = category
+        self.size += 1
+        return pos
+
+    def _reserve(self, capacity, dim):
+        # Moves the rows after the base into buffers with room for `capacity` of them
+        split, n_tail = self._base_size, self.size - self._base_size
+        tail = np.empty((capacity, dim), dtype=EMBEDDING_DTYPE)
+        ids = np.full(split + capacity, DEAD_ROW, dtype=np.int64)
+        categories = np.empty(split + capacity, dtype=object)
+        if n_tail:
+            tail[:n_tail] = self._tail[:n_tail]
+        ids[:self.size] = self._ids[:self.size]
+        categories[:self.size] = self._categories[:self.size]
+        self._tail, self._ids, self._categories = tail, ids, categories
+
+    def kill(self, positions):
+        """Tombstone the live rows at `positions`."""
+        self._ids[positions] = DEAD_ROW
+        self._categories[positions] = None
+        self.dead += len(positions)
+
+    def set_category(self, faq_id, category):
+        ids, _, categories = self.view()
+        categories[ids == faq_id] = category
+
+    def compacted(self):
+        """A buffer of the live rows alone, and their positions in this one."""
+        ids, matrix, categories = self.view()
+        live = np.flatnonzero(ids != DEAD_ROW)
+        tail = np.asarray(matrix[live], dtype=EMBEDDING_DTYPE) if len(live) else None
+        return RowBuffer(ids[live], categories[live], tail=tail), live
+
+
+class FAQIndex:
+    """
+    Process-wide matrix of normalized FAQ embeddings, one row per FAQ question
+    and per FAQVariant phrasing, row-aligned with the ids of the FAQs they answer.
+
+    Writes in this process are applied incrementally through the FAQ signals;
+    writes in other processes are noticed through the IndexVersion stamp, which
+    is read at most once per CHATBOT_INDEX_CHECK_INTERVAL seconds. Nearest-neighbour
+    search is delegated to the backend configured in CHATBOT_RETRIEVAL; a BM25
+    inverted index over question and answer text is kept alongside it for the
+    hybrid modes configured in CHATBOT_HYBRID, and rows are partitioned by FAQ
+    category for the routing configured in CHATBOT_CATEGORY_ROUTING.
+    """
+
+    def __init__(self, key=FAQ_INDEX_KEY):
+        self.key = key
+        self.version = None
+        self.model_name = None
+        self._lock = threading.RLock()
+        self._checked_at = 0.0
+        self._stale = True
+        # (ids, matrix, backend, partitions, tombstoned rows) is replaced as a whole so readers
+        # never see a half-applied update
+        self._snapshot = (np.empty(0, dtype=np.int64), None, None, None, 0)
+        self._rows = RowBuffer(np.empty(0, dtype=np.int64), np.empty(0, dtype=object))
+        # Row key per position, None for a tombstone
+        self._keys = []
+        self._positions = {}
+        self._faqs = {}
+        self._phrasings = {}
+        self._variant_faqs = {}
+        self._lexical = BM25Index()
+
+    def __len__(self):
+        return len(self._snapshot[0]) - self._snapshot[4]
+
+    @property
+    def is_stale(self):
+        return self._stale
+
+    # ----------------- Loading -----------------
+    def ensure_fresh(self):
+        interval = getattr(settings, 'CHATBOT_INDEX_CHECK_INTERVAL', 1.0)
+        now = time.monotonic()
+        if not self._stale and now - self._checked_at < interval:
+            return
+        self._checked_at = now
+        with span('index_check'):
+            stale = self._stale or current_version(self.key) != self.version
+        if stale:
+            with span('index_reload'):
+                self.reload()
+
+    def reload(self):
+        with self._lock:
+            # Read the stamp first: a write racing with the load bumps it again and forces another reload
+            version, model_name = current_state(self.key)
+            # An unstamped index is read as the model its rows record; seeding the stamp is left to writes
+            model_name = model_name or rows_model_name()
+            # Embeddings are read separately: from the shared store where it is current, else from the DB
+            faqs = list(FAQ.objects.defer('embedding', 'next_embedding'))
+            categories_by_faq = {faq.id: faq.category for faq in faqs}
+            variants = [variant for variant in FAQVariant.objects.defer('embedding', 'next_embedding')
+                        if variant.faq_id in categories_by_faq]
+
+            keys, ids, base, tail = self._load_matrix(faqs, variants, model_name)
+            categories = np.array([categories_by_faq.get(faq_id) for faq_id in ids.tolist()], dtype=object)
+
+            lexical = BM25Index()
+            for faq in faqs:
+                lexical.add(faq.id, _lexical_text(faq))
+
+            phrasings = {}
+            for variant in variants:
+                phrasings.setdefault(variant.faq_id, {})[variant.id] = variant.question
+
+            self._faqs = {faq.id: _index_copy(faq) for faq in faqs}
+            self._phrasings = phrasings
+            self._variant_faqs = {variant.id: variant.faq_id for variant in variants}
+            self._lexical = lexical
+            self._keys = keys
+            self._positions = {key: pos for pos, key in enumerate(keys) if key is not None}
+            self._rows = RowBuffer(ids, categories, base=base, tail=tail)
+            self._publish()
+            self.version = version
+            self.model_name = model_name
+            self._stale = False
+
+    def _load_matrix(self, faqs, variants, model_name):
+        """
+        Return (row keys, FAQ id per row, base, tail) for the given FAQs and
+        variants, whose embeddings come from `model_name`: the rows' matrix is
+        the read-only `base` followed by the private `tail`, either may be None.
+
+        Rows whose phrasing is unchanged since the embedding store was written
+        come from the mapped store file, which is used as is, so its pages stay
+        shared with the other workers: its stale rows are tombstoned (key None,
+        FAQ id DEAD_ROW) and the remaining rows, read from the database, are
+        stacked after it. Only a store with more than MAX_DEAD_ROWS stale rows
+        is copied instead.
+        """
+        rows = {(FAQ_ROW, faq.id): (faq.id, faq.question) for faq in faqs}
+        rows.update({(VARIANT_ROW, variant.id): (variant.faq_id, variant.question) for variant in variants})
+        if not rows:
+            return [], np.empty(0, dtype=np.int64), None, None
+
+        mapped = self._open_store(model_name)
+        mapped_keys = []
+        if mapped is not None:
+            for key, faq_id, question_hash in zip(mapped.keys(), mapped.faq_ids.tolist(), mapped.hashes.tolist()):
+                row = rows.get(key)
+                fresh = row is not None and row[0] == faq_id and text_hash(row[1]) == question_hash
+                mapped_keys.append(key if fresh else None)
+
+        reused = set(mapped_keys)
+        reused.discard(None)
+        stale = len(mapped_keys) - len(reused)
+        if mapped is not None and stale > MAX_DEAD_ROWS:
+            logger.info("Embedding store has %d stale rows; copying the %d current ones", stale, len(reused))
+        vectors = self._read_embeddings([key for key in rows if key not in reused], rows, model_name,
+                                        everything=mapped is None)
+        # Rows deleted since the FAQs were listed have no embedding and are left out
+        new_keys = [key for key in rows if key in vectors]
+        if mapped is not None and (new_keys or stale):
+            logger.info("Embedding store covers %d of %d index rows; rebuild it to share the rest",
+                        len(reused), len(rows))
+
+        keys = mapped_keys + new_keys
+        if not reused and not new_keys:
+            return [], np.empty(0, dtype=np.int64), None, None
+        ids = np.array([rows[key][0] if key is not None else DEAD_ROW for key in keys], dtype=np.int64)
+        tail = _normalize(np.vstack([vectors[key] for key in new_keys])) if new_keys else None
+        if mapped is None:
+            return keys, ids, None, tail
+        if stale > MAX_DEAD_ROWS:
+            # Scanning that many dead rows would cost more than one private copy of the live ones
+            live = np.flatnonzero(ids != DEAD_ROW)
+            head = np.asarray(mapped.matrix[live], dtype=EMBEDDING_DTYPE)
+            keys = [keys[pos] for pos in live.tolist()]
+            return keys, ids[live], None, head if tail is None else np.vstack([head, tail])
+        return keys, ids, mapped.matrix, tail
+
+    def _open_store(self, model_name):
+        store = get_embedding_store()
+        mapped = store.open() if store is not None else None
+        if mapped is not None and model_name and mapped.model not in (None, model_name):
+            logger.warning("Ignoring embedding store built with %s; the index uses %s", mapped.model, model_name)
+            return None
+        return mapped
+
+    def _read_embeddings(self, keys, rows, model_name, everything=False):
+        # {key: vector} of the stored embeddings for `keys`; rows saved without the
+        # pre_save signal (bulk inserts, raw SQL) have none yet and are embedded once
+        # here, or left out and queued for the embedding worker when it is enabled.
+        # So are rows that record another model, whose vectors cannot share the matrix.
+        from .jobs import enqueue
+
+        vectors = {}
+        for kind, model in ((FAQ_ROW, FAQ), (VARIANT_ROW, FAQVariant)):
+            pks = [pk for row_kind, pk in keys if row_kind == kind]
+            if not pks:
+                continue
+            if everything:
+                stored = model.objects.values_list('pk', 'embedding', 'embedding_model').iterator()
+            else:
+                stored = (item for start in range(0, len(pks), 500)
+                          for item in model.objects.filter(pk__in=pks[start:start + 500])
+                                                   .values_list('pk', 'embedding', 'embedding_model'))
+            missing, foreign = [], 0
+            for pk, embedding, row_model in stored:
+                if (kind, pk) not in rows:
+                    continue
+                if embedding is None:
+                    missing.append(pk)
+                elif model_name and row_model and row_model != model_name:
+                    missing.append(pk)
+                    foreign += 1
+                else:
+                    vectors[(kind, pk)] = from_bytes(embedding)
+            if foreign:
+                logger.warning("%d %s rows are embedded with another model than %s; re-embedding them",
+                               foreign, kind, model_name)
+            if missing and queue_enabled():
+                enqueue(kind, missing, refresh=False)
+            elif missing:
+                # Rows not embedded yet fix the model of an index that has none
+                model_name = model_name or recorded_model_name()
+                encoded = encode([rows[(kind, pk)][1] for pk in missing], model=get_model(model_name))
+                model.objects.bulk_update([model(pk=pk, embedding=to_bytes(vector), embedding_model=model_name)
+                                           for pk, vector in zip(missing, encoded)],
+                                          ['embedding', 'embedding_model'])
+                for pk, vector in zip(missing, encoded):
+                    vectors[(kind, pk)] = vector
+        return vectors
+
+    def _publish(self, previous=None, grow=False):
+        # Swap in a snapshot of the current rows. With `grow`, rows were only added or
+        # tombstoned since `previous` was built, so it is extended rather than rebuilt.
+        ids, matrix, categories = self._rows.view()
+        if grow and previous is not None and previous.matrix is not None and matrix is not None:
+            backend = previous.grow(matrix)
+        else:
+            backend = create_backend()
+            backend.build(matrix, previous=previous)
+        self._snapshot = (ids, matrix, backend, CategoryPartitions(matrix, categories), self._rows.dead)
+
+    def invalidate(self):
+        self._stale = True
+
+    # ----------------- Incremental updates -----------------
+    def _advance(self, version):
+        # Only a direct successor of our own version can be applied incrementally
+        if self.version is None or version != self.version + 1:
+            self._stale = True
+        self.version = version
+
+    def _put_row(self, key, faq_id, embedding):
+        # Appends the row for `key`, tombstoning the one it replaces
+        vector = _normalize(from_bytes(embedding))
+        if self._rows.dim not in (None, len(vector)):
+            # Embedded with another model than the loaded rows; only a reload can switch
+            self._stale = True
+            return
+        pos = self._positions.get(key)
+        if pos is not None:
+            if self._rows.view()[0][pos] == faq_id and np.array_equal(self._rows.row(pos), vector):
+                return
+            self._kill([pos])
+        self._positions[key] = self._rows.append(faq_id, self._faqs[faq_id].category, vector)
+        self._keys.append(key)
+
+    def _kill(self, positions):
+        self._rows.kill(positions)
+        for pos in positions:
+            self._positions.pop(self._keys[pos], None)
+            self._keys[pos] = None
+
+    def _apply(self):
+        # Publish this process's writes: the backend is extended, or rebuilt once
+        # the tombstones are many enough to compact
+        previous = self._snapshot[2]
+        if self._rows.dead <= MAX_DEAD_ROWS:
+            self._publish(previous, grow=True)
+            return
+        self._rows, live = self._rows.compacted()
+        self._keys = [self._keys[pos] for pos in live.tolist()]
+        self._positions = {key: pos for pos, key in enumerate(self._keys)}
+        self._publish(previous)
+
+    def upsert(self, faq, version):
+        if faq.embedding is None and not queue_enabled():
+            self.invalidate()
+            return
+        with self._lock:
+            self._advance(version)
+            if self._stale:
+                return
+            self._faqs[faq.id] = _index_copy(faq)
+            self._lexical.add(faq.id, _lexical_text(faq))
+            # Variant rows share their FAQ's category
+            self._rows.set_category(faq.id, faq.category)
+            # Without an embedding it is queued for the worker; only the lexical index can find it meanwhile
+            if faq.embedding is not None:
+                self._put_row((FAQ_ROW, faq.id), faq.id, faq.embedding)
+            if not self._stale:
+                self._apply()
+
+    def upsert_variant(self, variant, version):
+        if (variant.embedding is None and not queue_enabled()) or variant.faq_id not in self._faqs:
+            self.invalidate()
+            return
+        with self._lock:
+            self._advance(version)
+            if self._stale:
+                return
+            self._forget_variant(variant.id)
+            self._variant_faqs[variant.id] = variant.faq_id
+            self._phrasings.setdefault(variant.faq_id, {})[variant.id] = variant.question
+            if variant.embedding is None:
+                return
+            self._put_row((VARIANT_ROW, variant.id), variant.faq_id, variant.embedding)
+            if not self._stale:
+                self._apply()
+
+    def remove(self, faq_id, version):
+        with self._lock:
+            self._advance(version)
+            if self._stale:
+                return
+            self._faqs.pop(faq_id, None)
+            self._phrasings.pop(faq_id, None)
+            self._lexical.remove(faq_id)
+            # The FAQ's own row and any variant rows whose deletion has not been applied yet
+            positions = np.flatnonzero(self._rows.view()[0] == faq_id).tolist()
+            if positions:
+                self._kill(positions)
+                self._apply()
+
+    def _forget_variant(self, variant_id):
+        faq_id = self._variant_faqs.pop(variant_id, None)
+        if faq_id in self._phrasings:
+            self._phrasings[faq_id].pop(variant_id, None)
+
+    def remove_variant(self, variant_id, version):
+        with self._lock:
+            self._advance(version)
+            if self._stale:
+                return
+            self._forget_variant(variant_id)
+            pos = self._positions.get((VARIANT_ROW, variant_id))
+            if pos is not None:
+                self._kill([pos])
+                self._apply()
+
+    # ----------------- Matching -----------------
+    def get(self, faq_id):
+        return self._faqs.get(faq_id)
+
+    def search(self, query_vector, text=None, category=None):
+        """Return (faq, cosine score) of the best match, or (None, 0.0) when the index is empty."""
+        return self.search_many(np.asarray(query_vector)[np.newaxis, :], None if text is None else [text],
+                                category=category)[0]
+
+    def search_many(self, query_vectors, texts=None, category=None):
+        """Best (faq, cosine score) for each row of `query_vectors`, or (None, 0.0) where nothing matched."""
+        return [ranked[0] if ranked else (None, 0.0)
+                for ranked in self.rank_many(query_vectors, k=1, texts=texts, category=category)]
+
+    def rank_many(self, query_vectors, k=1, texts=None, category=None):
+        """
+        Up to k (faq, cosine score) pairs for each row of `query_vectors`, best
+        first and one per FAQ, scored in one batch.
+
+        When the question `texts` are given and CHATBOT_HYBRID['MODE'] is 'rerank'
+        or 'rrf', BM25 candidates narrow or re-rank the semantic search.
+
+        With a `category`, or with CHATBOT_CATEGORY_ROUTING['AUTO'] and a clear
+        closest category centroid, only that category's rows are scored; a best
+        score below FALLBACK_SCORE falls back to the whole index.
+        """
+        self.ensure_fresh()
+        ids, matrix, backend, partitions, dead = self._snapshot
+        if matrix is None:
+            return [[] for _ in range(len(query_vectors))]
+
+        queries = _normalize(np.asarray(query_vectors, dtype=EMBEDDING_DTYPE))
+        # Enough rows to still find k distinct FAQs when some rows are variants of the same FAQ or tombstones
+        row_k = k * -(-(len(ids) - dead) // max(len(self._faqs), 1)) + dead
+        results = [None] * len(queries)
+        pending = self._search_partitions(queries, category, k, row_k, ids, partitions, results)
+
+        if pending:
+            mode = _hybrid_config().get('MODE', 'off')
+            if texts is not None and mode in ('rerank', 'rrf'):
+                for i in pending:
+                    results[i] = self._hybrid_search(queries[i], texts[i], mode, k, row_k, ids, matrix, backend)
+            else:
+                for i, positions, scores in zip(pending, *backend.search_many(queries[pending], k=row_k)):
+                    results[i] = pool_by_faq(ids, positions, scores, k)
+
+        return [[(self._faqs[faq_id], float(score)) for faq_id, score in ranked if faq_id in self._faqs]
+                for ranked in results]
+
+    def _search_partitions(self, queries, category, k, row_k, ids, partitions, results):
+        # Fills `results` for queries settled inside one category; returns the indices left for the full index
+        config = _routing_config()
+        if category is not None:
+            routes = [category] * len(queries)
+        elif config.get('AUTO', False):
+            routes = partitions.classify(queries, config.get('MIN_MARGIN', 0.05))
+        else:
+            return list(range(len(queries)))
+
+        fallback_score = config.get('FALLBACK_SCORE', 0.6)
+        pending = []
+        for i, (query, route) in enumerate(zip(queries, routes)):
+            found = partitions.search(query, route, k=row_k) if route is not None else None
+            ranked = pool_by_faq(ids, *found, k) if found is not None else []
+            if not ranked or ranked[0][1] < fallback_score:
+                pending.append(i)
+            else:
+                results[i] = ranked
+        return pending
+
+    def _lexical_candidates(self, text, n, ids):
+        # FAQ ids of the BM25 hits that are present in this snapshot
+        candidates = []
+        for faq_id, _, _ in self._lexical.search(text, k=n):
+            pos = self._positions.get((FAQ_ROW, faq_id))
+            # Skip rows written after this snapshot was taken
+            if pos is not None and pos < len(ids) and ids[pos] == faq_id:
+                candidates.append(faq_id)
+        return candidates
+
+    def _hybrid_search(self, query, text, mode, k, row_k, ids, matrix, backend):
+        config = _hybrid_config()
+        n = config.get('CANDIDATES', 50)
+        candidates = self._lexical_candidates(text, n, ids)
+
+        if mode == 'rerank':
+            if not candidates:
+                # No keyword overlap at all: fall back to the full semantic search
+                positions, scores = backend.search(query, k=row_k)
+                return pool_by_faq(ids, positions, scores, k)
+            # Every row of the candidate FAQs, so a variant can carry its FAQ
+            rows = np.flatnonzero(np.isin(ids, candidates))
+            scores = matrix[rows] @ query
+            order = np.argsort(-scores, kind='stable')
+            return pool_by_faq(ids, rows[order], scores[order], k)
+
+        # Reciprocal rank fusion of the semantic and lexical rankings
+        rrf_k = config.get('RRF_K', 60)
+        semantic_positions, semantic_scores = backend.search(query, k=max(n, row_k))
+        semantic = pool_by_faq(ids, semantic_positions, semantic_scores)
+        fused = {}
+        for ranking in ([faq_id for faq_id, _ in semantic], candidates):
+            for rank, faq_id in enumerate(ranking):
+                fused[faq_id] = fused.get(faq_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+        best = sorted(fused, key=fused.get, reverse=True)[:k]
+        # Thresholds still apply to the semantic similarity of the fused winners
+        return [(faq_id, float(np.max(matrix[ids == faq_id] @ query))) for faq_id in best]
+
+    def phrasings(self, faq_id):
+        """The FAQ's question followed by its variant phrasings."""
+        faq = self._faqs.get(faq_id)
+        if faq is None:
+            return []
+        return [faq.question, *self._phrasings.get(faq_id, {}).values()]
+
+    def lexical_match(self, text, category=None):
+        """
+        A keyword hit confident enough to answer without encoding the question,
+        only among the FAQs of `category` when one is given.
+
+        Returns (faq, normalized BM25 score) when the best hit reaches
+        SHORTCIRCUIT_SCORE and beats the runner-up by SHORTCIRCUIT_MARGIN, else None.
+        """
+        self.ensure_fresh()
+        config = _hybrid_config()
+        faqs = self._faqs
+        hits = self._lexical.search(text, k=2, where=None if category is None else (
+            lambda faq_id: faq_id in faqs and faqs[faq_id].category == category))
+        if not hits:
+            return None
+        faq_id, score, normalized = hits[0]
+        if normalized < config.get('SHORTCIRCUIT_SCORE', 0.9):
+            return None
+        if len(hits) > 1 and score < hits[1][1] * config.get('SHORTCIRCUIT_MARGIN', 1.5):
+            return None
+        faq = self._faqs.get(faq_id)
+        return (faq, normalized) if faq is not None else None
+
+
+faq_index = FAQIndex()
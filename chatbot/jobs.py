@@ -0,0 +1,229 @@
+import logging
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import FAQ, EmbeddingJob, FAQVariant, IndexVersion
+
+logger = logging.getLogger(__name__)
+
+# Job kinds, matching the FAQ index's row keys
+JOB_MODELS = {'faq': FAQ, 'variant': FAQVariant}
+
+
+def _queue_config():
+    return getattr(settings, 'CHATBOT_EMBEDDING_QUEUE', {})
+
+
+def queue_enabled():
+    return _queue_config().get('ENABLED', False)
+
+
+def enqueue(kind, pks, refresh=True):
+    """
+    Ask the embedding worker to (re)embed the `kind` rows `pks`.
+
+    A row already waiting keeps a single job: with `refresh` its request time is
+    moved forward, so a worker busy with the older text will not mark it done.
+    """
+    if not pks:
+        return
+    now = timezone.now()
+    jobs = [EmbeddingJob(kind=kind, object_id=pk, requested_at=now) for pk in pks]
+    if refresh:
+        EmbeddingJob.objects.bulk_create(jobs, update_conflicts=True, unique_fields=['kind', 'object_id'],
+                                         update_fields=['requested_at'])
+    else:
+        EmbeddingJob.objects.bulk_create(jobs, ignore_conflicts=True)
+
+
+def _state():
+    from .index import FAQ_INDEX_KEY
+
+    return IndexVersion.objects.get_or_create(key=FAQ_INDEX_KEY)[0]
+
+
+def _lock_state():
+    """The FAQ index stamp row, locked for the rest of the transaction where the database supports it."""
+    return IndexVersion.objects.select_for_update().get(pk=_state().pk)
+
+
+def _models(state):
+    """(active model or '' before the first embedding, model being migrated to or '') recorded in the stamp row."""
+    return state.embedding_model, state.next_embedding_model
+
+
+class EmbeddingWorker:
+    """
+    Drains the EmbeddingJob queue and keeps the corpus embedded with the configured model.
+
+    Each step claims up to `batch_size` jobs under a lease, encodes their current
+    text in one call and writes the vectors only if the text is still the one
+    encoded, so an edit made meanwhile is simply picked up again by its new job.
+
+    When CHATBOT_EMBEDDING_MODEL differs from the model the index uses, rows are
+    re-embedded into `next_embedding` in the background. Once every row has one,
+    a single transaction swaps them in and records the new model, so the web
+    processes go from one consistent index straight to the other.
+    """
+
+    def __init__(self, batch_size=64, lease_seconds=300):
+        self.batch_size = batch_size
+        self.lease = timedelta(seconds=lease_seconds)
+        # Encoder for the migration target, kept apart from the process-wide active one
+        self._next_encoder = None
+
+    def _encode(self, texts, model_name, active):
+        from .embeddings import encode, get_model, load_model
+
+        if active:
+            return encode(texts, model=get_model(model_name))
+        if self._next_encoder is None or self._next_encoder[0] != model_name:
+            self._next_encoder = (model_name, load_model(model_name))
+        return encode(texts, model=self._next_encoder[1])
+
+    def step(self):
+        """Handle one batch of queued rows, else one batch of migration; returns the number of rows handled."""
+        return self.process_jobs() or self.migrate()
+
+    # ----------------- Queued rows -----------------
+    def _claim(self):
+        now = timezone.now()
+        with transaction.atomic():
+            jobs = list(EmbeddingJob.objects.select_for_update(skip_locked=True)
+                        .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+                        .order_by('requested_at')[:self.batch_size])
+            EmbeddingJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                locked_until=now + self.lease, attempts=F('attempts') + 1)
+        return jobs
+
+    def process_jobs(self):
+        from .embeddings import to_bytes
+        from .index import recorded_model_name
+        from .signals import faqs_changed_in_bulk
+
+        jobs = self._claim()
+        if not jobs:
+            return 0
+        job_pks = [job.pk for job in jobs]
+        active, target = _models(_state())
+        if not active:
+            # The first embedding of an unstamped index fixes its model
+            active = recorded_model_name()
+
+        rows = []
+        for kind, model in JOB_MODELS.items():
+            pks = [job.object_id for job in jobs if job.kind == kind]
+            if pks:
+                rows += [(model, pk, question)
+                         for pk, question in model.objects.filter(pk__in=pks).values_list('pk', 'question')]
+        texts = [question for _, _, question in rows]
+        try:
+            vectors = self._encode(texts, active, active=True) if rows else []
+            # During a migration the new model's vector is made too, so the row is not re-done later
+            next_vectors = self._encode(texts, target, active=False) if rows and target else [None] * len(rows)
+        except Exception as exc:
+            # The lease keeps the batch from being retried at once
+            logger.exception("Embedding %d queued rows failed", len(rows))
+            EmbeddingJob.objects.filter(pk__in=job_pks).update(last_error=str(exc)[:2000])
+            return 0
+
+        with transaction.atomic():
+            if _models(_lock_state()) != (active, target):
+                # The model changed while encoding; release the batch to be encoded again
+                EmbeddingJob.objects.filter(pk__in=job_pks).update(locked_until=None)
+                return len(jobs)
+            updated = 0
+            for (model, pk, question), vector, next_vector in zip(rows, vectors, next_vectors):
+                # Only if the text is still what was encoded; an edit since then has queued the row again
+                updated += model.objects.filter(pk=pk, question=question).update(
+                    embedding=to_bytes(vector),
+                    embedding_model=active,
+                    next_embedding=None if next_vector is None else to_bytes(next_vector),
+                )
+            EmbeddingJob.objects.filter(
+                reduce(or_, (Q(pk=job.pk, requested_at=job.requested_at) for job in jobs))).delete()
+            # Jobs requested again while this batch was encoded are left for the next one
+            EmbeddingJob.objects.filter(pk__in=job_pks).update(locked_until=None)
+            if updated:
+                faqs_changed_in_bulk()
+        logger.info("Embedded %d queued rows with %s", updated, active)
+        return len(jobs)
+
+    # ----------------- Model migration -----------------
+    def _reset_migration(self, state, target):
+        for model in JOB_MODELS.values():
+            model.objects.filter(next_embedding__isnull=False).update(next_embedding=None)
+        state.next_embedding_model = target
+        state.save(update_fields=['next_embedding_model'])
+
+    def migrate(self):
+        from .embeddings import configured_model_name, to_bytes
+        from .index import rows_model_name
+
+        configured = configured_model_name()
+        with transaction.atomic():
+            state = _lock_state()
+            if not state.embedding_model:
+                # Stamped from what the rows record, never from the setting, which may already have moved on
+                state.embedding_model = rows_model_name()
+                if not state.embedding_model:
+                    # Nothing embedded yet; the first embedding stamps the index
+                    return 0
+                state.save(update_fields=['embedding_model'])
+            if state.embedding_model == configured:
+                if state.next_embedding_model:
+                    # The setting went back before the migration finished
+                    self._reset_migration(state, '')
+                return 0
+            if state.next_embedding_model != configured:
+                logger.info("Re-embedding FAQs for %s (index uses %s)", configured, state.embedding_model)
+                self._reset_migration(state, configured)
+
+        rows = []
+        for model in JOB_MODELS.values():
+            if len(rows) < self.batch_size:
+                rows += [(model, pk, question) for pk, question in
+                         model.objects.filter(next_embedding__isnull=True).order_by('pk')
+                         .values_list('pk', 'question')[:self.batch_size - len(rows)]]
+        if not rows:
+            self._switch(configured)
+            return 0
+
+        vectors = self._encode([question for _, _, question in rows], configured, active=False)
+        with transaction.atomic():
+            if _lock_state().next_embedding_model != configured:
+                return len(rows)
+            for (model, pk, question), vector in zip(rows, vectors):
+                model.objects.filter(pk=pk, question=question).update(next_embedding=to_bytes(vector))
+        return len(rows)
+
+    def _switch(self, model_name):
+        from .index import current_version
+        from .signals import faqs_changed_in_bulk
+        from .store import export_embeddings, get_embedding_store
+
+        with transaction.atomic():
+            state = _lock_state()
+            if state.next_embedding_model != model_name or any(
+                    model.objects.filter(next_embedding__isnull=True).exists() for model in JOB_MODELS.values()):
+                return
+            for kind, model in JOB_MODELS.items():
+                model.objects.filter(next_embedding__isnull=False).update(
+                    embedding=F('next_embedding'), embedding_model=model_name, next_embedding=None)
+                # Rows edited during the switch still hold an old-model vector; queue them again
+                enqueue(kind, list(model.objects.exclude(embedding_model=model_name).values_list('pk', flat=True)))
+            state.embedding_model = model_name
+            state.next_embedding_model = ''
+            state.save(update_fields=['embedding_model', 'next_embedding_model'])
+            faqs_changed_in_bulk()
+            store = get_embedding_store()
+            if store is not None:
+                export_embeddings(store, index_version=current_version())
+        self._next_encoder = None
+        logger.info("FAQ index switched to %s", model_name)
@@ -0,0 +1,99 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+
+_TOKEN = re.compile(r'\w+')
+
+# Words that would put almost every FAQ into every candidate set
+STOPWORDS = frozenset("""
+    a an and are as at be by can do does for from how i if in is it me my of on or our
+    the to was what when where which who why will with you your
+""".split())
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall(text.casefold()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Token inverted index with Okapi BM25 scoring, updated one document at a time.
+
+    Only the postings of the query's terms are visited, so a query with
+    distinctive words (course codes, building or form names) touches a handful
+    of documents however large the corpus is.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._doc_terms = {}
+        self._lengths = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, doc_id, text):
+        with self._lock:
+            self.remove(doc_id)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+            self._doc_terms[doc_id] = tuple(counts)
+            length = sum(counts.values())
+            self._lengths[doc_id] = length
+            self._total_length += length
+
+    def remove(self, doc_id):
+        with self._lock:
+            length = self._lengths.pop(doc_id, None)
+            if length is None:
+                return
+            self._total_length -= length
+            for term in self._doc_terms.pop(doc_id):
+                docs = self._postings[term]
+                del docs[doc_id]
+                if not docs:
+                    del self._postings[term]
+
+    def _idf(self, term):
+        df = len(self._postings.get(term, ()))
+        n = len(self._lengths)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, text, k=10, where=None):
+        """
+        Return up to k (doc_id, score, normalized score) tuples, best first,
+        among the documents for which `where(doc_id)` is true when it is given.
+
+        The normalized score divides by the score of a document of average
+        length containing every query term once, capped at 1, so it is
+        comparable between queries. Query terms missing from the corpus still
+        count towards that maximum, so unmatched words lower confidence.
+        """
+        terms = set(tokenize(text))
+        with self._lock:
+            if not terms or not self._lengths:
+                return []
+            average_length = self._total_length / len(self._lengths) or 1.0
+            scores = {}
+            best_possible = 0.0
+            for term in terms:
+                idf = self._idf(term)
+                best_possible += idf
+                docs = self._postings.get(term)
+                if not docs:
+                    continue
+                for doc_id, tf in docs.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if where is not None:
+            scores = {doc_id: score for doc_id, score in scores.items() if where(doc_id)}
+        ranked = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(doc_id, score, min(1.0, score / best_possible)) for doc_id, score in ranked]
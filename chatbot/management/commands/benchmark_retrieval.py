@@ -0,0 +1,55 @@
+import json
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.benchmarks import compare_backends, perturbed_queries, synthetic_embeddings
+from chatbot.embeddings import from_bytes
+from chatbot.models import FAQ
+from chatbot.retrieval import IVFBackend
+
+
+class Command(BaseCommand):
+    help = "Compare approximate retrieval backends with exact search (latency and recall@k)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=0, metavar='N',
+                            help="Benchmark N synthetic embeddings instead of the stored FAQ embeddings.")
+        parser.add_argument('--queries', type=int, default=200, help="Number of queries to run.")
+        parser.add_argument('-k', type=int, default=5, help="Depth of the recall@k measurement.")
+        parser.add_argument('--nlist', type=int, default=64, help="IVF cluster count.")
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16],
+                            help="IVF probe counts to sweep.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        if options['synthetic']:
+            matrix = synthetic_embeddings(options['synthetic'])
+        else:
+            rows = FAQ.objects.exclude(embedding__isnull=True).values_list('embedding', flat=True)
+            vectors = [from_bytes(row) for row in rows.iterator()]
+            if not vectors:
+                raise CommandError("No stored FAQ embeddings; run rebuild_faq_embeddings or use --synthetic N.")
+            matrix = np.vstack(vectors)
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+        queries, _ = perturbed_queries(matrix, options['queries'])
+        nlist = min(options['nlist'], len(matrix))
+        backends = [
+            (f'ivf(nlist={nlist},nprobe={nprobe})', IVFBackend(nlist=nlist, nprobe=nprobe, min_train_size=0))
+            for nprobe in options['nprobe']
+        ]
+        report = compare_backends(matrix, queries, backends, k=options['k'])
+
+        if options['json']:
+            self.stdout.write(json.dumps({'rows': len(matrix), 'results': report}, indent=2))
+            return
+
+        k = options['k']
+        self.stdout.write(f"{len(matrix)} rows, {len(queries)} queries")
+        for result in report:
+            self.stdout.write(
+                f"{result['backend']:<28} build {result['build_s']:7.2f}s  "
+                f"p50 {result['p50_ms']:7.3f}ms  p95 {result['p95_ms']:7.3f}ms  "
+                f"recall@1 {result['recall@1']:.3f}  recall@{k} {result[f'recall@{k}']:.3f}"
+            )
@@ -0,0 +1,145 @@
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from chatbot.benchmarks import (
+    CACHE_MODES, default_backends, measure_encoding, measure_endpoint, measure_retrieval, paraphrase_queries,
+    rss_mb, synthetic_faqs,
+)
+
+
+class Command(BaseCommand):
+    help = ("Benchmark encoding, retrieval and the /api/chatbot/ endpoint on synthetic FAQ corpora "
+            "with labelled paraphrase queries, and print the results as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                            help="Corpus sizes (number of FAQs) to benchmark.")
+        parser.add_argument('--queries', type=int, default=200, help="Paraphrase queries per corpus.")
+        parser.add_argument('-k', type=int, default=5, help="Depth of the recall@k measurement.")
+        parser.add_argument('--backends', nargs='+', default=['brute', 'ivf'], choices=['brute', 'ivf'],
+                            help="Retrieval backends to benchmark.")
+        parser.add_argument('--cache-modes', nargs='+', default=list(CACHE_MODES), choices=list(CACHE_MODES),
+                            help="Answer/semantic cache combinations for the endpoint runs.")
+        parser.add_argument('--passes', type=int, default=2,
+                            help="Times the query set is sent to the endpoint; later passes exercise the caches.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the query sample.")
+        parser.add_argument('--skip-endpoint', action='store_true', help="Only measure encoding and retrieval.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        report = {'environment': self._environment(), 'options': {
+            key: options[key] for key in ('sizes', 'queries', 'k', 'backends', 'cache_modes', 'passes', 'seed')
+        }, 'results': []}
+
+        # The corpora are loaded into a throwaway test database, never the real one
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for size in options['sizes']:
+                self.stderr.write(f"Benchmarking {size} FAQs...")
+                report['results'].append(self._run_size(size, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+            self.stderr.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    def _environment(self):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                                    text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': __import__('os').cpu_count(),
+            'model': getattr(settings, 'CHATBOT_EMBEDDING_MODEL', None),
+            'encoder': getattr(settings, 'CHATBOT_ENCODER', {}).get('BACKEND', 'torch'),
+        }
+
+    def _run_size(self, size, options):
+        from chatbot.cache import get_answer_cache, get_semantic_cache
+        from chatbot.embeddings import to_bytes
+        from chatbot.index import faq_index, recorded_model_name
+        from chatbot.models import FAQ, FAQVariant
+        from chatbot.retrieval import create_backend
+        from chatbot.signals import faqs_changed_in_bulk
+
+        k = options['k']
+        faqs = synthetic_faqs(size)
+        queries = paraphrase_queries(size, options['queries'], seed=options['seed'])
+        targets = [target for _, target in queries]
+        backends = {name: config for name, config in default_backends(size).items() if name in options['backends']}
+
+        encoding, matrix, query_vectors = measure_encoding([faq['question'] for faq in faqs], queries)
+        result = {
+            'faqs': size,
+            'queries': len(queries),
+            'encode': encoding,
+            'retrieval': {name: measure_retrieval(matrix, query_vectors, targets, create_backend(config), k)
+                          for name, config in backends.items()},
+            'memory': {'matrix_mb': matrix.nbytes / 2 ** 20},
+        }
+        if options['skip_endpoint']:
+            result['memory']['rss_mb'] = rss_mb()
+            return result
+
+        FAQVariant.objects.all().delete()
+        FAQ.objects.all().delete()
+        model_name = recorded_model_name()
+        FAQ.objects.bulk_create(
+            [FAQ(**faq, embedding=to_bytes(vector), embedding_model=model_name) for faq, vector in zip(faqs, matrix)],
+            batch_size=2000,
+        )
+        faqs_changed_in_bulk()
+        faq_ids = list(FAQ.objects.order_by('pk').values_list('pk', flat=True))
+
+        ranking = {**getattr(settings, 'CHATBOT_RANKING', {}), 'ALTERNATIVES': k - 1,
+                   'ALTERNATIVE_THRESHOLD': float('-inf')}
+        ranking['TOP_K'] = max(ranking.get('TOP_K', 5), k)
+        client = Client()
+        endpoint = {}
+        for name, config in backends.items():
+            for mode in options['cache_modes']:
+                with override_settings(CHATBOT_RETRIEVAL=config, CHATBOT_RANKING=ranking,
+                                       CHATBOT_EMBEDDING_STORE={'PATH': None}, CHATBOT_QUERY_LOG={'ENABLED': False},
+                                       **CACHE_MODES[mode]):
+                    for cache in (get_answer_cache(), get_semantic_cache()):
+                        if cache is not None:
+                            cache.clear()
+                    if 'index_peak_mb' not in result['memory']:
+                        tracemalloc.start()
+                        faq_index.reload()
+                        result['memory']['index_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                        tracemalloc.stop()
+                    started = time.perf_counter()
+                    faq_index.reload()
+                    reload_s = time.perf_counter() - started
+                    endpoint[f'{name}/{mode}'] = {
+                        'backend': name,
+                        'cache_mode': mode,
+                        'index_reload_s': reload_s,
+                        **measure_endpoint(client, queries, faq_ids, k=k, passes=options['passes']),
+                    }
+        result['endpoint'] = endpoint
+        result['memory']['rss_mb'] = rss_mb()
+        return result
@@ -0,0 +1,93 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.embeddings import ENCODER_BACKENDS, encode, load_model
+from chatbot.models import FAQ
+
+SAMPLE_QUESTIONS = [
+    "Where can I check the academic calendar?",
+    "Are laptops allowed in class?",
+    "What are the library hours?",
+    "How do I register for classes?",
+    "When are the exam results announced?",
+    "How can I pay the hostel fees?",
+]
+
+
+class Command(BaseCommand):
+    help = "Compare encoder backends against fp32 torch: embedding parity, latency and throughput."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', nargs='+', default=['int8', 'onnx'], choices=sorted(ENCODER_BACKENDS),
+                            help="Backends to compare with the fp32 torch reference.")
+        parser.add_argument('--limit', type=int, default=512,
+                            help="Maximum number of FAQ questions to encode (built-in samples if there are none).")
+        parser.add_argument('--repeat', type=int, default=3, help="Timing repetitions; the best run is reported.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        sentences = list(FAQ.objects.values_list('question', flat=True)[:options['limit']]) or SAMPLE_QUESTIONS
+
+        reference_model = load_model(backend='torch')
+        reference = encode(sentences, model=reference_model)
+        report = [self._measure('torch', reference_model, sentences, reference, options['repeat'])]
+
+        for backend in options['backends']:
+            if backend == 'torch':
+                continue
+            try:
+                model = load_model(backend=backend)
+            except ImportError as exc:
+                self.stderr.write(f"Skipping {backend}: {exc}")
+                continue
+            report.append(self._measure(backend, model, sentences, reference, options['repeat']))
+
+        if options['json']:
+            self.stdout.write(json.dumps({'sentences': len(sentences), 'results': report}, indent=2))
+            return
+
+        self.stdout.write(f"{len(sentences)} sentences")
+        for result in report:
+            self.stdout.write(
+                f"{result['backend']:<6} single p50 {result['single_p50_ms']:7.2f}ms  "
+                f"batch {result['throughput_per_s']:8.1f}/s  "
+                f"cosine vs fp32 mean {result['cosine_mean']:.4f} min {result['cosine_min']:.4f}  "
+                f"top-1 agreement {result['top1_agreement']:.3f}"
+            )
+
+    def _measure(self, name, model, sentences, reference, repeat):
+        if not len(sentences):
+            raise CommandError("Nothing to encode.")
+
+        batch_seconds = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            vectors = encode(sentences, model=model)
+            batch_seconds.append(time.perf_counter() - started)
+
+        single_seconds = []
+        for sentence in sentences[:64]:
+            started = time.perf_counter()
+            encode([sentence], model=model)
+            single_seconds.append(time.perf_counter() - started)
+
+        # Vectors are normalized, so the row-wise dot product is the cosine similarity
+        cosines = np.sum(vectors * reference, axis=1)
+        # Does each sentence still retrieve the same nearest neighbour among the fp32 vectors?
+        reference_scores = reference @ reference.T
+        candidate_scores = vectors @ reference.T
+        np.fill_diagonal(reference_scores, -np.inf)
+        np.fill_diagonal(candidate_scores, -np.inf)
+        agreement = np.mean(np.argmax(reference_scores, axis=1) == np.argmax(candidate_scores, axis=1))
+
+        return {
+            'backend': name,
+            'single_p50_ms': float(np.median(single_seconds) * 1000),
+            'throughput_per_s': len(sentences) / min(batch_seconds),
+            'cosine_mean': float(cosines.mean()),
+            'cosine_min': float(cosines.min()),
+            'top1_agreement': float(agreement) if len(sentences) > 1 else 1.0,
+        }
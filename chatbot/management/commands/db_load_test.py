@@ -0,0 +1,165 @@
+import json
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections, transaction
+from django.db.utils import load_backend
+
+from chatbot.benchmarks import latency_summary
+
+# Alias and table used only by this command, so the application's data is never touched
+ALIAS = 'db_load_test'
+TABLE = 'campusbot_db_load_test'
+
+
+def _connect(settings_dict):
+    # Registered under its own alias so transaction.atomic() can use it
+    wrapper = load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, ALIAS)
+    connections[ALIAS] = wrapper
+    return wrapper
+
+
+def _disconnect(wrapper):
+    wrapper.close()
+    if hasattr(wrapper, 'close_pool'):
+        wrapper.close_pool()
+    del connections[ALIAS]
+
+
+def _worker(role, number, settings_dict, n_rows, start, options):
+    """Run one writer or reader process until the deadline; returns (role, seconds or None, error or None) per op."""
+    wrapper = _connect(settings_dict)
+    rng = random.Random(options['seed'] * 1000 + number + (0 if role == 'write' else 500))
+    hold = options['hold_ms'] / 1000
+    results = []
+    try:
+        time.sleep(max(0.0, start - time.time()))
+        deadline = time.perf_counter() + options['duration']
+        while time.perf_counter() < deadline:
+            row = rng.randint(1, n_rows)
+            started = time.perf_counter()
+            try:
+                if role == 'write':
+                    # Shaped like a login: record a session row and bump a counter in one transaction
+                    with transaction.atomic(using=ALIAS), wrapper.cursor() as cursor:
+                        cursor.execute(f'INSERT INTO {TABLE} (worker, counter) VALUES (%s, 0)', [number])
+                        cursor.execute(f'UPDATE {TABLE} SET counter = counter + 1 WHERE id = %s', [row])
+                        if hold:
+                            time.sleep(hold)
+                else:
+                    with wrapper.cursor() as cursor:
+                        cursor.execute(f'SELECT counter FROM {TABLE} WHERE id = %s', [row])
+                        cursor.fetchone()
+                        cursor.execute(f'SELECT COUNT(*) FROM {TABLE} WHERE worker = %s', [rng.randint(-1, 3)])
+                        cursor.fetchone()
+            except DatabaseError as exc:
+                results.append((role, None, str(exc)))
+            else:
+                results.append((role, time.perf_counter() - started, None))
+    finally:
+        _disconnect(wrapper)
+    return results
+
+
+class Command(BaseCommand):
+    help = ("Run concurrent writer and reader processes against the configured database and report "
+            "throughput, latency and lock errors. On SQLite the configured settings are compared with "
+            "the old defaults (rollback journal, no pragmas), each on a scratch database file.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4, help="Processes running write transactions.")
+        parser.add_argument('--readers', type=int, default=8, help="Processes running reads.")
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds each profile runs.")
+        parser.add_argument('--rows', type=int, default=1000, help="Rows in the table before the run.")
+        parser.add_argument('--hold-ms', type=float, default=1.0,
+                            help="Time each write transaction stays open after its statements.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        base = connections['default'].settings_dict
+        scratch = None
+        if base['ENGINE'] == 'django.db.backends.sqlite3':
+            scratch = Path(tempfile.mkdtemp(prefix='db_load_test-'))
+            profiles = [
+                ('baseline', dict(deepcopy(base), NAME=str(scratch / 'baseline.sqlite3'), OPTIONS={})),
+                ('configured', dict(deepcopy(base), NAME=str(scratch / 'configured.sqlite3'))),
+            ]
+        else:
+            # Other databases are exercised in place, on a scratch table dropped afterwards
+            profiles = [('configured', deepcopy(base))]
+
+        report = {'options': {key: options[key] for key in ('writers', 'readers', 'duration', 'rows', 'hold_ms')},
+                  'vendor': connections['default'].vendor, 'results': []}
+        try:
+            for name, settings_dict in profiles:
+                self.stderr.write(f"Running {name} profile for {options['duration']}s...")
+                report['results'].append(dict(self._run(settings_dict, options), profile=name))
+        finally:
+            if scratch is not None:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self._print(report)
+
+    def _run(self, settings_dict, options):
+        wrapper = _connect(settings_dict)
+        try:
+            self._create_table(wrapper, options['rows'])
+            jobs = [(role, i) for role, count in (('write', options['writers']), ('read', options['readers']))
+                    for i in range(count)]
+            with ProcessPoolExecutor(max_workers=len(jobs), initializer=django.setup) as executor:
+                # Every process starts on the same wall-clock instant, after all have been spawned
+                start = time.time() + 1.0 + 0.05 * len(jobs)
+                futures = [executor.submit(_worker, role, i, settings_dict, options['rows'], start, options)
+                           for role, i in jobs]
+                results = [result for future in futures for result in future.result()]
+        finally:
+            with wrapper.cursor() as cursor:
+                cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+            _disconnect(wrapper)
+
+        summary = {}
+        for role in ('write', 'read'):
+            latencies = [latency for kind, latency, _ in results if kind == role and latency is not None]
+            errors = [error for kind, _, error in results if kind == role and error is not None]
+            summary[role] = {
+                'ops': len(latencies),
+                'ops_per_second': round(len(latencies) / options['duration'], 1),
+                **{key: round(value, 3) for key, value in latency_summary(latencies).items()},
+                'max_ms': round(max(latencies) * 1000, 3) if latencies else 0.0,
+                'errors': len(errors),
+                'error_samples': sorted(set(errors))[:3],
+            }
+        return summary
+
+    def _create_table(self, wrapper, n_rows):
+        key = 'bigserial PRIMARY KEY' if wrapper.vendor == 'postgresql' else 'integer PRIMARY KEY AUTOINCREMENT'
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+            cursor.execute(f'CREATE TABLE {TABLE} (id {key}, worker integer NOT NULL, counter integer NOT NULL)')
+        with transaction.atomic(using=ALIAS), wrapper.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {TABLE} (worker, counter) VALUES (%s, %s)', [(-1, 0)] * n_rows)
+
+    def _print(self, report):
+        self.stdout.write(f"{report['vendor']}: {report['options']['writers']} writers, "
+                          f"{report['options']['readers']} readers, {report['options']['duration']}s per profile")
+        header = f"{'profile':<12}{'role':<7}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}"
+        self.stdout.write(header)
+        for result in report['results']:
+            for role in ('write', 'read'):
+                stats = result[role]
+                self.stdout.write(
+                    f"{result['profile']:<12}{role:<7}{stats['ops_per_second']:>10.1f}{stats['p50_ms']:>10.2f}"
+                    f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}{stats['errors']:>8}")
+                for sample in stats['error_samples']:
+                    self.stdout.write(f"{'':<19}{sample}")
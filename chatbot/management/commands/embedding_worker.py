@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from chatbot.jobs import EmbeddingWorker
+
+
+class Command(BaseCommand):
+    help = ("Embed queued FAQ and variant writes in batches, and re-embed the corpus in the background "
+            "when CHATBOT_EMBEDDING_MODEL changes. Runs until interrupted unless --once is given.")
+
+    def add_arguments(self, parser):
+        config = getattr(settings, 'CHATBOT_EMBEDDING_QUEUE', {})
+        parser.add_argument('--batch-size', type=int, default=config.get('BATCH_SIZE', 64),
+                            help="Rows encoded per model call.")
+        parser.add_argument('--poll-interval', type=float, default=config.get('POLL_INTERVAL', 1.0),
+                            help="Seconds to wait when there is nothing to do.")
+        parser.add_argument('--lease', type=int, default=config.get('LEASE_SECONDS', 300),
+                            help="Seconds a claimed batch is reserved before another worker may retry it.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty and no migration is in progress.")
+
+    def handle(self, *args, **options):
+        worker = EmbeddingWorker(batch_size=options['batch_size'], lease_seconds=options['lease'])
+        total = 0
+        started = time.perf_counter()
+        try:
+            while True:
+                # A long-lived process outside the request cycle must drop broken or expired connections itself
+                close_old_connections()
+                handled = worker.step()
+                total += handled
+                if handled:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Handled {total} rows in {time.perf_counter() - started:.1f}s.")
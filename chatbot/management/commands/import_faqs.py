@@ -0,0 +1,39 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.importers import FORMATS, ImportFormatError, detect_format, import_faqs, iter_records
+
+
+class Command(BaseCommand):
+    help = "Bulk-import FAQs from a JSON array, JSONL or CSV file (use - for stdin)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - to read standard input.")
+        parser.add_argument('--format', choices=FORMATS,
+                            help="Input format; guessed from the file extension when omitted.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="FAQs encoded and inserted per batch.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or detect_format(path)
+
+        started = time.perf_counter()
+        try:
+            if path == '-':
+                result = import_faqs(iter_records(sys.stdin, fmt), batch_size=options['batch_size'])
+            else:
+                with open(path, encoding='utf-8', newline='') as stream:
+                    result = import_faqs(iter_records(stream, fmt), batch_size=options['batch_size'])
+        except (OSError, ImportFormatError) as exc:
+            raise CommandError(str(exc))
+        elapsed = time.perf_counter() - started
+
+        for error in result['errors']:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f"Inserted {result['inserted']}, skipped {result['skipped']} duplicates, "
+            f"failed {result['failed']} in {elapsed:.1f}s."
+        ))
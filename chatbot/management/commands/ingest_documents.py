@@ -0,0 +1,68 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.documents import EXTENSIONS, FORMATS, DocumentFormatError, ingest_document, remove_document
+
+
+def _document_paths(paths):
+    # Directories are walked for files with a supported extension
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower().lstrip('.') in EXTENSIONS:
+                    yield os.path.join(root, name)
+
+
+class Command(BaseCommand):
+    help = ("Import handbooks, circulars and pages (HTML, text or PDF) as passages the chatbot can answer "
+            "from. Documents whose file is unchanged since the last import are skipped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help="Files or directories to import.")
+        parser.add_argument('--format', choices=FORMATS,
+                            help="Input format; guessed from each file's extension when omitted.")
+        parser.add_argument('--force', action='store_true', help="Re-import documents even if unchanged.")
+        parser.add_argument('--batch-size', type=int,
+                            default=getattr(settings, 'CHATBOT_DOCUMENTS', {}).get('BATCH_SIZE', 64),
+                            help="Passages embedded and inserted per batch.")
+        parser.add_argument('--remove', nargs='+', default=[], metavar='SOURCE',
+                            help="Delete previously imported documents by source path.")
+
+    def handle(self, *args, **options):
+        if not options['paths'] and not options['remove']:
+            raise CommandError("Give documents to import or --remove.")
+
+        for source in options['remove']:
+            source = os.path.abspath(source) if os.path.exists(source) else source
+            if remove_document(source):
+                self.stdout.write(f"Removed {source}")
+            else:
+                self.stderr.write(f"No imported document {source}")
+
+        started = time.perf_counter()
+        imported = unchanged = passages = 0
+        for path in _document_paths(options['paths']):
+            try:
+                result = ingest_document(path, fmt=options['format'], batch_size=options['batch_size'],
+                                         force=options['force'])
+            except (OSError, DocumentFormatError, ImportError) as exc:
+                raise CommandError(f"{path}: {exc}")
+            if result['status'] == 'unchanged':
+                unchanged += 1
+                self.stdout.write(f"Unchanged {path}")
+            else:
+                imported += 1
+                passages += result['passages']
+                self.stdout.write(f"Imported {path}: {result['passages']} passages")
+        if imported or unchanged:
+            self.stdout.write(self.style.SUCCESS(
+                f"Imported {imported} documents ({passages} passages), skipped {unchanged} unchanged "
+                f"in {time.perf_counter() - started:.1f}s."
+            ))
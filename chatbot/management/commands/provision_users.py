@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.provisioning import RosterError, parse_range, provision_users, range_roster, read_roster
+
+
+class Command(BaseCommand):
+    help = ("Create or update student accounts in bulk from a roster file or a roll-number range, "
+            "hashing passwords across a process pool.")
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--roster', help="CSV with email and optional password columns, or one email "
+                                             "per line (use - for stdin).")
+        source.add_argument('--range', help='Roll numbers, e.g. "128-191" or "101-120,125".')
+        parser.add_argument('--prefix', default='1DT23CS', help="Email prefix before the roll number.")
+        parser.add_argument('--domain', default='@dsatm.edu.in', help="Email domain after the roll number.")
+        parser.add_argument('--password-template', default=None,
+                            help='Password for users without one, with {number} (ranges) or {email}; '
+                                 'defaults to "{number}@nova" for ranges.')
+        parser.add_argument('--reset-existing', action='store_true',
+                            help="Also reset the password of users that already exist; by default they are "
+                                 "left untouched.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Processes hashing passwords.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Users written per transaction.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            if options['range']:
+                template = options['password_template'] or '{number}@nova'
+                entries = list(range_roster(parse_range(options['range']), options['prefix'],
+                                            options['domain'], template))
+            elif options['roster'] == '-':
+                entries = list(read_roster(sys.stdin, options['password_template']))
+            else:
+                with open(options['roster'], encoding='utf-8', newline='') as stream:
+                    entries = list(read_roster(stream, options['password_template']))
+        except (OSError, RosterError, KeyError) as exc:
+            raise CommandError(str(exc))
+
+        result = provision_users(entries, batch_size=options['batch_size'], workers=options['workers'],
+                                 update_existing=options['reset_existing'])
+        elapsed = time.perf_counter() - started
+        written = result['created'] + result['updated']
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['created']}, updated {result['updated']}, skipped {result['skipped']} users "
+            f"in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.1f} users/s, {options['workers']} workers)."
+        ))
@@ -0,0 +1,114 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from chatbot.models import FAQ, FAQVariant
+
+
+class Command(BaseCommand):
+    help = ("Re-encode FAQ questions and their variants in bulk with CHATBOT_EMBEDDING_MODEL and store their "
+            "embeddings. The new vectors are swapped in together once every row has one, so questions keep "
+            "being answered from the previous embeddings meanwhile. This blocks until done; with the embedding "
+            "queue enabled, a model change can instead be left to `manage.py embedding_worker`, which "
+            "re-embeds in the background.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=256,
+                            help="Number of FAQs encoded and written per batch.")
+        parser.add_argument('--missing-only', action='store_true',
+                            help="Only embed rows that have no stored embedding yet, with the model the index uses.")
+        parser.add_argument('--store-only', action='store_true',
+                            help="Skip encoding; only write a new embedding store version from the database.")
+
+    def handle(self, *args, **options):
+        from chatbot.embeddings import configured_model_name, get_model
+        from chatbot.index import current_version, recorded_model_name
+        from chatbot.jobs import EmbeddingWorker, _lock_state
+        from chatbot.signals import faqs_changed_in_bulk
+        from chatbot.store import export_embeddings, get_embedding_store
+
+        batch_size = options['batch_size']
+        # A full rebuild moves the index to the configured model; filling gaps must match the rows already there
+        full_rebuild = not (options['missing_only'] or options['store_only'])
+        model_name = configured_model_name() if full_rebuild else recorded_model_name()
+        encoder = None if options['store_only'] else get_model(model_name)
+
+        started = time.perf_counter()
+        if full_rebuild:
+            # Vectors go to next_embedding, as in a background migration, until all rows have one
+            with transaction.atomic():
+                EmbeddingWorker()._reset_migration(_lock_state(), model_name)
+        totals = [0, 0]
+        for i, model in enumerate(() if options['store_only'] else (FAQ, FAQVariant)):
+            queryset = model.objects.order_by('pk').only('pk', 'question')
+            if options['missing_only']:
+                queryset = queryset.filter(embedding__isnull=True)
+
+            total = 0
+            batch = []
+            for row in queryset.iterator(chunk_size=batch_size):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    total += self._embed_batch(model, batch, encoder, model_name, full_rebuild)
+                    batch = []
+            if batch:
+                total += self._embed_batch(model, batch, encoder, model_name, full_rebuild)
+            totals[i] = total
+
+        store = get_embedding_store()
+        with transaction.atomic():
+            # bulk_update bypasses the FAQ signals, so tell running workers to reload. The new
+            # version only becomes visible on commit, by which time the store file is published.
+            if full_rebuild:
+                self._switch(model_name, encoder)
+            faqs_changed_in_bulk()
+            generation = None
+            if store is not None:
+                try:
+                    generation = export_embeddings(store, index_version=current_version())
+                except ValueError as exc:
+                    raise CommandError(f"FAQs changed while the store was written, run again: {exc}")
+
+        elapsed = time.perf_counter() - started
+        if not options['store_only']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Embedded {totals[0]} FAQs and {totals[1]} variants in {elapsed:.1f}s."
+            ))
+        if generation is not None:
+            self.stdout.write(f"Published embedding store version {generation} in {store.path}.")
+
+    def _embed_batch(self, model, rows, encoder, model_name, full_rebuild):
+        from chatbot.embeddings import encode, to_bytes
+
+        vectors = encode([row.question for row in rows], model=encoder)
+        for row, vector in zip(rows, vectors):
+            if full_rebuild:
+                row.next_embedding = to_bytes(vector)
+            else:
+                row.embedding = to_bytes(vector)
+                row.embedding_model = model_name
+        # bulk_update skips pre_save, so the signal does not re-encode each row
+        fields = ['next_embedding'] if full_rebuild else ['embedding', 'embedding_model']
+        model.objects.bulk_update(rows, fields)
+        return len(rows)
+
+    def _switch(self, model_name, encoder):
+        # Call inside a transaction: every row moves to its new vector and the stamp to the new model at once
+        from chatbot.embeddings import encode, to_bytes
+        from chatbot.jobs import JOB_MODELS, _lock_state
+
+        state = _lock_state()
+        for model in JOB_MODELS.values():
+            # Rows added or edited during the rebuild (or reset by an embedding worker) are embedded now
+            stale = list(model.objects.filter(next_embedding__isnull=True).only('pk', 'question'))
+            if stale:
+                for row, vector in zip(stale, encode([row.question for row in stale], model=encoder)):
+                    row.next_embedding = to_bytes(vector)
+                model.objects.bulk_update(stale, ['next_embedding'])
+            model.objects.update(embedding=F('next_embedding'), embedding_model=model_name, next_embedding=None)
+        # Any background migration is superseded: every row is now embedded with this model
+        state.embedding_model = model_name
+        state.next_embedding_model = ''
+        state.save(update_fields=['embedding_model', 'next_embedding_model'])
@@ -0,0 +1,73 @@
+import json
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chatbot.cache import normalize_question
+from chatbot.models import QueryLog
+
+
+class Command(BaseCommand):
+    help = ("Cluster the questions the chatbot could not answer by embedding similarity and list the "
+            "most asked missing topics, each with sample phrasings and the closest existing FAQ.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help="Look at questions from the last N days.")
+        parser.add_argument('--limit', type=int, default=20000,
+                            help="Most recent unanswered questions to cluster.")
+        parser.add_argument('--similarity', type=float, default=0.75,
+                            help="Cosine similarity for a question to join a topic.")
+        parser.add_argument('--top', type=int, default=20, help="Topics to list.")
+        parser.add_argument('--samples', type=int, default=5, help="Phrasings shown per topic.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        from chatbot.embeddings import encode, get_model
+        from chatbot.index import active_model_name, faq_index
+        from chatbot.querylog import cluster_questions
+
+        since = timezone.now() - timedelta(days=options['days'])
+        questions = (QueryLog.objects.filter(answered=False, created_at__gte=since)
+                     .order_by('-created_at').values_list('question', flat=True)[:options['limit']])
+
+        # Repeats of the same normalized question are encoded once and weighted by their count
+        counts = Counter()
+        phrasings = {}
+        for question in questions.iterator():
+            key = normalize_question(question)
+            if key:
+                counts[key] += 1
+                phrasings.setdefault(key, Counter())[question.strip()] += 1
+        keys = list(counts)
+        topics = []
+        if keys:
+            vectors = encode(keys, model=get_model(active_model_name()))
+            weights = [counts[key] for key in keys]
+            for members in cluster_questions(vectors, weights, options['similarity'])[:options['top']]:
+                member_keys = sorted((keys[i] for i in members), key=counts.get, reverse=True)
+                centroid = vectors[members].mean(axis=0)
+                closest = faq_index.rank_many(centroid[None, :], k=1)[0]
+                topics.append({
+                    'asked': sum(counts[key] for key in member_keys),
+                    'distinct': len(member_keys),
+                    'samples': [phrasings[key].most_common(1)[0][0] for key in member_keys[:options['samples']]],
+                    'closest_faq': ({'id': closest[0][0].id, 'question': closest[0][0].question,
+                                     'score': round(closest[0][1], 4)} if closest else None),
+                })
+
+        report = {'days': options['days'], 'unanswered': sum(counts.values()), 'topics': topics}
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"{report['unanswered']} unanswered questions in the last {options['days']} days, "
+                          f"{len(keys)} distinct.")
+        for rank, topic in enumerate(topics, start=1):
+            self.stdout.write(f"\n{rank}. asked {topic['asked']} times ({topic['distinct']} phrasings)")
+            for sample in topic['samples']:
+                self.stdout.write(f"   - {sample}")
+            if topic['closest_faq'] is not None:
+                faq = topic['closest_faq']
+                self.stdout.write(f"   closest FAQ #{faq['id']} ({faq['score']:.2f}): {faq['question']}")
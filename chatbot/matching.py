@@ -0,0 +1,230 @@
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .cache import get_answer_cache, get_semantic_cache
+from .embeddings import encode, encode_query
+from .index import faq_index
+from .metrics import record_answer, span
+from .passages import passage_index, passages_enabled
+from .querylog import get_query_log
+from .reranking import get_reranker
+
+logger = logging.getLogger(__name__)
+
+NO_ANSWER = "Sorry, I don't know the answer to that question yet."
+
+
+def _ranking_config():
+    return getattr(settings, 'CHATBOT_RANKING', {})
+
+
+def rank_embeddings(embeddings, questions=None, category=None, k=None):
+    """
+    Up to k (faq, score) candidates for each row of `embeddings`, best first;
+    `questions` are the matching texts, used by the hybrid lexical modes, and
+    `category` restricts the search to one FAQ category unless nothing there is
+    a confident match.
+
+    Near-identical earlier questions reuse their ranking from the semantic cache;
+    the rest are scored against the FAQ index in one matrix-matrix product.
+    """
+    if k is None:
+        k = _ranking_config().get('TOP_K', 5)
+    rankings = [None] * len(embeddings)
+    pending = list(range(len(embeddings)))
+
+    # Cached rankings were found without a category filter, so filtered searches bypass the cache
+    semantic_cache = get_semantic_cache() if category is None else None
+    if semantic_cache is not None:
+        faq_index.ensure_fresh()
+        pending = []
+        for i, embedding in enumerate(embeddings):
+            cached = semantic_cache.lookup(faq_index.version, embedding, k)
+            if cached is not None:
+                ranked = [(faq_index.get(faq_id), score) for faq_id, score in cached]
+                if all(faq is not None for faq, _ in ranked):
+                    rankings[i] = ranked
+                    continue
+            pending.append(i)
+
+    if pending:
+        texts = None if questions is None else [questions[i] for i in pending]
+        with span('retrieve'):
+            searched = faq_index.rank_many(embeddings[pending], k=k, texts=texts, category=category)
+        for i, ranked in zip(pending, searched):
+            rankings[i] = ranked
+            if semantic_cache is not None:
+                semantic_cache.add(faq_index.version, embeddings[i], [(faq.id, score) for faq, score in ranked], k)
+    return rankings
+
+
+def match_embeddings(embeddings, questions=None, category=None):
+    """Best (faq, bi-encoder score) for each row of `embeddings`, or (None, 0.0) where nothing matched."""
+    return [ranked[0] if ranked else (None, 0.0)
+            for ranked in rank_embeddings(embeddings, questions, category)]
+
+
+def match_faq(user_question, category=None):
+    # Only the user's question is encoded; FAQ vectors come from the in-memory index
+    return match_embeddings(encode_query(user_question)[np.newaxis, :], [user_question], category)[0]
+
+
+def _result(ranked, match_threshold, alternative_threshold):
+    """
+    Payload for a ranking: the best FAQ's answer when it clears `match_threshold`,
+    plus up to ALTERNATIVES other candidates scoring at least `alternative_threshold`.
+    """
+    top_faq, top_score = ranked[0] if ranked else (None, 0.0)
+    if top_faq is not None and top_score > match_threshold:
+        result = {
+            'answer': top_faq.answer,
+            'extra_data': top_faq.extra_data,
+            'faq_id': top_faq.id,
+            'score': round(top_score, 4),
+        }
+        others = ranked[1:]
+    else:
+        # Without a confident answer every candidate is offered as a suggestion
+        result = {'answer': NO_ANSWER, 'faq_id': None, 'score': round(top_score, 4)}
+        others = ranked
+
+    n_alternatives = _ranking_config().get('ALTERNATIVES', 3)
+    if n_alternatives:
+        result['alternatives'] = [
+            {'faq_id': faq.id, 'question': faq.question, 'score': round(score, 4)}
+            for faq, score in others[:n_alternatives] if score >= alternative_threshold
+        ]
+    return result
+
+
+def _bi_encoder_result(ranked):
+    config = _ranking_config()
+    return _result(ranked, config.get('MATCH_THRESHOLD', 0.6), config.get('ALTERNATIVE_THRESHOLD', 0.45))
+
+
+def _lexical_result(faq, lexical_score):
+    # A BM25 score is not on the cosine scale, so it is reported apart from `score`
+    result = {
+        'answer': faq.answer,
+        'extra_data': faq.extra_data,
+        'faq_id': faq.id,
+        'lexical_score': round(lexical_score, 4),
+    }
+    if _ranking_config().get('ALTERNATIVES', 3):
+        result['alternatives'] = []
+    return result
+
+
+def _passage_result(passage, score, result):
+    """`result`, which no FAQ answered, answered with a document passage instead; FAQ suggestions are kept."""
+    return {
+        **result,
+        'answer': passage.text,
+        'extra_data': {'source': passage.title},
+        'passage_id': passage.id,
+        'score': round(score, 4),
+    }
+
+
+def answer_questions(questions, category=None):
+    """
+    Answer several questions at once, in input order, optionally preferring
+    FAQs of one `category`.
+
+    Each result has the answer, extra_data when matched, the matched FAQ id, its
+    score and ranked alternatives. Answers come from the answer cache where
+    possible; the rest are encoded in one call, their top-k candidates retrieved
+    together and, when CHATBOT_RERANKER is enabled, re-scored by the cross-encoder.
+    Questions no FAQ answers confidently are answered from the best document
+    passage when it clears CHATBOT_DOCUMENTS['MATCH_THRESHOLD'].
+    Every question is added to the query log when CHATBOT_QUERY_LOG is enabled.
+    """
+    started = time.perf_counter()
+    results = [None] * len(questions)
+    pending = list(range(len(questions)))
+    # Before encoding, so questions are encoded with the model of the index they are matched against
+    faq_index.ensure_fresh()
+    search_passages = passages_enabled()
+    if search_passages:
+        passage_index.ensure_fresh()
+
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        version = (faq_index.version, passage_index.version if search_passages else None)
+        pending = []
+        with span('answer_cache'):
+            for i, question in enumerate(questions):
+                results[i] = answer_cache.get(version, question, category)
+                if results[i] is None:
+                    pending.append(i)
+                else:
+                    record_answer('answer_cache')
+
+    # Distinctive keywords can settle a question before it is ever encoded
+    if pending and getattr(settings, 'CHATBOT_HYBRID', {}).get('MODE') == 'shortcircuit':
+        still_pending = []
+        for i in pending:
+            hit = faq_index.lexical_match(questions[i], category)
+            if hit is None:
+                still_pending.append(i)
+                continue
+            results[i] = _lexical_result(*hit)
+            record_answer('lexical', results[i], scorer='bm25')
+            if answer_cache is not None:
+                answer_cache.set(version, questions[i], results[i], category)
+        pending = still_pending
+
+    if pending:
+        # A single question goes through the micro-batcher so it can share a forward pass
+        pending_questions = [questions[i] for i in pending]
+        with span('encode'):
+            if len(pending) == 1:
+                embeddings = encode_query(pending_questions[0])[np.newaxis, :]
+            else:
+                embeddings = encode(pending_questions)
+
+        reranker = get_reranker()
+        reranker_config = getattr(settings, 'CHATBOT_RERANKER', {})
+        scorers = {}
+        for i, ranked in zip(pending, rank_embeddings(embeddings, pending_questions, category)):
+            if reranker is not None and ranked:
+                with span('rerank'):
+                    ranked, elapsed = reranker.rerank(questions[i], ranked, faq_index.phrasings)
+                logger.debug("Reranked %d candidates in %.1fms", len(ranked), elapsed * 1000)
+                results[i] = _result(ranked, reranker_config.get('MATCH_THRESHOLD', 0.5),
+                                     reranker_config.get('ALTERNATIVE_THRESHOLD', 0.3))
+                scorers[i] = 'cross_encoder'
+            else:
+                results[i] = _bi_encoder_result(ranked)
+                scorers[i] = 'bi_encoder'
+
+        unanswered = [j for j, i in enumerate(pending) if results[i]['faq_id'] is None]
+        if search_passages and unanswered:
+            threshold = getattr(settings, 'CHATBOT_DOCUMENTS', {}).get('MATCH_THRESHOLD', 0.5)
+            with span('passages'):
+                found = passage_index.search_many(embeddings[unanswered])
+            for j, (passage, score) in zip(unanswered, found):
+                if passage is not None and score > threshold:
+                    results[pending[j]] = _passage_result(passage, score, results[pending[j]])
+                    scorers[pending[j]] = 'passage'
+
+        for i in pending:
+            record_answer('passage' if scorers[i] == 'passage' else 'model', results[i], scorer=scorers[i])
+            if answer_cache is not None:
+                answer_cache.set(version, questions[i], results[i], category)
+
+    query_log = get_query_log()
+    if query_log is not None:
+        elapsed = time.perf_counter() - started
+        for question, result in zip(questions, results):
+            query_log.record(question, result, elapsed, category)
+    return results
+
+
+def answer_question(user_question, category=None):
+    """Build the chatbot API payload for one question."""
+    result = answer_questions([user_question], category)[0]
+    return {key: value for key, value in result.items() if key in ('answer', 'extra_data', 'alternatives')}
@@ -0,0 +1,371 @@
+import cProfile
+import contextvars
+import hmac
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans from sub-millisecond dict lookups up to a cold model load
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SCORE_BUCKETS = tuple(round(0.1 * i, 1) for i in range(1, 11))
+
+
+def _metrics_config():
+    return getattr(settings, 'CHATBOT_METRICS', {})
+
+
+def _label_text(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = ','.join('%s="%s"' % (name, _escape(value)) for name, value in zip(labelnames, values))
+    return '{%s}' % pairs
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels.get(name, '')) for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name + '_total', key, value) for key, value in values]
+
+
+class Histogram:
+    """Bucketed distribution per label combination, exposed with cumulative Prometheus buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        # The last slot counts observations above every bound (the +Inf bucket)
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        samples = []
+        labelnames = self.labelnames + ('le',)
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', key + (_number(bound),), cumulative, labelnames))
+            samples.append((self.name + '_sum', key, total))
+            samples.append((self.name + '_count', key, cumulative))
+        return samples
+
+
+class Registry:
+    """Named metrics of this process plus collectors called at scrape time for stats kept elsewhere."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        return self._get_or_create(Histogram, name, documentation, buckets, labelnames)
+
+    def register_collector(self, collector):
+        """`collector()` yields (name, kind, documentation, [(sample name, labels dict, value), ...]) families."""
+        self._collectors.append(collector)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for sample in metric.samples():
+                name, values, value = sample[:3]
+                labelnames = sample[3] if len(sample) > 3 else metric.labelnames
+                lines.append(f'{name}{_label_text(labelnames, values)} {_number(value)}')
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception:
+                logger.exception("Metrics collector %r failed", collector)
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for sample_name, labels, value in samples:
+                    lines.append(f'{sample_name}{_label_text(tuple(labels), tuple(labels.values()))} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.counter('chatbot_http_requests', 'HTTP requests by view and status code.', ('view', 'status'))
+REQUEST_SECONDS = registry.histogram('chatbot_http_request_seconds', 'Request latency by view.', labelnames=('view',))
+STAGE_SECONDS = registry.histogram('chatbot_stage_seconds', 'Time spent in each stage of answering.',
+                                   labelnames=('stage',))
+ANSWERS = registry.counter('chatbot_answers', 'Questions answered, by where the answer came from.', ('source',))
+MATCH_SCORE = registry.histogram('chatbot_match_score', 'Score of the best candidate for freshly answered questions.',
+                                 SCORE_BUCKETS, ('scorer',))
+UNANSWERED = registry.counter('chatbot_unanswered', 'Questions whose best candidate scored below the match threshold.')
+SLOW_REQUESTS = registry.counter('chatbot_slow_requests', 'Requests slower than CHATBOT_METRICS SLOW_REQUEST_MS.',
+                                 ('view',))
+
+# Stage timings of the request being served, for slow-request logs and the Server-Timing header
+_trace = contextvars.ContextVar('chatbot_metrics_trace', default=None)
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as `stage` of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace[stage] = trace.get(stage, 0.0) + elapsed
+
+
+def record_answer(source, result=None, scorer='bi_encoder'):
+    """Count one answered question; fresh results also feed the score histogram and the miss counter."""
+    ANSWERS.inc(source=source)
+    if result is None:
+        return
+    # Lexical answers carry a BM25 score in place of the cosine one
+    MATCH_SCORE.observe(result['score'] if 'score' in result else result['lexical_score'], scorer=scorer)
+    if result['faq_id'] is None and result.get('passage_id') is None:
+        UNANSWERED.inc()
+
+
+def _component_stats():
+    """Stats kept by the batcher, caches, reranker and query log, read when /metrics is scraped."""
+    from .batching import get_batcher
+    from .cache import get_answer_cache, get_semantic_cache
+    from .querylog import get_query_log
+    from .reranking import get_reranker
+
+    batcher = get_batcher()
+    if batcher is not None:
+        stats = batcher.stats()
+        # Bucket counts are per size range; Prometheus wants them cumulative
+        samples = []
+        cumulative = 0
+        for bound, count in sorted(stats['batch_size_buckets'].items()):
+            cumulative += count
+            samples.append(('chatbot_encode_batch_size_bucket', {'le': _number(bound)}, cumulative))
+        samples.append(('chatbot_encode_batch_size_bucket', {'le': '+Inf'}, stats['batches']))
+        samples.append(('chatbot_encode_batch_size_sum', {}, stats['items']))
+        samples.append(('chatbot_encode_batch_size_count', {}, stats['batches']))
+        yield 'chatbot_encode_batch_size', 'histogram', 'Questions per encoder forward pass.', samples
+        yield ('chatbot_encode_queue_seconds', 'counter', 'Time questions waited for a batch.',
+               [('chatbot_encode_queue_seconds_total', {}, stats['queue_seconds_total'])])
+
+    caches = []
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        caches.append(('answer', answer_cache.stats()))
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is not None:
+        caches.append(('semantic', semantic_cache.stats()))
+    for outcome in ('hits', 'misses'):
+        if caches:
+            yield (f'chatbot_cache_{outcome}', 'counter', f'Cache {outcome} by tier.',
+                   [(f'chatbot_cache_{outcome}_total', {'cache': name}, stats[outcome]) for name, stats in caches])
+
+    reranker = get_reranker()
+    if reranker is not None:
+        stats = reranker.stats()
+        for name, documentation, value in (
+                ('chatbot_rerank_calls', 'Cross-encoder rerank calls.', stats['calls']),
+                ('chatbot_rerank_pairs_scored', 'Question/phrasing pairs run through the model.', stats['pairs_scored']),
+                ('chatbot_rerank_pair_cache_hits', 'Pair scores served from the LRU.', stats['cache_hits']),
+                ('chatbot_rerank_seconds', 'Time spent reranking.', stats['total_ms'] / 1000)):
+            yield name, 'counter', documentation, [(name + '_total', {}, value)]
+
+    query_log = get_query_log()
+    if query_log is not None:
+        stats = query_log.stats()
+        for name, documentation, value in (
+                ('chatbot_query_log_written', 'Query log entries written to the database.', stats['written']),
+                ('chatbot_query_log_dropped', 'Query log entries lost to a full buffer or a failed write.',
+                 stats['dropped'])):
+            yield name, 'counter', documentation, [(name + '_total', {}, value)]
+        yield ('chatbot_query_log_pending', 'gauge', 'Query log entries waiting to be written.',
+               [('chatbot_query_log_pending', {}, stats['pending'])])
+
+
+registry.register_collector(_component_stats)
+
+
+def can_read_metrics(request):
+    """
+    Whether `request` may scrape /metrics: a staff user, a bearer token equal to
+    CHATBOT_METRICS['TOKEN'], or a client address listed in ALLOWED_IPS.
+    """
+    config = _metrics_config()
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and user.is_staff:
+        return True
+    if has_bearer_token(request, config.get('TOKEN')):
+        return True
+    return request.META.get('REMOTE_ADDR') in config.get('ALLOWED_IPS', ())
+
+
+def has_bearer_token(request, token):
+    """Whether `request` carries "Authorization: Bearer <token>"; always False when no token is configured."""
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode())
+
+
+class MetricsMiddleware:
+    """
+    Counts and times every request, attaches its stage timings as a Server-Timing
+    header and logs requests slower than SLOW_REQUEST_MS with their breakdown.
+
+    A PROFILE_SAMPLE_RATE share of synchronous requests runs under cProfile; the
+    profile is written to PROFILE_DIR only if the request turns out slow, so the
+    files show exactly where slow requests spend their time.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    # One profiler at a time; concurrent requests are simply not sampled
+    _profile_lock = threading.Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        config = _metrics_config()
+        if not config.get('ENABLED', True):
+            return self.get_response(request)
+
+        trace = {}
+        token = _trace.set(trace)
+        profiler = None
+        sample_rate = config.get('PROFILE_SAMPLE_RATE', 0.0)
+        if sample_rate and random.random() < sample_rate and self._profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started
+            _trace.reset(token)
+            if profiler is not None:
+                self._profile_lock.release()
+        self._finish(request, response, elapsed, trace, profiler, config)
+        return response
+
+    async def __acall__(self, request):
+        config = _metrics_config()
+        if not config.get('ENABLED', True):
+            return await self.get_response(request)
+
+        trace = {}
+        token = _trace.set(trace)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started
+            _trace.reset(token)
+        self._finish(request, response, elapsed, trace, None, config)
+        return response
+
+    def _finish(self, request, response, elapsed, trace, profiler, config):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unresolved'
+        REQUESTS.inc(view=view, status=response.status_code)
+        REQUEST_SECONDS.observe(elapsed, view=view)
+        if trace:
+            response['Server-Timing'] = ', '.join(
+                f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in trace.items())
+
+        if elapsed * 1000 >= config.get('SLOW_REQUEST_MS', 500):
+            SLOW_REQUESTS.inc(view=view)
+            logger.warning("Slow request %s %s took %.1fms: %s", request.method, request.path, elapsed * 1000,
+                           ', '.join(f'{stage}={seconds * 1000:.1f}ms' for stage, seconds in trace.items()))
+            if profiler is not None:
+                self._dump_profile(profiler, view, config)
+
+    @staticmethod
+    def _dump_profile(profiler, view, config):
+        directory = Path(config.get('PROFILE_DIR') or settings.BASE_DIR / 'profiles')
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"{view.replace(':', '_')}-{time.strftime('%Y%m%d-%H%M%S')}-{random.getrandbits(32):08x}.prof"
+            profiler.dump_stats(path)
+        except OSError:
+            logger.exception("Could not write request profile")
+            return
+        logger.warning("Wrote profile of slow request to %s (inspect with `python -m pstats`)", path)
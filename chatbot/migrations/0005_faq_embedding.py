@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_usersession_default_password_changed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faq',
+            name='embedding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
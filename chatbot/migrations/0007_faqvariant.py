@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_indexversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FAQVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.CharField(max_length=255)),
+                ('embedding', models.BinaryField(blank=True, null=True)),
+                ('faq', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='chatbot.faq')),
+            ],
+        ),
+    ]
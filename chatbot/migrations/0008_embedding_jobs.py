@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_embedding_model(apps, schema_editor):
+    # Embeddings written so far all came from the configured model, so they are
+    # labelled (and the FAQ index stamped) with it while that is still true
+    model_name = getattr(settings, 'CHATBOT_EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+    labelled = 0
+    for name in ('FAQ', 'FAQVariant'):
+        model = apps.get_model('chatbot', name)
+        labelled += model.objects.filter(embedding__isnull=False, embedding_model='').update(embedding_model=model_name)
+    if labelled:
+        IndexVersion = apps.get_model('chatbot', 'IndexVersion')
+        IndexVersion.objects.get_or_create(key='faq')
+        IndexVersion.objects.filter(key='faq', embedding_model='').update(embedding_model=model_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0007_faqvariant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faq',
+            name='embedding_model',
+            field=models.CharField(blank=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='faq',
+            name='next_embedding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='faqvariant',
+            name='embedding_model',
+            field=models.CharField(blank=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='faqvariant',
+            name='next_embedding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='indexversion',
+            name='embedding_model',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='indexversion',
+            name='next_embedding_model',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.CreateModel(
+            name='EmbeddingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('faq', 'FAQ'), ('variant', 'Variant')], max_length=10)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('requested_at', models.DateTimeField()),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_embedding_job')],
+            },
+        ),
+        migrations.RunPython(record_embedding_model, migrations.RunPython.noop),
+    ]
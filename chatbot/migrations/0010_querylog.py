@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0009_documents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.CharField(max_length=500)),
+                ('category', models.CharField(blank=True, default='', max_length=50)),
+                ('faq_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('passage_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('score', models.FloatField(default=0.0)),
+                ('answered', models.BooleanField()),
+                ('latency_ms', models.FloatField()),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['answered', 'created_at'], name='querylog_answered_created')],
+            },
+        ),
+    ]
@@ -7,6 +7,24 @@ class FAQ(models.Model):
     category = models.CharField(max_length=50, default='general')
     extra_data = models.JSONField(blank=True, null=True)  # Built-in JSONField for SQLite and others
     message_type = models.CharField(max_length=50, blank=True, null=True)
+    # Normalized float32 SBERT vector of `question`, filled by the pre_save signal or the embedding worker
+    embedding = models.BinaryField(blank=True, null=True, editable=False)
+    # Model that produced `embedding`, and the vector from the model being migrated to, if any
+    embedding_model = models.CharField(max_length=200, blank=True, default='', editable=False)
+    next_embedding = models.BinaryField(blank=True, null=True, editable=False)
+
+    def __str__(self):
+        return self.question
+
+class FAQVariant(models.Model):
+    """Alternate phrasing of a FAQ's question, indexed as an extra embedding row of its FAQ."""
+    faq = models.ForeignKey(FAQ, related_name='variants', on_delete=models.CASCADE)
+    question = models.CharField(max_length=255)
+    # Normalized float32 SBERT vector of `question`, filled by the pre_save signal or the embedding worker
+    embedding = models.BinaryField(blank=True, null=True, editable=False)
+    # Model that produced `embedding`, and the vector from the model being migrated to, if any
+    embedding_model = models.CharField(max_length=200, blank=True, default='', editable=False)
+    next_embedding = models.BinaryField(blank=True, null=True, editable=False)
 
     def __str__(self):
         return self.question
@@ -19,3 +37,84 @@ class UserSession(models.Model):
     def __str__(self):
         return f"Session for {self.user.username}"
 
+class IndexVersion(models.Model):
+    """Version stamp bumped on every indexed write, so worker processes can detect stale in-memory indexes."""
+    key = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    # Model the indexed embeddings come from (questions are encoded with it too), and
+    # the model the embedding worker is re-embedding the corpus with, if any
+    embedding_model = models.CharField(max_length=200, blank=True, default='')
+    next_embedding_model = models.CharField(max_length=200, blank=True, default='')
+
+    def __str__(self):
+        return f"{self.key} v{self.version}"
+
+class EmbeddingJob(models.Model):
+    """A FAQ or variant waiting for `manage.py embedding_worker` to (re)compute its embedding."""
+    KIND_CHOICES = [('faq', 'FAQ'), ('variant', 'Variant')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    # Refreshed when the row changes again, so a worker never drops a newer request than the one it handled
+    requested_at = models.DateTimeField()
+    locked_until = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_embedding_job')]
+
+    def __str__(self):
+        return f"Embed {self.kind} {self.object_id}"
+
+class Document(models.Model):
+    """A handbook, circular or page imported by `manage.py ingest_documents`, searched through its Passages."""
+    # File path or URL the document was read from
+    source = models.CharField(max_length=500)
+    title = models.CharField(max_length=255, blank=True, default='')
+    # SHA-256 of the raw file, so an unchanged document is skipped on re-import
+    content_hash = models.CharField(max_length=64)
+    # A re-import writes a new inactive Document and swaps it in once all its passages are stored
+    active = models.BooleanField(default=False)
+    imported_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['source'], condition=models.Q(active=True),
+                                               name='unique_active_document')]
+
+    def __str__(self):
+        return self.title or self.source
+
+class Passage(models.Model):
+    """A chunk of a Document's text, answered verbatim when no FAQ matches."""
+    document = models.ForeignKey(Document, related_name='passages', on_delete=models.CASCADE)
+    position = models.PositiveIntegerField()
+    text = models.TextField()
+    # Normalized float32 SBERT vector of `text` and the model that produced it
+    embedding = models.BinaryField(blank=True, null=True, editable=False)
+    embedding_model = models.CharField(max_length=200, blank=True, default='', editable=False)
+
+    class Meta:
+        ordering = ['document', 'position']
+
+    def __str__(self):
+        return f"{self.document} #{self.position}"
+
+class QueryLog(models.Model):
+    """A question put to the chatbot, written in bulk by chatbot.querylog."""
+    question = models.CharField(max_length=500)
+    category = models.CharField(max_length=50, blank=True, default='')
+    # Plain ids: logs outlive the FAQs and passages they matched
+    faq_id = models.PositiveBigIntegerField(blank=True, null=True)
+    passage_id = models.PositiveBigIntegerField(blank=True, null=True)
+    score = models.FloatField(default=0.0)
+    answered = models.BooleanField()
+    # Time to answer; questions sent together in one batch share it
+    latency_ms = models.FloatField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['answered', 'created_at'], name='querylog_answered_created')]
+
+    def __str__(self):
+        return self.question
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+
+from .embeddings import EMBEDDING_DTYPE, from_bytes
+from .index import active_model_name, current_version
+from .metrics import span
+from .models import Passage
+from .retrieval import create_backend
+
+logger = logging.getLogger(__name__)
+
+PASSAGE_INDEX_KEY = 'passage'
+
+# What an answer needs from a passage; the embedding is only kept in the matrix
+IndexedPassage = namedtuple('IndexedPassage', 'id document_id title text')
+
+
+def passages_enabled():
+    return getattr(settings, 'CHATBOT_DOCUMENTS', {}).get('ENABLED', True)
+
+
+class PassageIndex:
+    """
+    Process-wide matrix of normalized embeddings of the passages of active
+    Documents, searched when no FAQ answers a question confidently.
+
+    Documents are only written by `manage.py ingest_documents`, which bumps the
+    'passage' IndexVersion stamp, so the index is simply reloaded when the stamp
+    moves (checked at most once per CHATBOT_INDEX_CHECK_INTERVAL seconds).
+    Passages embedded with another model than the FAQ index's are left out.
+    """
+
+    def __init__(self, key=PASSAGE_INDEX_KEY):
+        self.key = key
+        self.version = None
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._stale = True
+        # (passages, backend) is replaced as a whole so readers never see a half-applied reload
+        self._snapshot = ([], None)
+
+    def __len__(self):
+        return len(self._snapshot[0])
+
+    def ensure_fresh(self):
+        interval = getattr(settings, 'CHATBOT_INDEX_CHECK_INTERVAL', 1.0)
+        now = time.monotonic()
+        if not self._stale and now - self._checked_at < interval:
+            return
+        self._checked_at = now
+        with span('passage_check'):
+            stale = self._stale or current_version(self.key) != self.version
+        if stale:
+            with span('passage_reload'):
+                self.reload()
+
+    def reload(self):
+        with self._lock:
+            version = current_version(self.key)
+            model_name = active_model_name()
+            rows = Passage.objects.filter(document__active=True, embedding__isnull=False)
+            stale = rows.exclude(embedding_model=model_name).count()
+            if stale:
+                logger.warning("%d passages were embedded with another model than %s; re-run ingest_documents "
+                               "to search them", stale, model_name)
+
+            passages, vectors = [], []
+            for pk, document_id, title, text, embedding in rows.filter(embedding_model=model_name).values_list(
+                    'pk', 'document_id', 'document__title', 'text', 'embedding').iterator(chunk_size=2000):
+                passages.append(IndexedPassage(pk, document_id, title, text))
+                vectors.append(from_bytes(embedding))
+            backend = None
+            if passages:
+                backend = create_backend()
+                backend.build(np.vstack(vectors).astype(EMBEDDING_DTYPE, copy=False))
+            self._snapshot = (passages, backend)
+            self.version = version
+            self._stale = False
+
+    def invalidate(self):
+        self._stale = True
+
+    def search_many(self, query_vectors):
+        """Best (passage, cosine score) for each row of the normalized `query_vectors`, or (None, 0.0)."""
+        self.ensure_fresh()
+        passages, backend = self._snapshot
+        if backend is None:
+            return [(None, 0.0)] * len(query_vectors)
+        found = []
+        for positions, scores in zip(*backend.search_many(np.asarray(query_vectors, dtype=EMBEDDING_DTYPE), k=1)):
+            found.append((passages[positions[0]], float(scores[0])) if len(positions) else (None, 0.0))
+        return found
+
+
+passage_index = PassageIndex()
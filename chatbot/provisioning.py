@@ -0,0 +1,122 @@
+import csv
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+RANGE_PART = re.compile(r'(\d+)(?:-(\d+))?')
+
+
+class RosterError(ValueError):
+    pass
+
+
+def parse_range(spec):
+    """Numbers in a range spec such as "128-191" or "101-120,125,130-133", in order and without repeats."""
+    numbers = []
+    for part in spec.split(','):
+        match = RANGE_PART.fullmatch(part.strip())
+        if match is None:
+            raise RosterError(f"Invalid range {part.strip()!r}; expected N or N-M.")
+        start = int(match.group(1))
+        end = int(match.group(2) or start)
+        if end < start:
+            raise RosterError(f"Invalid range {part.strip()!r}; the end is before the start.")
+        numbers.extend(range(start, end + 1))
+    return list(dict.fromkeys(numbers))
+
+
+def range_roster(numbers, prefix, domain, password_template):
+    """(email, password) for each roll number: <prefix><number><domain>, password from the template's {number}."""
+    for number in numbers:
+        email = f'{prefix}{number}{domain}'
+        yield email, password_template.format(number=number, email=email)
+
+
+def read_roster(stream, password_template=None):
+    """
+    (email, password) for each row of a roster: CSV with `email` and optional
+    `password` columns, or one email (optionally followed by ",password") per line.
+
+    Rows without a password get `password_template` formatted with {email}.
+    """
+    rows = [row for row in csv.reader(stream) if row and any(cell.strip() for cell in row)]
+    email_column, password_column = 0, 1
+    if rows and 'email' in [cell.strip().lower() for cell in rows[0]]:
+        header = [cell.strip().lower() for cell in rows.pop(0)]
+        email_column = header.index('email')
+        password_column = header.index('password') if 'password' in header else None
+
+    for line, row in enumerate(rows, start=1):
+        email = row[email_column].strip() if email_column < len(row) else ''
+        if '@' not in email:
+            raise RosterError(f"Row {line}: {email!r} is not an email address.")
+        password = ''
+        if password_column is not None and password_column < len(row):
+            password = row[password_column].strip()
+        if not password:
+            if password_template is None:
+                raise RosterError(f"Row {line}: no password for {email} and no password template given.")
+            password = password_template.format(email=email, number='')
+        yield email, password
+
+
+def provision_users(entries, batch_size=500, workers=None, update_existing=False):
+    """
+    Create or update one user per (email, password), with the email as username.
+
+    Existing users are found with one query up front. Passwords are hashed in a
+    process pool, as PBKDF2 is CPU-bound, and each batch is written with
+    bulk_create/bulk_update in its own transaction while later ones are hashed.
+    Users that already exist keep their password unless `update_existing`.
+    Returns counts of created, updated and skipped users.
+    """
+    # A repeated email keeps its last password
+    passwords = dict(entries)
+    existing = {user.username: user for user in
+                User.objects.filter(username__in=list(passwords)).only('id', 'username', 'email', 'password')}
+    if not update_existing:
+        passwords = {email: password for email, password in passwords.items() if email not in existing}
+    result = {'created': 0, 'updated': 0, 'skipped': len(existing) if not update_existing else 0}
+    if not passwords:
+        return result
+
+    emails = list(passwords)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _write_batches(emails, map(make_password, passwords.values()), existing, batch_size, result)
+        return result
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+        # Results stream back in order, so writing a batch overlaps with hashing the next
+        hashes = executor.map(make_password, passwords.values(), chunksize=max(1, min(64, len(emails) // (workers * 4))))
+        _write_batches(emails, hashes, existing, batch_size, result)
+    return result
+
+
+def _write_batches(emails, hashes, existing, batch_size, result):
+    new, changed = [], []
+
+    def flush():
+        with transaction.atomic():
+            User.objects.bulk_create(new, batch_size=batch_size)
+            User.objects.bulk_update(changed, ['email', 'password'], batch_size=batch_size)
+        result['created'] += len(new)
+        result['updated'] += len(changed)
+        new.clear()
+        changed.clear()
+
+    for email, password_hash in zip(emails, hashes):
+        user = existing.get(email)
+        if user is None:
+            new.append(User(username=email, email=email, password=password_hash))
+        else:
+            user.email = email
+            user.password = password_hash
+            changed.append(user)
+        if len(new) + len(changed) >= batch_size:
+            flush()
+    flush()
@@ -0,0 +1,150 @@
+import atexit
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import QueryLog
+
+logger = logging.getLogger(__name__)
+
+
+class QueryLogBuffer:
+    """
+    Bounded in-process buffer of answered questions, written to QueryLog in bulk
+    by a background thread.
+
+    record() only appends to a ring buffer of `max_size` entries, so a request
+    never waits on the database; if the writer falls that far behind, the oldest
+    unwritten entries are dropped and counted. The thread writes everything
+    waiting every `flush_interval` seconds, or as soon as `batch_size` entries
+    are, and once more when the process exits.
+    """
+
+    def __init__(self, max_size=10000, batch_size=500, flush_interval=2.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._entries = deque(maxlen=max_size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stats = {'recorded': 0, 'written': 0, 'dropped': 0}
+        atexit.register(self._flush_at_exit)
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='chatbot-query-log', daemon=True)
+                    self._thread.start()
+
+    def record(self, question, result, latency, category=None):
+        """Queue one answered question; `result` is its answer_questions() result, `latency` in seconds."""
+        self._ensure_started()
+        entry = (question[:500], category or '', result.get('faq_id'), result.get('passage_id'),
+                 result.get('score', 0.0), latency * 1000, timezone.now())
+        with self._lock:
+            if len(self._entries) == self._entries.maxlen:
+                self._stats['dropped'] += 1
+            self._entries.append(entry)
+            self._stats['recorded'] += 1
+            waiting = len(self._entries)
+        if waiting >= self.batch_size:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing the query log failed")
+            finally:
+                # The thread outlives requests, so it drops stale connections itself
+                close_old_connections()
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Writing the query log at exit failed")
+
+    def flush(self):
+        """Write every waiting entry; returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                entries = list(self._entries)
+                self._entries.clear()
+            if not entries:
+                return 0
+            try:
+                QueryLog.objects.bulk_create([
+                    QueryLog(question=question, category=category, faq_id=faq_id, passage_id=passage_id,
+                             score=score, answered=faq_id is not None or passage_id is not None,
+                             latency_ms=latency_ms, created_at=created_at)
+                    for question, category, faq_id, passage_id, score, latency_ms, created_at in entries
+                ], batch_size=self.batch_size)
+            except Exception:
+                with self._lock:
+                    self._stats['dropped'] += len(entries)
+                raise
+            with self._lock:
+                self._stats['written'] += len(entries)
+            return len(entries)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=len(self._entries))
+
+
+_query_log = None
+_query_log_lock = threading.Lock()
+
+
+def get_query_log():
+    """Process-wide buffer configured by settings.CHATBOT_QUERY_LOG, or None when disabled."""
+    global _query_log
+    config = getattr(settings, 'CHATBOT_QUERY_LOG', {})
+    if not config.get('ENABLED', False):
+        return None
+    if _query_log is None:
+        with _query_log_lock:
+            if _query_log is None:
+                _query_log = QueryLogBuffer(
+                    max_size=config.get('MAX_SIZE', 10000),
+                    batch_size=config.get('BATCH_SIZE', 500),
+                    flush_interval=config.get('FLUSH_INTERVAL', 2.0),
+                )
+    return _query_log
+
+
+def cluster_questions(vectors, counts, threshold=0.75):
+    """
+    Group normalized question `vectors` whose cosine similarity to a cluster's
+    centroid is at least `threshold`, visiting the most asked (`counts`) first
+    so each cluster is seeded by its most common phrasing.
+
+    Returns a list of clusters, each a list of row indices, largest total count first.
+    """
+    order = np.argsort(-np.asarray(counts), kind='stable')
+    clusters = []
+    # Running (unnormalized) centroid sums, one row per cluster
+    sums = np.empty((0, vectors.shape[1]), dtype=np.float32)
+    for i in order.tolist():
+        if clusters:
+            centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True)
+            similarities = centroids @ vectors[i]
+            best = int(np.argmax(similarities))
+            if similarities[best] >= threshold:
+                clusters[best].append(i)
+                sums[best] += vectors[i]
+                continue
+        clusters.append([i])
+        sums = np.vstack([sums, vectors[i]])
+    return sorted(clusters, key=lambda members: -sum(counts[i] for i in members))
@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RERANKER_MODEL = 'cross-encoder/stsb-TinyBERT-L-4'
+
+
+class CrossEncoderReranker:
+    """
+    Second-stage scorer: a cross-encoder reads the question together with each
+    candidate FAQ phrasing, which is more accurate than comparing embeddings but
+    too slow to run over the whole corpus, so it only sees the bi-encoder's top k.
+
+    Pair scores are kept in an LRU cache keyed by the normalized question and the
+    phrasing, so repeated questions and unchanged FAQs are never scored twice.
+    """
+
+    def __init__(self, model_name=DEFAULT_RERANKER_MODEL, cache_size=4096, batch_size=32, **options):
+        self.model_name = model_name
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.options = options
+        self._model = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.calls = 0
+        self.pairs_scored = 0
+        self.cache_hits = 0
+        self.total_seconds = 0.0
+
+    def get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    started = time.perf_counter()
+                    self._model = CrossEncoder(self.model_name, device='cpu', **self.options)
+                    logger.info("Loaded reranker %s in %.1fs", self.model_name, time.perf_counter() - started)
+        return self._model
+
+    def score(self, question, phrasings):
+        """Cross-encoder scores of `question` against each phrasing."""
+        key_question = normalize_question(question)
+        scores = [None] * len(phrasings)
+        missing = []
+        with self._lock:
+            for i, phrasing in enumerate(phrasings):
+                cached = self._cache.get((key_question, phrasing))
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self._cache.move_to_end((key_question, phrasing))
+                    scores[i] = cached
+            self.cache_hits += len(phrasings) - len(missing)
+
+        if missing:
+            predicted = self.get_model().predict([(question, phrasings[i]) for i in missing],
+                                                 batch_size=self.batch_size, show_progress_bar=False)
+            with self._lock:
+                for i, value in zip(missing, np.asarray(predicted, dtype=np.float32).tolist()):
+                    scores[i] = value
+                    self._cache[(key_question, phrasings[i])] = value
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                self.pairs_scored += len(missing)
+        return scores
+
+    def rerank(self, question, candidates, phrasings_of):
+        """
+        Re-order (faq, score) candidates by cross-encoder score, best first.
+
+        Each FAQ is scored against all its phrasings (from `phrasings_of(faq_id)`)
+        and keeps the best, mirroring the bi-encoder's max-pooling over variants.
+        """
+        started = time.perf_counter()
+        phrasings = []
+        owners = []
+        for position, (faq, _) in enumerate(candidates):
+            for phrasing in phrasings_of(faq.id) or [faq.question]:
+                phrasings.append(phrasing)
+                owners.append(position)
+
+        best = [-np.inf] * len(candidates)
+        for position, value in zip(owners, self.score(question, phrasings)):
+            best[position] = max(best[position], value)
+        reranked = sorted(((faq, score) for (faq, _), score in zip(candidates, best)),
+                          key=lambda item: item[1], reverse=True)
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.calls += 1
+            self.total_seconds += elapsed
+        return reranked, elapsed
+
+    def stats(self):
+        with self._lock:
+            calls, pairs_scored, cache_hits, total_seconds = (self.calls, self.pairs_scored, self.cache_hits,
+                                                              self.total_seconds)
+        return {
+            'calls': calls,
+            'pairs_scored': pairs_scored,
+            'cache_hits': cache_hits,
+            'total_ms': round(total_seconds * 1000, 3),
+            'mean_ms': round(total_seconds * 1000 / calls, 3) if calls else 0.0,
+        }
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """Process-wide reranker configured by settings.CHATBOT_RERANKER, or None when disabled."""
+    global _reranker
+    config = getattr(settings, 'CHATBOT_RERANKER', {})
+    if not config.get('ENABLED', False):
+        return None
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = CrossEncoderReranker(
+                    model_name=config.get('MODEL', DEFAULT_RERANKER_MODEL),
+                    cache_size=config.get('CACHE_SIZE', 4096),
+                    batch_size=config.get('BATCH_SIZE', 32),
+                )
+    return _reranker
@@ -0,0 +1,251 @@
+import copy
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'chatbot.retrieval.BruteForceBackend'
+
+
+def top_k(scores, k):
+    """Indices of the k largest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def similarities(matrix, queries, rows=None, block_rows=8192):
+    """
+    queries @ matrix[rows].T in float32 (every row when `rows` is None). Picked
+    rows, and a reduced-precision matrix (e.g. a float16 embedding store), are
+    gathered and upcast one block at a time, so the matrix is never copied whole.
+    """
+    if rows is None and isinstance(matrix, np.ndarray) and matrix.dtype == np.float32:
+        return queries @ matrix.T
+    n = len(matrix) if rows is None else len(rows)
+    scores = np.empty(queries.shape[:-1] + (n,), dtype=np.float32)
+    for start in range(0, n, block_rows):
+        block = matrix[start:start + block_rows] if rows is None else matrix[rows[start:start + block_rows]]
+        block = np.asarray(block, dtype=np.float32)
+        scores[..., start:start + len(block)] = queries @ block.T
+    return scores
+
+
+class StackedRows:
+    """
+    Read-only row-wise concatenation of two matrices, such as a memory-mapped
+    embedding store and the rows read since, indexed like one array (integer,
+    slice or boolean row selections) without copying either.
+    """
+
+    ndim = 2
+
+    def __init__(self, head, tail):
+        self.head = head
+        self.tail = tail
+        self.shape = (len(head) + len(tail), head.shape[1])
+        self.dtype = np.result_type(head.dtype, tail.dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        split = len(self.head)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                head = self.head[min(start, split):min(stop, split)]
+                tail = self.tail[max(start - split, 0):max(stop - split, 0)]
+                return np.concatenate([np.asarray(head, dtype=self.dtype), np.asarray(tail, dtype=self.dtype)])
+            key = np.arange(start, stop, step)
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.flatnonzero(key)
+        if key.ndim == 0:
+            return self.head[key] if key < split else self.tail[key - split]
+        rows = np.empty((len(key), self.shape[1]), dtype=self.dtype)
+        in_head = key < split
+        rows[in_head] = self.head[key[in_head]]
+        rows[~in_head] = self.tail[key[~in_head] - split]
+        return rows
+
+
+class RetrievalBackend:
+    """
+    Nearest-neighbour search over the rows of a normalized embedding matrix.
+
+    A backend instance is built for one matrix and then only read, so the FAQ
+    index can swap it in together with the matrix it was built from. It keeps a
+    reference to the matrix rather than a copy, so a memory-mapped matrix stays
+    shared between processes.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.matrix = None
+        self.rows = None
+
+    def build(self, matrix, previous=None, rows=None):
+        """
+        Index `matrix`, or only its `rows` positions, in which case search results
+        are positions in `rows`. `previous` is the backend it replaces, whose state
+        may be reused.
+        """
+        self.matrix = matrix
+        self.rows = rows
+
+    def grow(self, matrix):
+        """
+        A backend for `matrix`, the indexed matrix with rows appended after the
+        unchanged indexed ones; this one stays as is for readers still using it.
+        Only for backends indexing every row. The default rebuilds.
+        """
+        grown = copy.copy(self)
+        grown.build(matrix, previous=self)
+        return grown
+
+    @property
+    def size(self):
+        if self.matrix is None:
+            return 0
+        return len(self.matrix) if self.rows is None else len(self.rows)
+
+    def _matrix_rows(self, positions):
+        # Matrix rows of indexed positions
+        return positions if self.rows is None else self.rows[positions]
+
+    def search(self, query, k=1):
+        """Return (row positions, cosine scores) of the k best rows, best first."""
+        raise NotImplementedError
+
+    def search_many(self, queries, k=1):
+        """search() for each row of `queries`; returns a list of positions and a list of scores."""
+        results = [self.search(query, k) for query in queries]
+        return [positions for positions, _ in results], [scores for _, scores in results]
+
+
+class BruteForceBackend(RetrievalBackend):
+    """Exact scan: one matrix-vector product over every row."""
+
+    def search(self, query, k=1):
+        if not self.size:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = similarities(self.matrix, query, self.rows)
+        positions = top_k(scores, k)
+        return positions, scores[positions]
+
+    def search_many(self, queries, k=1):
+        if not self.size:
+            return super().search_many(queries, k)
+        # One matrix-matrix product for the whole batch
+        scores = similarities(self.matrix, queries, self.rows)
+        positions = [top_k(row, k) for row in scores]
+        return positions, [row[best] for row, best in zip(scores, positions)]
+
+
+class IVFBackend(RetrievalBackend):
+    """
+    Inverted-file index: rows are clustered around `nlist` spherical k-means
+    centroids and a query only scans the `nprobe` closest clusters.
+
+    Raising `nprobe` trades latency for recall; `nprobe == nlist` is exact.
+    Matrices smaller than `min_train_size` are scanned exactly. Only the cluster
+    order is stored; the probed rows are gathered from the matrix per query,
+    which is slower than scanning a clustered copy but keeps a memory-mapped
+    matrix shared instead of duplicating it in every process. Rows added by
+    grow() are scanned exactly until they reach a quarter of the clustered ones.
+    """
+
+    def __init__(self, nlist=64, nprobe=8, n_iter=10, min_train_size=1000, max_train_size=50000, seed=0,
+                 **options):
+        super().__init__(**options)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.min_train_size = min_train_size
+        self.max_train_size = max_train_size
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self._order = None
+        self._offsets = None
+        # Rows assigned to clusters; any after them were appended by grow()
+        self._clustered = 0
+
+    def build(self, matrix, previous=None, rows=None):
+        super().build(matrix, rows=rows)
+        n = self._clustered = self.size
+        if n < max(self.min_train_size, self.nlist):
+            self.centroids = None
+            return
+
+        # Incremental updates keep the old centroids until the corpus has doubled
+        if isinstance(previous, IVFBackend) and previous.centroids is not None \
+                and len(previous.centroids) == self.nlist and n <= 2 * previous.trained_size:
+            self.centroids = previous.centroids
+            self.trained_size = previous.trained_size
+        else:
+            self.centroids = self._train()
+            self.trained_size = n
+
+        assignments = np.argmax(similarities(matrix, self.centroids, rows), axis=0)
+        # Positions cluster by cluster, so each probed list is a contiguous slice of them
+        self._order = np.argsort(assignments, kind='stable')
+        self._offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=self.nlist))))
+
+    def grow(self, matrix):
+        if self.centroids is None or len(matrix) - self._clustered > self._clustered // 4:
+            return super().grow(matrix)
+        grown = copy.copy(self)
+        grown.matrix = matrix
+        return grown
+
+    def _train(self):
+        rng = np.random.default_rng(self.seed)
+        # The training sample is a transient copy of at most max_train_size rows
+        if self.size > self.max_train_size:
+            picked = rng.choice(self.size, self.max_train_size, replace=False)
+            sample = self.matrix[self._matrix_rows(np.sort(picked))]
+        else:
+            sample = self.matrix if self.rows is None else self.matrix[self.rows]
+
+        centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].astype(np.float32)
+        for _ in range(self.n_iter):
+            assignments = np.argmax(similarities(sample, centroids), axis=0)
+            for c in range(self.nlist):
+                members = sample[assignments == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0, dtype=np.float32)
+                else:
+                    centroids[c] = sample[rng.integers(len(sample))]
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        return centroids
+
+    def search(self, query, k=1):
+        if self.centroids is None:
+            return BruteForceBackend.search(self, query, k)
+
+        probes = top_k(self.centroids @ query, self.nprobe)
+        candidate_positions = [self._order[self._offsets[c]:self._offsets[c + 1]] for c in probes]
+        if self._clustered < self.size:
+            candidate_positions.append(np.arange(self._clustered, self.size))
+        positions = np.concatenate(candidate_positions) if candidate_positions else np.empty(0, dtype=np.int64)
+        if not len(positions):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        scores = similarities(self.matrix, query, self._matrix_rows(positions))
+        best = top_k(scores, k)
+        return positions[best], scores[best]
+
+
+def create_backend(config=None):
+    """Instantiate the backend configured in settings.CHATBOT_RETRIEVAL."""
+    if config is None:
+        config = getattr(settings, 'CHATBOT_RETRIEVAL', {})
+    backend_class = import_string(config.get('BACKEND', DEFAULT_BACKEND))
+    return backend_class(**config.get('OPTIONS', {}))
@@ -0,0 +1,133 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import FAQ, Document, FAQVariant
+
+
+def _clear_answer_caches():
+    from .cache import get_answer_cache
+
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        answer_cache.clear()
+
+
+def _advance_semantic_cache(version, reset=False, dropped_faq_id=None):
+    from .cache import get_semantic_cache
+
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is not None:
+        semantic_cache.advance(version, reset=reset, dropped_faq_id=dropped_faq_id)
+
+
+def faqs_changed_in_bulk():
+    """
+    Catch indexes and caches up after FAQ writes that bypass the model signals
+    (bulk_create, bulk_update, queryset.update). Call inside the writing transaction.
+    """
+    from .index import bump_version, faq_index
+
+    version = bump_version()
+    transaction.on_commit(faq_index.invalidate)
+    transaction.on_commit(lambda: _advance_semantic_cache(version, reset=True))
+    transaction.on_commit(_clear_answer_caches)
+
+
+@receiver(pre_save, sender=FAQ)
+@receiver(pre_save, sender=FAQVariant)
+def embed_faq_question(sender, instance, raw=False, **kwargs):
+    # Fixtures are loaded as-is
+    if raw:
+        return
+
+    # New rows may arrive with an embedding computed in bulk by the caller
+    if instance.embedding is not None:
+        if instance.pk is None:
+            return
+        stored_question = sender.objects.filter(pk=instance.pk).values_list('question', flat=True).first()
+        if stored_question == instance.question:
+            return
+
+    from .embeddings import encode, get_model, to_bytes
+    from .index import recorded_model_name
+    from .jobs import queue_enabled
+
+    # A vector made ahead for a model migration is of the old text
+    instance.next_embedding = None
+    if queue_enabled():
+        # The worker embeds it; an edited row keeps its previous embedding until then
+        instance._embedding_queued = True
+        return
+    model_name = recorded_model_name()
+    instance.embedding = to_bytes(encode([instance.question], model=get_model(model_name))[0])
+    instance.embedding_model = model_name
+    instance._embedding_changed = True
+
+
+def _queue_embedding(kind, instance):
+    from .jobs import enqueue
+
+    if instance.__dict__.pop('_embedding_queued', False):
+        enqueue(kind, [instance.pk])
+
+
+@receiver(post_save, sender=FAQ)
+def index_saved_faq(sender, instance, created=False, raw=False, **kwargs):
+    from .index import bump_version, faq_index
+
+    # The stamp is bumped inside the write's transaction; this process applies it once committed
+    version = bump_version()
+    _queue_embedding('faq', instance)
+    embedding_changed = instance.__dict__.pop('_embedding_changed', False) or created
+    transaction.on_commit(lambda: faq_index.upsert(instance, version))
+    transaction.on_commit(lambda: _advance_semantic_cache(version, reset=embedding_changed))
+    transaction.on_commit(_clear_answer_caches)
+
+
+@receiver(post_delete, sender=FAQ)
+def unindex_deleted_faq(sender, instance, **kwargs):
+    from .index import bump_version, faq_index
+
+    version = bump_version()
+    faq_id = instance.pk
+    transaction.on_commit(lambda: faq_index.remove(faq_id, version))
+    transaction.on_commit(lambda: _advance_semantic_cache(version, dropped_faq_id=faq_id))
+    transaction.on_commit(_clear_answer_caches)
+
+
+@receiver(post_save, sender=FAQVariant)
+def index_saved_variant(sender, instance, created=False, raw=False, **kwargs):
+    from .index import bump_version, faq_index
+
+    version = bump_version()
+    instance.__dict__.pop('_embedding_changed', None)
+    _queue_embedding('variant', instance)
+    # A new phrasing, or one moved to another FAQ, can change any cached match
+    transaction.on_commit(lambda: faq_index.upsert_variant(instance, version))
+    transaction.on_commit(lambda: _advance_semantic_cache(version, reset=True))
+    transaction.on_commit(_clear_answer_caches)
+
+
+@receiver(post_delete, sender=FAQVariant)
+def unindex_deleted_variant(sender, instance, **kwargs):
+    from .index import bump_version, faq_index
+
+    version = bump_version()
+    variant_id = instance.pk
+    faq_id = instance.faq_id
+    # Questions that matched the FAQ through this phrasing may now match another FAQ
+    transaction.on_commit(lambda: faq_index.remove_variant(variant_id, version))
+    transaction.on_commit(lambda: _advance_semantic_cache(version, dropped_faq_id=faq_id))
+    transaction.on_commit(_clear_answer_caches)
+
+
+@receiver(post_delete, sender=Document)
+def unindex_deleted_document(sender, instance, **kwargs):
+    from .index import bump_version
+    from .passages import PASSAGE_INDEX_KEY, passage_index
+
+    # Inactive documents are imports in progress, never searched
+    if instance.active:
+        bump_version(PASSAGE_INDEX_KEY)
+        transaction.on_commit(passage_index.invalidate)
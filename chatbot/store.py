@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'CURRENT.json'
+# Row kinds in the sidecar, matching the FAQ index's row keys
+ROW_KINDS = ('faq', 'variant')
+
+
+def text_hash(text):
+    """Stable signed 64-bit hash of a phrasing, stored per row to detect edits made after a store was written."""
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'little', signed=True)
+
+
+class MappedEmbeddings:
+    """One store version: the read-only mapped matrix and its row sidecar."""
+
+    def __init__(self, manifest, matrix, rows):
+        self.generation = manifest['generation']
+        self.index_version = manifest.get('index_version')
+        self.model = manifest.get('model')
+        self.matrix = matrix
+        # Sidecar columns: row kind, primary key, FAQ id, question hash
+        self.kinds = rows[:, 0]
+        self.pks = rows[:, 1]
+        self.faq_ids = rows[:, 2]
+        self.hashes = rows[:, 3]
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def keys(self):
+        return [(ROW_KINDS[kind], pk) for kind, pk in zip(self.kinds.tolist(), self.pks.tolist())]
+
+
+class EmbeddingStore:
+    """
+    Versioned embedding matrix on disk, memory-mapped read-only by every worker.
+
+    Each version is an .npy matrix (float32 or float16) plus an .rows.npy sidecar
+    of row keys, FAQ ids and question hashes. A new version is written under
+    temporary names and renamed into place, then published by atomically
+    replacing CURRENT.json, so readers only ever see complete versions. Because
+    the files are mapped rather than read, all workers on a host share one copy
+    of the pages through the OS page cache.
+    """
+
+    def __init__(self, path, dtype='float32', keep=2):
+        self.path = Path(path)
+        self.dtype = np.dtype(dtype)
+        self.keep = keep
+        self._mapped = None
+        self._lock = threading.Lock()
+
+    def _file(self, generation, suffix):
+        return self.path / f'embeddings.{generation}{suffix}'
+
+    def manifest(self):
+        try:
+            with open(self.path / MANIFEST) as fh:
+                return json.load(fh)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def open(self):
+        """The current version, mapped read-only, or None when nothing has been written yet."""
+        manifest = self.manifest()
+        if manifest is None:
+            return None
+        with self._lock:
+            if self._mapped is None or self._mapped.generation != manifest['generation']:
+                generation = manifest['generation']
+                try:
+                    matrix = np.load(self._file(generation, '.npy'), mmap_mode='r')
+                    rows = np.load(self._file(generation, '.rows.npy'))
+                except FileNotFoundError:
+                    logger.warning("Embedding store version %s is missing its files", generation)
+                    return None
+                self._mapped = MappedEmbeddings(manifest, matrix, rows)
+        return self._mapped
+
+    def write(self, rows, n_rows, dim, index_version=None, model=None):
+        """
+        Write and publish a new version from an iterable of
+        (kind, pk, faq_id, question, normalized vector) for exactly `n_rows` rows.
+
+        Rows are streamed into the mapped file, so the whole matrix is never
+        held in memory. Returns the new generation number.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        previous = self.manifest()
+        generation = previous['generation'] + 1 if previous else 1
+        matrix_path = self._file(generation, '.npy')
+        rows_path = self._file(generation, '.rows.npy')
+        tmp_matrix = matrix_path.with_name(matrix_path.name + '.tmp')
+        tmp_rows = rows_path.with_name(rows_path.name + '.tmp')
+
+        matrix = np.lib.format.open_memmap(tmp_matrix, mode='w+', dtype=self.dtype, shape=(n_rows, dim))
+        sidecar = np.empty((n_rows, 4), dtype=np.int64)
+        written = 0
+        try:
+            for kind, pk, faq_id, question, vector in rows:
+                if written == n_rows:
+                    raise ValueError(f"Expected {n_rows} rows, got more")
+                matrix[written] = vector
+                sidecar[written] = (ROW_KINDS.index(kind), pk, faq_id, text_hash(question))
+                written += 1
+            if written != n_rows:
+                raise ValueError(f"Expected {n_rows} rows, got {written}")
+            matrix.flush()
+        except BaseException:
+            del matrix
+            os.unlink(tmp_matrix)
+            raise
+        del matrix
+        with open(tmp_rows, 'wb') as fh:
+            np.save(fh, sidecar)
+
+        os.replace(tmp_matrix, matrix_path)
+        os.replace(tmp_rows, rows_path)
+        manifest = {
+            'generation': generation,
+            'index_version': index_version,
+            'model': model,
+            'dtype': self.dtype.name,
+            'rows': n_rows,
+            'dim': dim,
+        }
+        tmp_manifest = self.path / (MANIFEST + '.tmp')
+        with open(tmp_manifest, 'w') as fh:
+            json.dump(manifest, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_manifest, self.path / MANIFEST)
+
+        self._prune(generation)
+        return generation
+
+    def _prune(self, generation):
+        # Workers still mapping an unlinked version keep reading it until they swap
+        for path in self.path.glob('embeddings.*.npy'):
+            try:
+                old = int(path.name.split('.')[1])
+            except ValueError:
+                continue
+            if old <= generation - self.keep:
+                path.unlink(missing_ok=True)
+
+
+def export_embeddings(store, index_version=None, chunk_size=2000):
+    """
+    Publish the embeddings stored in the database as a new store version.
+
+    Rows without an embedding yet are left out; workers read those from the
+    database. Call inside a transaction so the row count and the rows agree.
+    """
+    from .embeddings import EMBEDDING_DTYPE, from_bytes
+    from .index import current_state
+    from .models import FAQ, FAQVariant
+
+    faqs = FAQ.objects.filter(embedding__isnull=False).order_by('pk')
+    variants = FAQVariant.objects.filter(embedding__isnull=False).order_by('pk')
+    n_rows = faqs.count() + variants.count()
+    first = faqs.values_list('embedding', flat=True).first() or variants.values_list('embedding', flat=True).first()
+    dim = len(from_bytes(first)) if first is not None else 0
+
+    def rows():
+        for pk, question, embedding in faqs.values_list('pk', 'question', 'embedding').iterator(chunk_size):
+            yield 'faq', pk, pk, question, _unit(from_bytes(embedding), EMBEDDING_DTYPE)
+        for pk, faq_id, question, embedding in variants.values_list(
+                'pk', 'faq_id', 'question', 'embedding').iterator(chunk_size):
+            yield 'variant', pk, faq_id, question, _unit(from_bytes(embedding), EMBEDDING_DTYPE)
+
+    return store.write(rows(), n_rows, dim, index_version=index_version, model=current_state()[1] or None)
+
+
+def _unit(vector, dtype):
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).astype(dtype, copy=False)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_embedding_store():
+    """Process-wide store configured by settings.CHATBOT_EMBEDDING_STORE, or None when disabled."""
+    global _store
+    config = getattr(settings, 'CHATBOT_EMBEDDING_STORE', {})
+    if not config.get('PATH'):
+        return None
+    if _store is None or _store.path != Path(config['PATH']):
+        with _store_lock:
+            if _store is None or _store.path != Path(config['PATH']):
+                _store = EmbeddingStore(config['PATH'], dtype=config.get('DTYPE', 'float32'),
+                                        keep=config.get('KEEP', 2))
+    return _store
@@ -1,3 +1,1075 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_login_failed
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from . import embeddings, views
+from .batching import EncodeBatcher
+from .cache import SemanticCache, get_answer_cache, get_semantic_cache
+from .documents import chunk_blocks
+from .importers import CappedReader, ImportFormatError, ImportLimitError, import_faqs, iter_json_array
+from .index import CategoryPartitions, bump_version, current_state, current_version, faq_index
+from .jobs import EmbeddingWorker
+from .management.commands.rebuild_faq_embeddings import Command as RebuildCommand
+from .matching import answer_questions, rank_embeddings
+from .models import FAQ, EmbeddingJob, FAQVariant, IndexVersion, QueryLog
+from .passages import passage_index
+from .provisioning import RosterError, parse_range, provision_users, range_roster, read_roster
+from .querylog import QueryLogBuffer, cluster_questions
+from .reranking import CrossEncoderReranker
+from .retrieval import BruteForceBackend, IVFBackend, StackedRows
+from .store import EmbeddingStore, get_embedding_store
+from .workers import InferencePool, InferencePoolFull
+
+
+class FakeEncoder:
+    """Deterministic stand-in for SentenceTransformer: a bag of hashed words, 32 dimensions for '*-small' models."""
+
+    def __init__(self, model_name, **options):
+        self.dim = 32 if model_name.endswith('-small') else 64
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False):
+        matrix = np.full((len(sentences), self.dim), 1e-3, dtype=np.float32)
+        for row, sentence in enumerate(sentences):
+            for word in re.findall(r'\w+', sentence.lower()):
+                matrix[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim] += 1.0
+        if normalize_embeddings:
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix
+
+
+@override_settings(
+    CHATBOT_EMBEDDING_MODEL='fake-encoder',
+    CHATBOT_ENCODER={'BACKEND': 'fake', 'OPTIONS': {}},
+    CHATBOT_ENCODE_BATCHING={'ENABLED': False},
+    CHATBOT_EMBEDDING_STORE={'PATH': None},
+    CHATBOT_INDEX_CHECK_INTERVAL=0,
+    CHATBOT_QUERY_LOG={'ENABLED': False},
+    CHATBOT_DOCUMENTS={'ENABLED': False},
+)
+class ChatbotTestCase(TestCase):
+    """Runs with FakeEncoder in place of the SBERT model and fresh process-wide indexes and caches."""
+
+    def setUp(self):
+        patcher = mock.patch.dict(embeddings.ENCODER_BACKENDS, {'fake': FakeEncoder})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        embeddings._loaded = None
+        self.addCleanup(setattr, embeddings, '_loaded', None)
+        faq_index.invalidate()
+        passage_index.invalidate()
+        for cache in (get_answer_cache(), get_semantic_cache()):
+            if cache is not None:
+                cache.clear()
+
+    def create_faq(self, question, answer, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return FAQ.objects.create(question=question, answer=answer, **fields)
+
+    def ask(self, question, category=None):
+        return answer_questions([question], category)[0]
+
+
+class FAQIndexTests(ChatbotTestCase):
+    def test_save_embeds_and_indexes(self):
+        faq = self.create_faq('Where is the library?', 'Block A')
+        self.assertEqual(faq.embedding_model, 'fake-encoder')
+        self.assertEqual(current_state(), (faq_index.version, 'fake-encoder'))
+        self.assertEqual(self.ask('where is the library')['faq_id'], faq.pk)
+
+    def test_save_and_delete_bump_the_version(self):
+        faq = self.create_faq('Where is the library?', 'Block A')
+        version = current_version()
+        faq.answer = 'Block B'
+        with self.captureOnCommitCallbacks(execute=True):
+            faq.save()
+        self.assertEqual(current_version(), version + 1)
+        self.assertEqual(faq_index.version, version + 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            faq.delete()
+        self.assertEqual(current_version(), version + 2)
+        self.assertEqual(faq_index.version, version + 2)
+
+    def test_upsert_and_remove_apply_in_place(self):
+        library = self.create_faq('Where is the library?', 'Block A')
+        faq_index.ensure_fresh()
+        with mock.patch.object(faq_index, 'reload') as reload:
+            gym = self.create_faq('When does the gym open?', '6 am')
+            self.assertEqual(len(faq_index), 2)
+            self.assertEqual(self.ask('when does the gym open')['faq_id'], gym.pk)
+            with self.captureOnCommitCallbacks(execute=True):
+                gym.delete()
+            self.assertEqual(len(faq_index), 1)
+            self.assertIsNone(self.ask('when does the gym open')['faq_id'])
+            self.assertEqual(self.ask('where is the library')['faq_id'], library.pk)
+        reload.assert_not_called()
+
+    def test_writes_append_in_place_and_tombstone_until_compaction(self):
+        library = self.create_faq('Where is the library?', 'Block A')
+        faq_index.ensure_fresh()
+        gym = self.create_faq('When does the gym open?', '6 am')
+        # The first write after a load moves the loaded rows into a buffer with room to spare
+        buffer = faq_index._rows._tail
+        self.assertGreater(len(buffer), len(faq_index))
+        with mock.patch.object(faq_index, 'reload') as reload:
+            gym.question = 'When does the pool open?'
+            with self.captureOnCommitCallbacks(execute=True):
+                gym.save()
+            # The replaced row is tombstoned and the new one written into the same buffer
+            self.assertIs(faq_index._rows._tail, buffer)
+            self.assertEqual(faq_index._snapshot[4], 1)
+            self.assertEqual(len(faq_index), 2)
+            self.assertEqual(self.ask('when does the pool open')['faq_id'], gym.pk)
+            with mock.patch('chatbot.index.MAX_DEAD_ROWS', 1), self.captureOnCommitCallbacks(execute=True):
+                library.delete()
+            ids, _, _, _, dead = faq_index._snapshot
+            self.assertEqual((ids.tolist(), dead), ([gym.pk], 0))
+            self.assertEqual(self.ask('when does the pool open')['faq_id'], gym.pk)
+        reload.assert_not_called()
+
+    def test_edited_question_is_reembedded(self):
+        faq = self.create_faq('Where is the library?', 'Block A')
+        faq.question = 'When does the gym open?'
+        with self.captureOnCommitCallbacks(execute=True):
+            faq.save()
+        self.assertEqual(self.ask('when does the gym open')['faq_id'], faq.pk)
+        self.assertIsNone(self.ask('where is the library')['faq_id'])
+
+    def test_variant_matches_its_faq(self):
+        faq = self.create_faq('Where is the library?', 'Block A')
+        with self.captureOnCommitCallbacks(execute=True):
+            variant = FAQVariant.objects.create(faq=faq, question='How do I find the reading room?')
+        self.assertEqual(self.ask('find the reading room')['faq_id'], faq.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            variant.delete()
+        self.assertIsNone(self.ask('find the reading room')['faq_id'])
+
+    def test_close_candidates_are_offered_as_alternatives(self):
+        library = self.create_faq('Where is the library?', 'Block A')
+        cafe = self.create_faq('Where is the library cafe?', 'Ground floor')
+        result = self.ask('where is the library')
+        self.assertEqual(result['faq_id'], library.pk)
+        self.assertEqual([alternative['faq_id'] for alternative in result['alternatives']], [cafe.pk])
+
+    def test_writes_of_other_processes_reload_the_index(self):
+        faq = self.create_faq('Where is the library?', 'Block A')
+        self.assertEqual(self.ask('where is the library')['faq_id'], faq.pk)
+        # Written by another process: no signal reaches this one, only the stamp moves
+        FAQ.objects.filter(pk=faq.pk).update(answer='Block B')
+        bump_version()
+        self.assertEqual(self.ask('where is the library')['answer'], 'Block B')
+
+    def test_rows_saved_without_the_signal_are_embedded_once(self):
+        FAQ.objects.bulk_create([FAQ(question='Where is the library?', answer='Block A')])
+        self.assertEqual(self.ask('where is the library')['faq_id'], FAQ.objects.get().pk)
+        self.assertIsNotNone(FAQ.objects.get().embedding)
+        faq_index.invalidate()
+        with mock.patch('chatbot.index.encode') as encode:
+            self.ask('where is the library')
+        encode.assert_not_called()
+
+
+@override_settings(CHATBOT_EMBEDDING_MODEL='fake-encoder', CHATBOT_ENCODER={'BACKEND': 'fake', 'OPTIONS': {'x': 1}})
+class ModelLoadingTests(TestCase):
+    def test_model_is_loaded_once_on_first_use(self):
+        load = mock.Mock(side_effect=FakeEncoder)
+        with mock.patch.dict(embeddings.ENCODER_BACKENDS, {'fake': load}), mock.patch.object(embeddings, '_loaded'):
+            embeddings._loaded = None
+            load.assert_not_called()
+            embeddings.encode(['where is the library'])
+            embeddings.encode(['when does the gym open'])
+        load.assert_called_once_with('fake-encoder', x=1)
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            embeddings.load_model(backend='tensorrt')
+
+
+class AnswerCacheTests(ChatbotTestCase):
+    def test_answer_is_cached(self):
+        self.create_faq('Where is the library?', 'Block A')
+        self.ask('Where is the library?')
+        with mock.patch('chatbot.matching.encode_query') as encode_query:
+            self.assertEqual(self.ask('where is the LIBRARY')['answer'], 'Block A')
+        encode_query.assert_not_called()
+
+    def test_version_bump_invalidates_cached_answers(self):
+        faq = self.create_faq('Where is the library?', 'Block A')
+        self.assertEqual(self.ask('Where is the library?')['answer'], 'Block A')
+        # Written by another process: no signal clears this process's cache, only the stamp moves
+        FAQ.objects.filter(pk=faq.pk).update(answer='Block B')
+        bump_version()
+        self.assertEqual(self.ask('Where is the library?')['answer'], 'Block B')
+
+
+class SemanticCacheTests(ChatbotTestCase):
+    def vector(self, *values):
+        vector = np.array(values, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def test_near_duplicates_hit_and_others_miss(self):
+        cache = SemanticCache(max_size=4, max_distance=0.05)
+        cache.add(1, self.vector(1, 0, 0), [(7, 0.75), (8, 0.5)], k=2)
+        self.assertEqual(cache.lookup(1, self.vector(1, 0.1, 0), k=2), [(7, 0.75), (8, 0.5)])
+        self.assertIsNone(cache.lookup(1, self.vector(1, 1, 0), k=2))
+        # Another process moved the index: everything cached is stale
+        self.assertIsNone(cache.lookup(2, self.vector(1, 0, 0), k=2))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_advance_drops_what_a_write_affects(self):
+        cache = SemanticCache(max_size=4, max_distance=0.05)
+        cache.add(1, self.vector(1, 0, 0), [(7, 0.75)])
+        cache.add(1, self.vector(0, 1, 0), [(8, 0.75)])
+        cache.advance(2)
+        self.assertEqual(cache.lookup(2, self.vector(1, 0, 0)), [(7, 0.75)])
+        cache.advance(3, dropped_faq_id=7)
+        self.assertIsNone(cache.lookup(3, self.vector(1, 0, 0)))
+        self.assertEqual(cache.lookup(3, self.vector(0, 1, 0)), [(8, 0.75)])
+        cache.advance(4, reset=True)
+        self.assertIsNone(cache.lookup(4, self.vector(0, 1, 0)))
+
+    def rank(self, question, category=None):
+        with mock.patch.object(faq_index, 'rank_many', wraps=faq_index.rank_many) as rank_many:
+            ranked = rank_embeddings(embeddings.encode_query(question)[np.newaxis, :], [question], category)[0]
+        return [faq.id for faq, _ in ranked], rank_many.called
+
+    def test_faq_edits_and_deletes_invalidate_cached_rankings(self):
+        faq = self.create_faq('Where is the library?', 'Block A', category='campus')
+        self.assertEqual(self.rank('where is the library'), ([faq.pk], True))
+        self.assertEqual(self.rank('Where is the library?'), ([faq.pk], False))
+        faq.question = 'Where is the main library?'
+        with self.captureOnCommitCallbacks(execute=True):
+            faq.save()
+        self.assertEqual(self.rank('where is the library'), ([faq.pk], True))
+        with self.captureOnCommitCallbacks(execute=True):
+            faq.delete()
+        self.assertEqual(self.rank('where is the library'), ([], True))
+
+    def test_category_searches_bypass_the_cache(self):
+        faq = self.create_faq('Where is the library?', 'Block A', category='campus')
+        self.rank('where is the library')
+        self.assertEqual(self.rank('where is the library', 'campus'), ([faq.pk], True))
+
+
+@override_settings(CHATBOT_HYBRID={'MODE': 'shortcircuit', 'SHORTCIRCUIT_SCORE': 0.5, 'SHORTCIRCUIT_MARGIN': 1.5})
+class LexicalShortcircuitTests(ChatbotTestCase):
+    def test_distinctive_keywords_answer_without_encoding(self):
+        faq = self.create_faq('What is the CS3201 syllabus?', 'See the portal')
+        self.create_faq('Where is the library?', 'Block A')
+        with mock.patch('chatbot.matching.encode_query') as encode_query:
+            result = self.ask('CS3201 syllabus')
+        encode_query.assert_not_called()
+        self.assertEqual(result['faq_id'], faq.pk)
+        self.assertNotIn('score', result)
+        self.assertGreaterEqual(result['lexical_score'], 0.5)
+
+    def test_common_words_are_encoded(self):
+        library = self.create_faq('Where is the library?', 'Block A')
+        self.create_faq('Where is the library cafe?', 'Block B')
+        with mock.patch('chatbot.matching.encode_query', wraps=embeddings.encode_query) as encode_query:
+            self.assertEqual(self.ask('where is the library')['faq_id'], library.pk)
+        encode_query.assert_called_once()
+
+    def test_only_the_requested_category_is_considered(self):
+        self.create_faq('What is the CS3201 syllabus?', 'See the portal', category='academics')
+        library = self.create_faq('Where is the library?', 'Block A', category='campus')
+        with mock.patch('chatbot.matching.encode_query', wraps=embeddings.encode_query) as encode_query:
+            result = self.ask('CS3201 syllabus', category='campus')
+        encode_query.assert_called_once()
+        self.assertNotIn('lexical_score', result)
+        self.assertNotEqual(result['faq_id'], library.pk)
+        self.assertEqual(self.ask('CS3201 syllabus', category='academics')['answer'], 'See the portal')
+
+
+class HybridSearchTests(ChatbotTestCase):
+    def test_fusion_modes_find_the_semantic_match(self):
+        library = self.create_faq('Where is the library?', 'Block A')
+        self.create_faq('When does the gym open?', '6 am')
+        for mode in ('rerank', 'rrf'):
+            with self.subTest(mode=mode), override_settings(CHATBOT_HYBRID={'MODE': mode, 'CANDIDATES': 5}):
+                get_answer_cache().clear()
+                get_semantic_cache().clear()
+                self.assertEqual(self.ask('where is the library')['faq_id'], library.pk)
+                # Only stopwords: no BM25 candidates, so the semantic search decides alone
+                self.assertIsNone(self.ask('what is it')['faq_id'])
+
+
+class CategoryRoutingTests(ChatbotTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hostel = self.create_faq('Where is the hostel office?', 'Block H', category='hostel')
+        self.exams = self.create_faq('When are the exam results out?', 'June', category='exams')
+
+    def rank(self, question, category=None):
+        ranked = faq_index.rank_many(embeddings.encode_query(question)[np.newaxis, :], k=2, category=category)[0]
+        return [faq.id for faq, _ in ranked]
+
+    def test_explicit_category_answers_from_its_rows(self):
+        exam_office = self.create_faq('Where is the hostel office?', 'Block E', category='exams')
+        self.assertEqual(self.rank('where is the hostel office', 'hostel')[0], self.hostel.pk)
+        self.assertEqual(self.rank('where is the hostel office', 'exams')[0], exam_office.pk)
+
+    def test_weak_or_unknown_category_falls_back_to_the_whole_index(self):
+        self.assertEqual(self.rank('when are the exam results out', 'hostel')[0], self.exams.pk)
+        self.assertEqual(self.rank('when are the exam results out', 'library')[0], self.exams.pk)
+        with override_settings(CHATBOT_CATEGORY_ROUTING={'FALLBACK_SCORE': 0.0}):
+            self.assertEqual(self.rank('when are the exam results out', 'hostel'), [self.hostel.pk])
+
+    def test_auto_routes_to_a_clearly_closest_category(self):
+        with mock.patch.object(CategoryPartitions, 'search', autospec=True,
+                               side_effect=CategoryPartitions.search) as search:
+            with override_settings(CHATBOT_CATEGORY_ROUTING={'AUTO': True, 'MIN_MARGIN': 0.05}):
+                self.assertEqual(self.rank('exam results')[0], self.exams.pk)
+            self.assertEqual(search.call_args.args[2], 'exams')
+            search.reset_mock()
+            with override_settings(CHATBOT_CATEGORY_ROUTING={'AUTO': True, 'MIN_MARGIN': 1.0}):
+                self.assertEqual(self.rank('exam results')[0], self.exams.pk)
+            search.assert_not_called()
+
+    def test_variant_rows_follow_their_faq_to_a_new_category(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            FAQVariant.objects.create(faq=self.hostel, question='Where do I report a broken fan?')
+        faq_index.ensure_fresh()
+        self.hostel.category = 'maintenance'
+        with mock.patch.object(faq_index, 'reload') as reload, self.captureOnCommitCallbacks(execute=True):
+            self.hostel.save()
+        reload.assert_not_called()
+        ids, _, _, partitions, _ = faq_index._snapshot
+        self.assertEqual(set(partitions.categories[ids == self.hostel.pk]), {'maintenance'})
+        with override_settings(CHATBOT_CATEGORY_ROUTING={'FALLBACK_SCORE': 0.0}):
+            self.assertEqual(self.rank('report a broken fan', 'maintenance'), [self.hostel.pk])
+
+
+class EmbeddingStoreTests(ChatbotTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(CHATBOT_EMBEDDING_STORE={'PATH': self.path, 'KEEP': 2}))
+
+    def rows(self, *values):
+        return [('faq', i + 1, i + 1, f'question {i}', np.full(4, value, dtype=np.float32))
+                for i, value in enumerate(values)]
+
+    def test_write_open_and_swap(self):
+        store = EmbeddingStore(self.path)
+        self.assertIsNone(store.open())
+        self.assertEqual(store.write(self.rows(0.5, 0.25), 2, 4, index_version=7, model='fake-encoder'), 1)
+        first = store.open()
+        self.assertEqual((first.generation, first.index_version, first.model), (1, 7, 'fake-encoder'))
+        self.assertEqual(first.keys(), [('faq', 1), ('faq', 2)])
+        self.assertEqual(first.matrix[1].tolist(), [0.25] * 4)
+        self.assertIs(store.open(), first)
+
+        store.write(self.rows(1.0), 1, 4)
+        store.write(self.rows(2.0), 1, 4)
+        self.assertEqual(store.open().generation, 3)
+        # A reader that mapped an older version keeps reading it after it is pruned
+        self.assertEqual(first.matrix[0].tolist(), [0.5] * 4)
+        self.assertFalse((self.path / 'embeddings.1.npy').exists())
+
+    def test_failed_write_leaves_the_published_version(self):
+        store = EmbeddingStore(self.path)
+        store.write(self.rows(0.5), 1, 4)
+        with self.assertRaises(ValueError):
+            store.write(self.rows(1.0, 2.0), 3, 4)
+        self.assertEqual(store.manifest()['generation'], 1)
+        self.assertEqual(store.open().matrix[0].tolist(), [0.5] * 4)
+        self.assertEqual(sorted(path.name for path in self.path.iterdir()),
+                         ['CURRENT.json', 'embeddings.1.npy', 'embeddings.1.rows.npy'])
+
+    def test_index_maps_each_new_version_without_a_restart(self):
+        self.create_faq('Where is the library?', 'Block A')
+        call_command('rebuild_faq_embeddings', '--store-only', stdout=io.StringIO())
+        faq_index.ensure_fresh()
+        self.assertIsInstance(faq_index._snapshot[1], np.memmap)
+        self.create_faq('When does the gym open?', '6 am')
+        call_command('rebuild_faq_embeddings', '--store-only', stdout=io.StringIO())
+        faq_index.ensure_fresh()
+        matrix = faq_index._snapshot[1]
+        self.assertIsInstance(matrix, np.memmap)
+        self.assertEqual((get_embedding_store().open().generation, len(matrix)), (2, 2))
+        self.assertEqual(self.ask('when does the gym open')['answer'], '6 am')
+
+    def test_stale_store_rows_are_tombstoned_instead_of_copied(self):
+        library = self.create_faq('Where is the library?', 'Block A')
+        self.create_faq('When does the gym open?', '6 am')
+        call_command('rebuild_faq_embeddings', '--store-only', stdout=io.StringIO())
+        # Written by another process after the store was published
+        library.question = 'Canteen opening hours?'
+        with self.captureOnCommitCallbacks(execute=True):
+            library.save()
+        faq_index.reload()
+        ids, matrix, _, _, dead = faq_index._snapshot
+        self.assertIs(matrix.head, get_embedding_store().open().matrix)
+        self.assertEqual((len(matrix), dead, len(faq_index)), (3, 1, 2))
+        self.assertEqual(self.ask('canteen opening hours')['faq_id'], library.pk)
+        self.assertIsNone(self.ask('where is the library')['faq_id'])
+
+
+class ImportTests(ChatbotTestCase):
+    def test_iter_json_array(self):
+        stream = io.StringIO('[{"question": "a"}, {"question": "b"}, 3, "x", [1, 2]]')
+        self.assertEqual(list(iter_json_array(stream, chunk_size=4)),
+                         [{'question': 'a'}, {'question': 'b'}, 3, 'x', [1, 2]])
+        self.assertEqual(list(iter_json_array(io.StringIO(' [ ] '))), [])
+
+    def test_iter_json_array_items_split_across_chunks(self):
+        document = '[12345, -6.5e-10, true, null, "a\\u00e9b", {"q": [1, 2.25]}, 1E+3]'
+        for chunk_size in range(1, len(document) + 1):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(list(iter_json_array(io.StringIO(document), chunk_size=chunk_size)),
+                                 [12345, -6.5e-10, True, None, 'a\u00e9b', {'q': [1, 2.25]}, 1000.0])
+
+    def test_iter_json_array_rejects_other_documents(self):
+        for document in ('{"question": "a"}', '', '[{"question": "a"}', '[1 2]', '[,,1]', '[1,]', '[1,,2]',
+                         '[1] x', '[1]]', '[tru]', '[1.]'):
+            for chunk_size in (1, 4, 100):
+                with self.subTest(document=document, chunk_size=chunk_size), self.assertRaises(ImportFormatError):
+                    list(iter_json_array(io.StringIO(document), chunk_size=chunk_size))
+
+    def test_iter_json_array_stops_reading_at_the_first_error(self):
+        stream = io.StringIO('[1 2' + ' 3' * 10000 + ']')
+        with self.assertRaises(ImportFormatError):
+            list(iter_json_array(stream, chunk_size=16))
+        self.assertEqual(stream.tell(), 16)
+
+    def test_import_counts_and_dedupes(self):
+        self.create_faq('Where is the library?', 'Block A')
+        result = import_faqs([
+            {'question': 'Where is the library?', 'answer': 'again'},
+            {'question': 'When does the gym open?', 'answer': '6 am', 'variants': ['gym timings']},
+            {'question': 'When does the gym open?', 'answer': 'duplicate'},
+            {'question': '', 'answer': 'no question'},
+            ImportFormatError('line 5: bad'),
+            {'question': 'Is there a canteen?', 'answer': 'Yes'},
+        ], batch_size=1)
+        self.assertEqual((result['inserted'], result['skipped'], result['failed']), (2, 2, 2))
+        self.assertEqual(len(result['errors']), 2)
+        self.assertEqual(FAQ.objects.count(), 3)
+        self.assertEqual(FAQ.objects.get(question='When does the gym open?').answer, '6 am')
+        self.assertFalse(FAQ.objects.filter(embedding__isnull=True).exists())
+        self.assertFalse(FAQVariant.objects.exclude(embedding_model='fake-encoder').exists())
+        self.assertEqual(self.ask('gym timings')['answer'], '6 am')
+
+    def test_invalid_fields_are_reported_per_record(self):
+        result = import_faqs([
+            {'question': 'Where is the library?', 'answer': 'Block A', 'category': 'c' * 51},
+            {'question': 'Where is the gym?', 'answer': 'Block B', 'message_type': 'm' * 51},
+            {'question': 'Where is the canteen?', 'answer': 'Block C', 'message_type': ['text']},
+            {'question': 'q' * 256, 'answer': 'Block D'},
+            {'question': 42, 'answer': 'Block E'},
+            {'question': 'Where is the hostel?', 'answer': 'Block F', 'category': 'hostel', 'message_type': 'text'},
+        ])
+        self.assertEqual((result['inserted'], result['failed']), (1, 5))
+        self.assertEqual(result['errors'], [
+            'record 1: category is too long (at most 50 characters)',
+            'record 2: message_type is too long (at most 50 characters)',
+            'record 3: message_type must be a string',
+            'record 4: question is too long (at most 255 characters)',
+            'record 5: question must be a string',
+        ])
+        self.assertEqual(FAQ.objects.values_list('category', 'message_type').get(), ('hostel', 'text'))
+
+    def test_api_imports_csv(self):
+        body = 'question,answer,category\nWhere is the library?,Block A,campus\nWhen does the gym open?,6 am,\n'
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/import-faqs/?format=csv', body, content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['inserted'], 2)
+        self.assertEqual(list(FAQ.objects.order_by('pk').values_list('category', flat=True)), ['campus', 'general'])
+        self.assertEqual(self.ask('where is the library')['answer'], 'Block A')
+
+    @override_settings(CHATBOT_IMPORT={'TOKEN': 'secret', 'MAX_UPLOAD_BYTES': 200, 'MAX_RECORDS': 2})
+    def test_api_requires_staff_or_token_and_enforces_limits(self):
+        def post(records, **headers):
+            return self.client.post('/api/import-faqs/', json.dumps(records), content_type='application/json',
+                                    **headers)
+
+        one = [{'question': 'Where is the library?', 'answer': 'Block A'}]
+        self.assertEqual(post(one).status_code, 403)
+        self.assertEqual(post(one, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(post(one, HTTP_AUTHORIZATION='Bearer secret').status_code, 201)
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        three = [{'question': f'Question {i}?', 'answer': 'yes'} for i in range(3)]
+        self.assertEqual(post(three).status_code, 413)
+        self.assertEqual(post([{'question': 'Long?', 'answer': 'x' * 300}]).status_code, 413)
+        self.assertEqual(FAQ.objects.count(), 1)
+        # Bodies without a usable Content-Length are counted as they are read
+        with self.assertRaises(ImportLimitError):
+            CappedReader(io.BytesIO(b'[' * 201), 200).read()
+
+
+@override_settings(CHATBOT_EMBEDDING_QUEUE={'ENABLED': True, 'BATCH_SIZE': 2, 'LEASE_SECONDS': 300})
+class EmbeddingQueueTests(ChatbotTestCase):
+    def setUp(self):
+        super().setUp()
+        self.worker = EmbeddingWorker(batch_size=2)
+
+    def drain(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            while self.worker.step():
+                pass
+
+    def test_saves_are_queued_for_the_worker(self):
+        faq = self.create_faq('Where is the library?', 'Block A')
+        self.assertIsNone(faq.embedding)
+        self.assertEqual(EmbeddingJob.objects.count(), 1)
+        self.assertIsNone(self.ask('where is the library')['faq_id'])
+        self.drain()
+        self.assertFalse(EmbeddingJob.objects.exists())
+        self.assertEqual(FAQ.objects.get().embedding_model, 'fake-encoder')
+        self.assertEqual(current_state()[1], 'fake-encoder')
+        self.assertEqual(self.ask('where is the library')['faq_id'], faq.pk)
+
+    def test_edit_keeps_the_previous_embedding_until_reembedded(self):
+        self.create_faq('Where is the library?', 'Block A')
+        self.drain()
+        faq = FAQ.objects.get()
+        embedding = bytes(faq.embedding)
+        faq.question = 'When does the gym open?'
+        with self.captureOnCommitCallbacks(execute=True):
+            faq.save()
+        self.assertEqual(bytes(FAQ.objects.get().embedding), embedding)
+        self.drain()
+        self.assertEqual(self.ask('when does the gym open')['faq_id'], faq.pk)
+
+    def test_model_change_switches_once_everything_is_reembedded(self):
+        for i, place in enumerate(['library', 'gym', 'canteen']):
+            self.create_faq(f'Where is the {place}?', f'Block {i}')
+        self.drain()
+        with override_settings(CHATBOT_EMBEDDING_MODEL='fake-encoder-small'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.worker.step(), 2)
+            state = IndexVersion.objects.get(key='faq')
+            self.assertEqual((state.embedding_model, state.next_embedding_model),
+                             ('fake-encoder', 'fake-encoder-small'))
+            # Queries keep the old model and vectors until the switch
+            self.assertEqual(self.ask('where is the gym')['answer'], 'Block 1')
+            self.assertEqual(faq_index.model_name, 'fake-encoder')
+            self.drain()
+            state.refresh_from_db()
+            self.assertEqual((state.embedding_model, state.next_embedding_model), ('fake-encoder-small', ''))
+            self.assertFalse(FAQ.objects.exclude(embedding_model='fake-encoder-small').exists())
+            self.assertFalse(FAQ.objects.filter(next_embedding__isnull=False).exists())
+            self.assertEqual(self.ask('where is the canteen')['answer'], 'Block 2')
+            self.assertEqual(faq_index.model_name, 'fake-encoder-small')
+
+    def test_unstamped_index_takes_the_model_its_rows_record(self):
+        self.create_faq('Where is the library?', 'Block A')
+        self.drain()
+        IndexVersion.objects.filter(key='faq').update(embedding_model='')
+        with override_settings(CHATBOT_EMBEDDING_MODEL='fake-encoder-small'):
+            self.worker.migrate()
+            self.assertEqual(IndexVersion.objects.get(key='faq').embedding_model, 'fake-encoder')
+            self.assertEqual(FAQ.objects.get().embedding_model, 'fake-encoder')
+
+
+class QueryLogTests(ChatbotTestCase):
+    def buffer(self, **options):
+        # No background thread: the tests flush by hand
+        buffer = QueryLogBuffer(**options)
+        self.enterContext(mock.patch.object(buffer, '_ensure_started'))
+        return buffer
+
+    def test_full_buffer_drops_the_oldest_entries(self):
+        buffer = self.buffer(max_size=3, batch_size=100)
+        for i in range(5):
+            buffer.record(f'question {i}', {'faq_id': None}, 0.01)
+        self.assertEqual(buffer.stats(), {'recorded': 5, 'written': 0, 'dropped': 2, 'pending': 3})
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(list(QueryLog.objects.order_by('pk').values_list('question', flat=True)),
+                         ['question 2', 'question 3', 'question 4'])
+
+    def test_writer_is_woken_once_a_batch_is_waiting(self):
+        buffer = self.buffer(max_size=10, batch_size=2)
+        buffer.record('where is the library', {'faq_id': 7, 'score': 0.9}, 0.02, category='campus')
+        self.assertFalse(buffer._wake.is_set())
+        buffer.record('gym timings', {'faq_id': None}, 0.01)
+        self.assertTrue(buffer._wake.is_set())
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(list(QueryLog.objects.order_by('pk').values_list('category', 'faq_id', 'answered')),
+                         [('campus', 7, True), ('', None, False)])
+        self.assertEqual(buffer.stats()['written'], 2)
+
+    def test_cluster_questions_groups_similar_questions_by_count(self):
+        vectors = np.array([[1, 0], [0.96, 0.28], [0, 1], [0.28, 0.96], [0.71, 0.71]], dtype=np.float32)
+        clusters = cluster_questions(vectors, [1, 5, 2, 1, 1], threshold=0.9)
+        self.assertEqual(clusters, [[1, 0], [2, 3], [4]])
+
+    def test_unanswered_report_lists_missing_topics(self):
+        now = timezone.now()
+        QueryLog.objects.bulk_create(
+            [QueryLog(question=question, answered=False, latency_ms=1.0, created_at=now)
+             for question in ['Hostel fee?', 'hostel fee', 'What is the hostel fee amount', 'bus route']]
+            + [QueryLog(question='gym timings', faq_id=1, answered=True, latency_ms=1.0, created_at=now)])
+        out = io.StringIO()
+        call_command('unanswered_report', '--json', '--similarity', '0.5', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['unanswered'], 4)
+        self.assertEqual([(topic['asked'], topic['distinct']) for topic in report['topics']], [(3, 2), (1, 1)])
+        self.assertIn(report['topics'][0]['samples'][0], {'Hostel fee?', 'hostel fee'})
+
+
+class BatchAPITests(ChatbotTestCase):
+    def post(self, questions):
+        return self.client.post('/api/chatbot/batch/', json.dumps({'questions': questions}),
+                                content_type='application/json')
+
+    def test_questions_are_answered_in_order_with_one_encode(self):
+        library = self.create_faq('Where is the library?', 'Block A')
+        gym = self.create_faq('When does the gym open?', '6 am')
+        faq_index.ensure_fresh()
+        with mock.patch('chatbot.matching.encode', wraps=embeddings.encode) as encode:
+            response = self.post(['when does the gym open', 'who won the match', ' where is the library '])
+        encode.assert_called_once()
+        results = response.json()['results']
+        self.assertEqual([result['faq_id'] for result in results], [gym.pk, None, library.pk])
+        self.assertEqual(results[2]['question'], 'where is the library')
+        self.assertEqual(results[1]['answer'], "Sorry, I don't know the answer to that question yet.")
+
+    @override_settings(CHATBOT_BATCH_MAX_QUESTIONS=2)
+    def test_invalid_or_oversized_batches_are_rejected(self):
+        self.assertEqual(self.post('where is the library').status_code, 400)
+        self.assertEqual(self.post(['where is the library', 3]).status_code, 400)
+        self.assertEqual(self.post(['a', 'b', 'c']).status_code, 413)
+        self.assertEqual(self.post([]).json(), {'results': []})
+
+
+def index_dim():
+    return faq_index._snapshot[1].shape[1]
+
+
+class RebuildTests(ChatbotTestCase):
+    def test_index_reloaded_mid_rebuild_keeps_the_previous_model(self):
+        for i, place in enumerate(['library', 'gym', 'canteen']):
+            self.create_faq(f'Where is the {place}?', f'Block {i}')
+        embed_batch = RebuildCommand._embed_batch
+        seen = []
+
+        def embed_and_reload(command, *args):
+            written = embed_batch(command, *args)
+            faq_index.reload()
+            seen.append((faq_index.model_name, index_dim()))
+            self.assertEqual(self.ask('where is the gym')['answer'], 'Block 1')
+            return written
+
+        with override_settings(CHATBOT_EMBEDDING_MODEL='fake-encoder-small'), \
+                mock.patch.object(RebuildCommand, '_embed_batch', embed_and_reload):
+            call_command('rebuild_faq_embeddings', batch_size=1, stdout=io.StringIO())
+            self.assertEqual(seen, [('fake-encoder', 64)] * 3)
+            state = IndexVersion.objects.get(key='faq')
+            self.assertEqual((state.embedding_model, state.next_embedding_model), ('fake-encoder-small', ''))
+            self.assertFalse(FAQ.objects.exclude(embedding_model='fake-encoder-small').exists())
+            self.assertFalse(FAQ.objects.filter(next_embedding__isnull=False).exists())
+            self.assertEqual(self.ask('where is the canteen')['answer'], 'Block 2')
+            self.assertEqual((faq_index.model_name, index_dim()), ('fake-encoder-small', 32))
+
+    def test_rows_recording_another_model_are_reembedded_on_load(self):
+        faq = self.create_faq('Where is the library?', 'Block A')
+        FAQ.objects.filter(pk=faq.pk).update(embedding=embeddings.to_bytes(np.ones(32, dtype=np.float32)),
+                                             embedding_model='fake-encoder-small')
+        with self.assertLogs('chatbot.index', 'WARNING'):
+            faq_index.reload()
+        self.assertEqual(index_dim(), 64)
+        self.assertEqual(FAQ.objects.get().embedding_model, 'fake-encoder')
+        self.assertEqual(self.ask('where is the library')['faq_id'], faq.pk)
+
+
+class RetrievalTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        matrix = rng.standard_normal((400, 16)).astype(np.float32)
+        self.matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.queries = self.matrix[:5] + 0.1
+
+    def assertSameResults(self, backend, expected):
+        for query in self.queries:
+            positions, scores = backend.search(query, k=3)
+            expected_positions, expected_scores = expected.search(query, k=3)
+            np.testing.assert_array_equal(positions, expected_positions)
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+    def test_ivf_probing_every_cluster_is_exact(self):
+        exact = BruteForceBackend()
+        exact.build(self.matrix)
+        ivf = IVFBackend(nlist=8, nprobe=8, min_train_size=50)
+        ivf.build(self.matrix)
+        self.assertIsNotNone(ivf.centroids)
+        self.assertSameResults(ivf, exact)
+
+    def test_rows_index_part_of_the_matrix_in_place(self):
+        rows = np.arange(1, 400, 2)
+        exact = BruteForceBackend()
+        exact.build(self.matrix[rows])
+        for backend in (BruteForceBackend(), IVFBackend(nlist=4, nprobe=4, min_train_size=50)):
+            backend.build(self.matrix, rows=rows)
+            self.assertIs(backend.matrix, self.matrix)
+            self.assertSameResults(backend, exact)
+
+    def test_reduced_precision_matrix(self):
+        exact = BruteForceBackend()
+        exact.build(self.matrix.astype(np.float16).astype(np.float32))
+        ivf = IVFBackend(nlist=8, nprobe=8, min_train_size=50)
+        ivf.build(self.matrix.astype(np.float16))
+        self.assertSameResults(ivf, exact)
+
+    def test_small_matrix_is_scanned_exactly(self):
+        exact = BruteForceBackend()
+        exact.build(self.matrix)
+        ivf = IVFBackend(nlist=8, nprobe=1)
+        ivf.build(self.matrix)
+        self.assertIsNone(ivf.centroids)
+        self.assertSameResults(ivf, exact)
+
+    def test_rebuild_keeps_centroids_until_the_corpus_doubles(self):
+        ivf = IVFBackend(nlist=8, nprobe=8, min_train_size=50)
+        ivf.build(self.matrix[:150])
+        grown = IVFBackend(nlist=8, nprobe=8, min_train_size=50)
+        grown.build(self.matrix[:300], previous=ivf)
+        self.assertIs(grown.centroids, ivf.centroids)
+        retrained = IVFBackend(nlist=8, nprobe=8, min_train_size=50)
+        retrained.build(self.matrix, previous=grown)
+        self.assertIsNot(retrained.centroids, ivf.centroids)
+        self.assertEqual(retrained.trained_size, 400)
+
+    def test_ivf_grow_scans_appended_rows_until_reclustered(self):
+        self.queries = self.matrix[360:365] + 0.1
+        exact = BruteForceBackend()
+        exact.build(self.matrix)
+        ivf = IVFBackend(nlist=8, nprobe=8, min_train_size=50)
+        ivf.build(self.matrix[:350])
+        grown = ivf.grow(self.matrix)
+        self.assertIs(grown._order, ivf._order)
+        self.assertEqual(ivf.size, 350)
+        self.assertSameResults(grown, exact)
+        self.assertIsNot(ivf.grow(np.vstack([self.matrix, self.matrix]))._order, ivf._order)
+
+    def test_stacked_rows_read_like_one_matrix(self):
+        stacked = StackedRows(self.matrix[:300].astype(np.float16), self.matrix[300:])
+        dense = np.vstack([self.matrix[:300].astype(np.float16).astype(np.float32), self.matrix[300:]])
+        for key in (np.array([5, 350, 299, 300]), dense[:, 0] > 0, slice(290, 310)):
+            np.testing.assert_array_equal(stacked[key], dense[key])
+        exact = BruteForceBackend()
+        exact.build(dense)
+        for backend in (BruteForceBackend(), IVFBackend(nlist=8, nprobe=8, min_train_size=50)):
+            backend.build(stacked)
+            self.assertSameResults(backend, exact)
+
+
+class EncodeBatcherTests(TestCase):
+    def setUp(self):
+        self.calls = []
+
+        def encode_fn(sentences, model_name):
+            self.calls.append((model_name, list(sentences)))
+            return np.array([[float(sentence)] for sentence in sentences], dtype=np.float32)
+
+        self.batcher = EncodeBatcher(encode_fn, max_batch_size=8, max_wait_ms=10000)
+
+    def encode_concurrently(self, requests):
+        # Queue every request before the batching thread starts, so they are all pending together
+        results = [None] * len(requests)
+
+        def call(i, sentence, model_name):
+            results[i] = self.batcher.encode(sentence, model_name)
+
+        threads = [threading.Thread(target=call, args=(i, *request)) for i, request in enumerate(requests)]
+        with mock.patch.object(self.batcher, '_ensure_started'):
+            for thread in threads:
+                thread.start()
+            while self.batcher._queue.qsize() < len(requests):
+                time.sleep(0.001)
+        self.batcher._ensure_started()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_concurrent_questions_share_one_encode(self):
+        results = self.encode_concurrently([(str(i), 'model') for i in range(4)])
+        self.assertEqual(self.calls, [('model', ['0', '1', '2', '3'])])
+        self.assertEqual([float(vector[0]) for vector in results], [0.0, 1.0, 2.0, 3.0])
+
+    def test_questions_for_different_models_are_encoded_apart(self):
+        results = self.encode_concurrently([('0', 'old'), ('1', 'new'), ('2', 'old')])
+        self.assertEqual(self.calls, [('old', ['0', '2']), ('new', ['1'])])
+        self.assertEqual([float(vector[0]) for vector in results], [0.0, 1.0, 2.0])
+
+    def test_lone_question_does_not_wait_for_the_window(self):
+        started = time.perf_counter()
+        self.assertEqual(float(self.batcher.encode('7', 'model')[0]), 7.0)
+        self.assertLess(time.perf_counter() - started, 1.0)
+
+    def test_stats_count_batches_by_size(self):
+        self.encode_concurrently([(str(i), 'model') for i in range(3)])
+        self.batcher.encode('3', 'model')
+        stats = self.batcher.stats()
+        self.assertEqual((stats['batches'], stats['items'], stats['max_batch_size']), (2, 4, 3))
+        self.assertEqual(stats['mean_batch_size'], 2.0)
+        self.assertEqual({size: count for size, count in stats['batch_size_buckets'].items() if count}, {1: 1, 4: 1})
+
+
+class RequestValidationTests(TestCase):
+    def post(self, url, body):
+        return self.client.post(url, body, content_type='application/json')
+
+    def test_non_string_fields_are_rejected(self):
+        for url in ('/api/chatbot/', '/api/chatbot/stream/'):
+            with self.subTest(url=url):
+                response = self.post(url, '{"question": "hi", "category": 5}')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'category must be a string.'})
+                response = self.post(url, '{"question": ["hi"]}')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'question must be a string.'})
+                self.assertEqual(self.post(url, '[1]').status_code, 400)
+        response = self.post('/api/chatbot/batch/', '{"questions": ["hi"], "category": {}}')
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'category must be a string.'}))
+
+    def test_null_category_means_none(self):
+        with mock.patch.object(views, 'answer_question', return_value={'answer': 'ok'}) as answer_question:
+            response = self.post('/api/chatbot/', '{"question": " hi ", "category": null}')
+        self.assertEqual(response.json(), {'answer': 'ok'})
+        answer_question.assert_called_once_with('hi', None)
+
+
+class StreamTests(TestCase):
+    def events(self, question):
+        async def collect():
+            return [chunk async for chunk in views._answer_events(question, None)]
+        return asyncio.run(collect())
+
+    def test_failure_is_reported_as_an_error_event(self):
+        with mock.patch.object(views, 'answer_question', side_effect=RuntimeError('model missing')), \
+                self.assertLogs('chatbot.views', 'ERROR'):
+            events = self.events('where is the library')
+        self.assertEqual(events[0], views._sse('received', {'question': 'where is the library'}))
+        self.assertTrue(events[-1].startswith('event: error\n'))
+        self.assertNotIn('model missing', events[-1])
+
+    def test_answer_events(self):
+        payload = {'answer': 'Block A', 'extra_data': None, 'alternatives': []}
+        with mock.patch.object(views, 'answer_question', return_value=payload):
+            events = self.events('where is the library')
+        self.assertEqual([event.split('\n')[0] for event in events],
+                         ['event: received', 'event: answer', 'event: alternatives', 'event: done'])
+
+
+class InferencePoolTests(TestCase):
+    def test_full_pool_sheds_load_with_a_503(self):
+        pool = InferencePool(max_workers=1, max_queue=0)
+        release = threading.Event()
+        request = RequestFactory().post('/api/chatbot/', json.dumps({'question': 'where is the library'}),
+                                        content_type='application/json')
+
+        async def scenario():
+            blocked = asyncio.ensure_future(pool.run(release.wait))
+            await asyncio.sleep(0)
+            with self.assertRaises(InferencePoolFull):
+                await pool.run(str)
+            with mock.patch.object(views, 'get_inference_pool', return_value=pool):
+                response = await views.chatbot_api_async(request)
+            release.set()
+            await blocked
+            # The slot is free again once the blocked job finishes
+            return response, await pool.run(str, 'ok')
+
+        response, result = asyncio.run(scenario())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(result, 'ok')
+
+
+class RerankerTests(TestCase):
+    SCORES = {'where is the library': 0.25, 'how do i find the reading room': 0.75, 'when does the gym open': 0.5}
+
+    def setUp(self):
+        self.reranker = CrossEncoderReranker(cache_size=3)
+        self.predict = self.reranker._model = mock.Mock()
+        self.predict.predict.side_effect = lambda pairs, **kwargs: [self.SCORES[phrasing.lower().rstrip('?')]
+                                                                    for _, phrasing in pairs]
+        self.library = FAQ(id=1, question='Where is the library?')
+        self.gym = FAQ(id=2, question='When does the gym open?')
+        self.phrasings = {1: ['Where is the library?', 'How do I find the reading room?']}
+
+    def rerank(self, question):
+        ranked, _ = self.reranker.rerank(question, [(self.gym, 0.9), (self.library, 0.8)], self.phrasings.get)
+        return [(faq.id, score) for faq, score in ranked]
+
+    def test_reorders_by_the_best_phrasing_of_each_faq(self):
+        self.assertEqual(self.rerank('library'), [(1, 0.75), (2, 0.5)])
+        self.assertEqual(self.predict.predict.call_count, 1)
+        self.assertEqual(self.reranker.stats()['calls'], 1)
+
+    def test_cached_pairs_are_not_scored_again(self):
+        self.rerank('library')
+        self.assertEqual(self.rerank('Library!'), [(1, 0.75), (2, 0.5)])
+        self.assertEqual(self.predict.predict.call_count, 1)
+        stats = self.reranker.stats()
+        self.assertEqual((stats['pairs_scored'], stats['cache_hits']), (3, 3))
+
+    def test_least_recently_used_pairs_are_evicted(self):
+        self.reranker.score('library', ['Where is the library?', 'When does the gym open?'])
+        self.reranker.score('library', ['Where is the library?'])
+        self.reranker.score('library', ['How do I find the reading room?', 'When does the gym open?'])
+        self.assertEqual(len(self.reranker._cache), 3)
+        self.reranker.score('gym', ['When does the gym open?'])
+        # Scored together with the gym phrasing, the library one was evicted since it was used less recently
+        self.assertEqual(list(self.reranker._cache), [('library', 'When does the gym open?'),
+                                                      ('library', 'How do I find the reading room?'),
+                                                      ('gym', 'When does the gym open?')])
+
+
+@override_settings(CHATBOT_METRICS={'ENABLED': True, 'TOKEN': 'scrape-token'})
+class MetricsTests(ChatbotTestCase):
+    def test_answer_stages_are_timed_and_exported(self):
+        self.create_faq('Where is the library?', 'Block A')
+        response = self.client.post('/api/chatbot/', json.dumps({'question': 'where is the library'}),
+                                    content_type='application/json')
+        stages = {entry.split(';')[0] for entry in response['Server-Timing'].split(', ')}
+        self.assertLessEqual({'index_check', 'encode', 'retrieve', 'serialize'}, stages)
+        metrics = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'}).content.decode()
+        self.assertIn('chatbot_http_requests_total{view="chatbot_api",status="200"}', metrics)
+        self.assertIn('# TYPE chatbot_stage_seconds histogram', metrics)
+
+
+@override_settings(CHATBOT_METRICS={'ENABLED': True, 'TOKEN': 'scrape-token', 'ALLOWED_IPS': ['10.0.0.5']},
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MetricsAccessTests(TestCase):
+    def test_anonymous_requests_are_refused(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+
+    def test_token_allowlisted_address_or_staff_may_scrape(self):
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'}).status_code,
+                         200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.5').status_code, 200)
+        staff = User.objects.create_user('admin', 'admin@example.com', 'pw', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_disabled_endpoint_is_not_found(self):
+        with override_settings(CHATBOT_METRICS={'ENABLED': False, 'TOKEN': 'scrape-token'}):
+            response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoginTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('student', '1DT23CS001@dsatm.edu.in', 'secret-pw')
+
+    def test_email_or_username_logs_in(self):
+        for login in ('1DT23CS001@dsatm.edu.in', 'student'):
+            with self.subTest(login=login):
+                self.client.logout()
+                self.assertTrue(self.client.login(username=login, password='secret-pw'))
+        response = self.client.post('/login/', {'email': '1DT23CS001@dsatm.edu.in', 'password': 'secret-pw'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(int(self.client.session['_auth_user_id']), self.user.pk)
+
+    def test_failed_login_is_signalled(self):
+        failures = []
+
+        def handler(sender, credentials, **kwargs):
+            failures.append(credentials['username'])
+
+        user_login_failed.connect(handler)
+        self.addCleanup(user_login_failed.disconnect, handler)
+        for email in ('1DT23CS001@dsatm.edu.in', '1DT23CS002@dsatm.edu.in'):
+            # Only the backend's lookup: no second query to tell the two cases apart
+            with self.assertNumQueries(1):
+                response = self.client.post('/login/', {'email': email, 'password': 'wrong'})
+            self.assertEqual(response.context['error_message'], "Invalid email or password.")
+        self.assertEqual(failures, ['1DT23CS001@dsatm.edu.in', '1DT23CS002@dsatm.edu.in'])
+
+    def test_inactive_user_is_refused(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.client.post('/login/', {'email': '1DT23CS001@dsatm.edu.in', 'password': 'secret-pw'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ProvisioningTests(TestCase):
+    def test_parse_range(self):
+        self.assertEqual(parse_range('101-103, 102,105'), [101, 102, 103, 105])
+        for spec in ('5-3', 'abc', '', '1-2-3'):
+            with self.subTest(spec=spec), self.assertRaises(RosterError):
+                parse_range(spec)
+        self.assertEqual(list(range_roster([7], 'S', '@college.edu', '{number}@nova')),
+                         [('S7@college.edu', '7@nova')])
+
+    def test_read_roster(self):
+        csv_roster = io.StringIO('Password,Email\nsecret,a@college.edu\n,b@college.edu\n')
+        self.assertEqual(list(read_roster(csv_roster, 'welcome-{email}')),
+                         [('a@college.edu', 'secret'), ('b@college.edu', 'welcome-b@college.edu')])
+        self.assertEqual(list(read_roster(io.StringIO('c@college.edu,pw\n\nd@college.edu\n'), 'x')),
+                         [('c@college.edu', 'pw'), ('d@college.edu', 'x')])
+        for roster, template in (('d@college.edu\n', None), ('not-an-email,pw\n', 'x')):
+            with self.subTest(roster=roster), self.assertRaises(RosterError):
+                list(read_roster(io.StringIO(roster), template))
+
+    def test_existing_passwords_are_kept_unless_reset(self):
+        User.objects.create_user('old@college.edu', 'old@college.edu', 'changed-by-student')
+        entries = [('old@college.edu', 'default'), ('new1@college.edu', 'pw1'), ('new2@college.edu', 'pw2')]
+        self.assertEqual(provision_users(entries, batch_size=2, workers=1),
+                         {'created': 2, 'updated': 0, 'skipped': 1})
+        self.assertTrue(User.objects.get(username='new2@college.edu').check_password('pw2'))
+        self.assertTrue(User.objects.get(username='old@college.edu').check_password('changed-by-student'))
+
+        entries = [('old@college.edu', 'reset'), ('new1@college.edu', 'pw1b'), ('new3@college.edu', 'pw3')]
+        with self.assertNumQueries(5):
+            result = provision_users(entries, batch_size=10, workers=1, update_existing=True)
+        self.assertEqual(result, {'created': 1, 'updated': 2, 'skipped': 0})
+        self.assertTrue(User.objects.get(username='old@college.edu').check_password('reset'))
+        self.assertTrue(User.objects.get(username='new1@college.edu').check_password('pw1b'))
+
+    def test_command_provisions_a_range(self):
+        out = io.StringIO()
+        call_command('provision_users', range='1-3', prefix='S', domain='@college.edu', workers=1, stdout=out)
+        self.assertIn('Created 3, updated 0, skipped 0 users', out.getvalue())
+        self.assertTrue(User.objects.get(email='S2@college.edu').check_password('2@nova'))
+
+
+class ChunkTests(TestCase):
+    def test_short_blocks_are_packed_together(self):
+        blocks = ['one two three', 'four five six', 'seven eight']
+        self.assertEqual(list(chunk_blocks(blocks, max_words=10, overlap=2, min_words=1)),
+                         ['one two three four five six seven eight'])
+
+    def test_passages_overlap_and_respect_max_words(self):
+        words = [f'w{i}' for i in range(25)]
+        chunks = [chunk.split() for chunk in chunk_blocks([' '.join(words)], max_words=10, overlap=3, min_words=1)]
+        self.assertTrue(all(len(chunk) <= 10 for chunk in chunks))
+        self.assertEqual(chunks[0], words[:10])
+        self.assertEqual(chunks[1][:3], words[7:10])
+        self.assertEqual(chunks[-1][-1], 'w24')
+        covered = set().union(*chunks)
+        self.assertEqual(covered, set(words))
+
+    def test_breaks_between_blocks_once_half_full(self):
+        chunks = list(chunk_blocks(['a b c d e f', 'g h i j k l'], max_words=10, overlap=2, min_words=1))
+        self.assertEqual(chunks, ['a b c d e f', 'e f g h i j k l'])
+
+    def test_short_passages_are_dropped(self):
+        self.assertEqual(list(chunk_blocks(['Page 3'], max_words=10, overlap=2, min_words=5)), [])
+
+    def test_overlap_must_be_smaller_than_max_words(self):
+        with self.assertRaises(ValueError):
+            list(chunk_blocks(['a b c'], max_words=5, overlap=5))
@@ -1,7 +1,9 @@
+import os
+
 import requests
 
 # Your local or deployed Django endpoint
-url = "http://127.0.0.1:8000/api/add-faq/"
+url = "http://127.0.0.1:8000/api/import-faqs/"
 
 # List of FAQs to upload
 data = [
@@ -15,12 +17,14 @@ data = [
     }
 ]
 
-# Send each FAQ as a separate POST request
-for faq in data:
-    response = requests.post(url, json=faq)
-    print(f"Uploading FAQ: {faq['question']}")
-    print("Status Code:", response.status_code)
-    try:
-        print("Response:", response.json())
-    except Exception as e:
-        print("Response content could not be decoded as JSON:", response.text)
+# Send all FAQs in one request; the server skips questions that already exist.
+# For large files use `python manage.py import_faqs faqs.jsonl` instead.
+# The API only accepts staff sessions or the token set in CHATBOT_IMPORT_TOKEN on the server.
+headers = {"Authorization": f"Bearer {os.environ.get('CHATBOT_IMPORT_TOKEN', '')}"}
+response = requests.post(url, json=data, headers=headers)
+print(f"Uploading {len(data)} FAQs")
+print("Status Code:", response.status_code)
+try:
+    print("Response:", response.json())
+except Exception as e:
+    print("Response content could not be decoded as JSON:", response.text)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 from .views import add_faq_api
@@ -7,12 +8,17 @@ from django.urls import re_path
 urlpatterns = [
     path('', views.FrontendAppView.as_view(), name='home'),
     path('login/', views.login_view, name='login'),
-    path('api/chatbot/', views.chatbot_api, name='chatbot_api'),
+    path('api/chatbot/', views.chatbot_api_async if settings.CHATBOT_ASYNC_API else views.chatbot_api,
+         name='chatbot_api'),
+    path('api/chatbot/stream/', views.chatbot_stream_api, name='chatbot_stream_api'),
+    path('api/chatbot/batch/', views.chatbot_batch_api, name='chatbot_batch_api'),
     path('chatbot/', views.chatbot, name='chatbot'),
     # path('chatbot/', views.chatbot_view, name='chatbot'),
     path('api/add-faq/', add_faq_api, name='add_faq_api'),
+    path('api/import-faqs/', views.import_faqs_api, name='import_faqs_api'),
     path('api/csrf/', views.csrf_token_view, name='csrf_token'),
     path('api/user-info/', views.user_info_api, name='user_info_api'),
+    path('metrics', views.metrics_view, name='metrics'),
     # Password reset URL is commented out to disable password reset functionality
     # path('password-reset/', views.password_reset_view, name='password_reset'),
     path('logout/', views.logout_view, name='logout'),
@@ -2,162 +2,29 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.contrib.auth import authenticate, login, update_session_auth_hash
 from django.contrib import messages
 from django.views.generic import TemplateView
+import asyncio
+import codecs
 import json
+import logging
 import re
-import time
-import torch
-from sentence_transformers import SentenceTransformer, util
-from django.contrib.auth.models import User
+from django.conf import settings
+from django.db import transaction
+from .importers import (CappedReader, ImportFormatError, ImportLimitError, add_variants, clean_variants,
+                        detect_format, import_faqs, import_limits, iter_records)
+from .matching import answer_question, answer_questions
+from .metrics import can_read_metrics, has_bearer_token, registry, span
 from .models import FAQ, UserSession
+from .workers import InferencePoolFull, get_inference_pool
 
-# Load SBERT model once
-model = SentenceTransformer('all-MiniLM-L6-v2')
+logger = logging.getLogger(__name__)
 
-class FrontendAppView(TemplateView):
-    template_name = 'index.html'
-
-    def get(self, request, *args, **kwargs):
-        return render(request, self.template_name)
-
-# ----------------- Chatbot Web View -----------------
-@login_required
-def chatbot(request):
-    # Removed Django template rendering to use React frontend only
-    pass
-
-# ----------------- Logout View -----------------
-@login_required
-def logout_view(request):
-    logout(request)
-    return JsonResponse({'message': 'Logged out successfully'}, status=200)
-
-# ----------------- Chatbot API (POST) -----------------
-@csrf_exempt
-def chatbot_api(request):
-    if request.method == "POST":
-        try:
-            data = json.loads(request.body)
-            user_question = data.get('question', '').strip()
-        except json.JSONDecodeError:
-            return JsonResponse({'error': 'Invalid JSON'}, status=400)
-
-        faqs = list(FAQ.objects.all())
-        db_questions = [faq.question for faq in faqs]
-
-        db_embeddings = model.encode(db_questions, convert_to_tensor=True)
-        user_embedding = model.encode(user_question, convert_to_tensor=True)
-        cos_scores = util.pytorch_cos_sim(user_embedding, db_embeddings)[0]
-
-        top_result_idx = torch.argmax(cos_scores).item()
-        top_score = cos_scores[top_result_idx].item()
-
-        if top_score > 0.6:
-            matched_faq = faqs[top_result_idx]
-            return JsonResponse({
-                'answer': matched_faq.answer,
-                'extra_data': matched_faq.extra_data
-            })
-
-        return JsonResponse({'answer': "Sorry, I don't know the answer to that question yet."})
-
-    return JsonResponse({'error': 'Invalid request method'}, status=405)
-
-@login_required
-def user_info_api(request):
-    user = request.user
-    return JsonResponse({'username': user.username, 'email': user.email})
-
-# ----------------- Add FAQ via API -----------------
-@csrf_exempt
-def add_faq_api(request):
-    if request.method == "POST":
-        try:
-            data = json.loads(request.body)
-            question = data.get('question', '').strip()
-            answer = data.get('answer', '').strip()
-            category = data.get('category', 'general').strip()
-            extra_data = data.get('extra_data', None)
-
-            if not question or not answer:
-                return JsonResponse({'error': 'Both question and answer are required.'}, status=400)
-
-            if FAQ.objects.filter(question=question).exists():
-                return JsonResponse({'error': 'Question already exists.'}, status=409)
-
-            FAQ.objects.create(question=question, answer=answer, category=category, extra_data=extra_data)
-            return JsonResponse({'message': 'FAQ added successfully.'}, status=201)
-
-        except json.JSONDecodeError:
-            return JsonResponse({'error': 'Invalid JSON'}, status=400)
-
-# ----------------- Custom Login View -----------------
-def login_view(request):
-    if request.method == "POST":
-        email = request.POST.get('email')
-        password = request.POST.get('password')
-
-        pattern = r'^1DT23CS\d+@dsatm\.edu\.in$'
-        if not re.match(pattern, email):
-            error_message = "Access denied"
-            # return render(request, 'index.html', {'error_message': error_message, 'access_denied': True})
-            return render(request, 'index.html')
-
-        try:
-            user_obj = User.objects.get(email=email)
-        except User.DoesNotExist:
-            try:
-                user_obj = User.objects.get(username=email)
-            except User.DoesNotExist:
-                error_message = "User with this email does not exist."
-                # return render(request, 'index.html', {'error_message': error_message})
-                return render(request, 'index.html')
-
-        user = authenticate(request, username=user_obj.username, password=password)
-        if user is not None:
-            login(request, user)
-            # Redirect to chatbot directly, disable password reset redirect
-            user_session, created = UserSession.objects.get_or_create(user=user)
-            if created:
-                user_session.default_password_changed = False
-                user_session.save()
-            # Remove redirect to password_reset
-            return redirect('chatbot')
-        else:
-            error_message = "Invalid email or password."
-            # return render(request, 'index.html', {'error_message': error_message})
-            return render(request, 'index.html')
-
-    # return render(request, 'index.html')
-    return render(request, 'index.html')
-
-# ----------------- CSRF Token View -----------------
-@ensure_csrf_cookie
-def csrf_token_view(request):
-    return JsonResponse({'detail': 'CSRF cookie set'})
-from django.shortcuts import render, redirect
-from django.contrib.auth import logout
-from django.contrib.auth.decorators import login_required
-from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
-from django.views.decorators.csrf import ensure_csrf_cookie
-from django.contrib.auth import authenticate, login, update_session_auth_hash
-from django.contrib import messages
-from django.views.generic import TemplateView
-import json
-import re
-import time
-import torch
-from sentence_transformers import SentenceTransformer, util
-from django.contrib.auth.models import User
-from .models import FAQ, UserSession
-
-# Load SBERT model once
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# Only student accounts of this batch may sign in
+LOGIN_EMAIL_PATTERN = re.compile(r'1DT23CS\d+@dsatm\.edu\.in')
 
 class FrontendAppView(TemplateView):
     template_name = 'index.html'
@@ -176,25 +43,11 @@ def chatbot(request):
     if request.method == "POST":
         user_question = request.POST.get('question', '').strip()
         show_spinner = True
-        time.sleep(1)  # simulate delay
 
-        faqs = list(FAQ.objects.all())
-        db_questions = [faq.question for faq in faqs]
-
-        # Semantic similarity matching
-        db_embeddings = model.encode(db_questions, convert_to_tensor=True)
-        user_embedding = model.encode(user_question, convert_to_tensor=True)
-        cos_scores = util.pytorch_cos_sim(user_embedding, db_embeddings)[0]
-
-        top_result_idx = torch.argmax(cos_scores).item()
-        top_score = cos_scores[top_result_idx].item()
-
-        if top_score > 0.6:  # adjust threshold if needed
-            matched_faq = faqs[top_result_idx]
-            answer = matched_faq.answer
-            extra_data = matched_faq.extra_data
-        else:
-            answer = "Sorry, I don't know the answer to that question yet."
+        # Semantic similarity matching, with the thresholds from settings.CHATBOT_RANKING
+        result = answer_questions([user_question])[0]
+        answer = result['answer']
+        extra_data = result.get('extra_data')
 
         show_spinner = False
 
@@ -225,33 +78,159 @@ def logout_view(request):
     return JsonResponse({'message': 'Logged out successfully'}, status=200)
 
 # ----------------- Chatbot API (POST) -----------------
+def _text_field(data, name):
+    """`data[name]` stripped, '' when missing or null; ValueError for any other non-string."""
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object.')
+    value = data.get(name)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise ValueError(f'{name} must be a string.')
+    return value.strip()
+
+
+def _question_fields(data):
+    # Optional FAQ category to search first; other categories are only used as a fallback
+    return _text_field(data, 'question'), _text_field(data, 'category') or None
+
+
 @csrf_exempt
 def chatbot_api(request):
     if request.method == "POST":
         try:
             data = json.loads(request.body)
-            user_question = data.get('question', '').strip()
         except json.JSONDecodeError:
             return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        try:
+            user_question, category = _question_fields(data)
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
 
-        faqs = list(FAQ.objects.all())
-        db_questions = [faq.question for faq in faqs]
+        payload = answer_question(user_question, category)
+        with span('serialize'):
+            return JsonResponse(payload)
 
-        db_embeddings = model.encode(db_questions, convert_to_tensor=True)
-        user_embedding = model.encode(user_question, convert_to_tensor=True)
-        cos_scores = util.pytorch_cos_sim(user_embedding, db_embeddings)[0]
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
 
-        top_result_idx = torch.argmax(cos_scores).item()
-        top_score = cos_scores[top_result_idx].item()
+# ----------------- Batch Chatbot API (POST) -----------------
+@csrf_exempt
+def chatbot_batch_api(request):
+    # {"questions": [...], "category": optional}
+    #   -> {"results": [{"question", "answer", "extra_data", "faq_id", "score" (or "lexical_score"),
+    #                    "alternatives"}, ...]}
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        try:
+            category = _text_field(data, 'category') or None
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+
+        questions = data.get('questions')
 
-        if top_score > 0.6:
-            matched_faq = faqs[top_result_idx]
-            return JsonResponse({
-                'answer': matched_faq.answer,
-                'extra_data': matched_faq.extra_data
-            })
+        if not isinstance(questions, list) or not all(isinstance(q, str) for q in questions):
+            return JsonResponse({'error': 'questions must be a list of strings.'}, status=400)
 
-        return JsonResponse({'answer': "Sorry, I don't know the answer to that question yet."})
+        max_questions = getattr(settings, 'CHATBOT_BATCH_MAX_QUESTIONS', 64)
+        if len(questions) > max_questions:
+            return JsonResponse({'error': f'At most {max_questions} questions per request.'}, status=413)
+
+        questions = [q.strip() for q in questions]
+        results = answer_questions(questions, category) if questions else []
+        return JsonResponse({
+            'results': [{'question': q, **result} for q, result in zip(questions, results)]
+        })
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+# ----------------- Chatbot API, async (POST) -----------------
+@csrf_exempt
+async def chatbot_api_async(request):
+    # Same contract as chatbot_api, but the event loop is never blocked by inference
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        try:
+            user_question, category = _question_fields(data)
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+
+        try:
+            payload = await get_inference_pool().run(answer_question, user_question, category)
+        except InferencePoolFull:
+            response = JsonResponse({'error': 'Server busy, please try again shortly.'}, status=503)
+            response['Retry-After'] = '1'
+            return response
+
+        with span('serialize'):
+            return JsonResponse(payload)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+# ----------------- Chatbot API, streamed as Server-Sent Events (POST) -----------------
+# A comment line is sent this often while inference runs, so idle proxies keep the stream open
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+def _sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def _answer_events(user_question, category):
+    # "received" goes out before any inference, so the client sees the first byte at once
+    yield _sse('received', {'question': user_question})
+    job = asyncio.ensure_future(get_inference_pool().run(answer_question, user_question, category))
+    try:
+        while not (await asyncio.wait({job}, timeout=STREAM_KEEPALIVE_SECONDS))[0]:
+            yield ': keep-alive\n\n'
+    finally:
+        # The client went away; a job not yet started is dropped
+        if not job.done():
+            job.cancel()
+    try:
+        payload = job.result()
+    except InferencePoolFull:
+        yield _sse('error', {'error': 'Server busy, please try again shortly.', 'retry_after': 1})
+        return
+    except Exception:
+        # The 200 status is already sent, so a failure can only be reported in the stream
+        logger.exception("Answering a streamed question failed")
+        yield _sse('error', {'error': 'Something went wrong answering your question. Please try again.'})
+        return
+
+    yield _sse('answer', {'answer': payload['answer']})
+    if payload.get('extra_data'):
+        yield _sse('extra_data', {'extra_data': payload['extra_data']})
+    if 'alternatives' in payload:
+        yield _sse('alternatives', {'alternatives': payload['alternatives']})
+    yield _sse('done', {})
+
+
+@csrf_exempt
+async def chatbot_stream_api(request):
+    # Same request body as chatbot_api; the response is a text/event-stream of
+    # received -> answer -> extra_data (if any) -> alternatives -> done, or an error event.
+    # Streams only under ASGI: the open response is a suspended coroutine, not a thread.
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        try:
+            user_question, category = _question_fields(data)
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+
+        response = StreamingHttpResponse(_answer_events(user_question, category), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
@@ -274,46 +253,90 @@ def add_faq_api(request):
             if not question or not answer:
                 return JsonResponse({'error': 'Both question and answer are required.'}, status=400)
 
+            # Alternate phrasings matched as this FAQ
+            try:
+                variants = clean_variants(data.get('variants'), question)
+            except ValueError as exc:
+                return JsonResponse({'error': str(exc)}, status=400)
+
             if FAQ.objects.filter(question=question).exists():
                 return JsonResponse({'error': 'Question already exists.'}, status=409)
 
-            FAQ.objects.create(question=question, answer=answer, category=category, extra_data=extra_data)
+            with transaction.atomic():
+                faq = FAQ.objects.create(question=question, answer=answer, category=category, extra_data=extra_data)
+                add_variants(faq, variants)
             return JsonResponse({'message': 'FAQ added successfully.'}, status=201)
 
         except json.JSONDecodeError:
             return JsonResponse({'error': 'Invalid JSON'}, status=400)
 
+# ----------------- Bulk FAQ Import via API -----------------
+@csrf_exempt
+def import_faqs_api(request):
+    # Accepts a multipart upload in the `file` field, or the raw request body.
+    # Format comes from ?format=json|jsonl|csv, else the file name or Content-Type.
+    # Staff users or the CHATBOT_IMPORT token only, within its size and record limits;
+    # `manage.py import_faqs` has no limits.
+    if request.method == "POST":
+        limits = import_limits()
+        user = request.user
+        if not (user.is_authenticated and user.is_staff or has_bearer_token(request, limits.get('TOKEN'))):
+            return JsonResponse({'error': 'Forbidden'}, status=403)
+
+        max_bytes = limits.get('MAX_UPLOAD_BYTES')
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        # Checked before request.FILES, which would spool the whole upload
+        if max_bytes and length > max_bytes:
+            return JsonResponse({'error': "Upload is too large; use `manage.py import_faqs` for large files."},
+                                status=413)
+
+        upload = request.FILES.get('file')
+        source = upload if upload is not None else request
+        if max_bytes:
+            # Content-Length may be missing or cover a multipart body; count what is actually read
+            source = CappedReader(source, max_bytes)
+        fmt = request.GET.get('format') or detect_format(
+            upload.name if upload is not None else '',
+            upload.content_type if upload is not None else request.content_type,
+        )
+
+        try:
+            # Decoded incrementally, so large uploads are never held in memory as one string
+            stream = codecs.getreader('utf-8')(source)
+            result = import_faqs(iter_records(stream, fmt), max_records=limits.get('MAX_RECORDS'))
+        except ImportLimitError as exc:
+            return JsonResponse({'error': str(exc)}, status=413)
+        except (ImportFormatError, UnicodeDecodeError) as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+
+        return JsonResponse(result, status=201 if result['inserted'] else 200)
+
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
 # ----------------- Custom Login View -----------------
 def login_view(request):
     if request.method == "POST":
-        email = request.POST.get('email')
-        password = request.POST.get('password')
+        email = request.POST.get('email', '')
+        password = request.POST.get('password', '')
 
-        pattern = r'^1DT23CS\d+@dsatm\.edu\.in$'
-        if not re.match(pattern, email):
+        if not LOGIN_EMAIL_PATTERN.fullmatch(email):
             error_message = "Access denied"
             return render(request, 'index.html', {'error_message': error_message, 'access_denied': True})
 
-        try:
-            user_obj = User.objects.get(email=email)
-        except User.DoesNotExist:
-            try:
-                user_obj = User.objects.get(username=email)
-            except User.DoesNotExist:
-                error_message = "User with this email does not exist."
-                return render(request, 'index.html', {'error_message': error_message})
-
-        user = authenticate(request, username=user_obj.username, password=password)
+        # EmailOrUsernameBackend looks the user up by email or username in one query
+        user = authenticate(request, username=email, password=password)
         if user is not None:
             login(request, user)
-            # Redirect to chatbot directly, disable password reset redirect
-            user_session, created = UserSession.objects.get_or_create(user=user)
-            if created:
-                user_session.default_password_changed = False
-                user_session.save()
+            # Redirect to chatbot directly, disable password reset redirect.
+            # A single INSERT that is a no-op for returning users, instead of get_or_create + save
+            UserSession.objects.bulk_create([UserSession(user=user)], ignore_conflicts=True)
             # Remove redirect to password_reset
             return redirect('chatbot')
         else:
+            # The same message for an unknown account and a wrong password, so logins cannot be probed
             error_message = "Invalid email or password."
             return render(request, 'index.html', {'error_message': error_message})
 
@@ -322,4 +345,13 @@ def login_view(request):
 # ----------------- CSRF Token View -----------------
 @ensure_csrf_cookie
 def csrf_token_view(request):
-    return JsonResponse({'detail': 'CSRF cookie set'})
\ No newline at end of file
+    return JsonResponse({'detail': 'CSRF cookie set'})
+
+# ----------------- Metrics (Prometheus text format) -----------------
+def metrics_view(request):
+    # Process-local: scrape every worker, and keep the endpoint off the public network
+    if not getattr(settings, 'CHATBOT_METRICS', {}).get('ENABLED', True):
+        raise Http404()
+    if not can_read_metrics(request):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
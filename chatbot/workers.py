@@ -0,0 +1,59 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class InferencePoolFull(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+class InferencePool:
+    """
+    Bounded thread pool that async views await for encoding and retrieval.
+
+    At most `max_workers` jobs run at once and `max_queue` more may wait. Beyond
+    that, `run()` fails immediately with InferencePoolFull instead of queueing,
+    so an overloaded server sheds load quickly rather than timing out.
+    """
+
+    def __init__(self, max_workers=4, max_queue=64):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chatbot-inference')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+
+    @staticmethod
+    def _call(fn, args):
+        try:
+            return fn(*args)
+        finally:
+            # Pool threads outlive requests, so they drop stale connections themselves
+            close_old_connections()
+
+    async def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise InferencePoolFull()
+        # Run in the caller's context so per-request state such as metrics spans follows the job
+        future = self._executor.submit(contextvars.copy_context().run, self._call, fn, args)
+        # Released when the job really finishes, even if the awaiting request is cancelled
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_inference_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = getattr(settings, 'CHATBOT_INFERENCE_POOL', {})
+                _pool = InferencePool(
+                    max_workers=config.get('WORKERS', 4),
+                    max_queue=config.get('MAX_QUEUE', 64),
+                )
+    return _pool
@@ -63,18 +63,68 @@ const Chatbot = () => {
     setInput('');
     setLoading(true);
 
+    // The bot message is added on the first answer event and filled in as later events arrive
+    const botId = `bot-${Date.now()}`;
+    let answered = false;
+    // Set once the server has explained a failure, which is then kept on screen
+    let failed = false;
+    const updateBot = (fields) => {
+      setMessages((prev) => (prev.some((msg) => msg.id === botId)
+        ? prev.map((msg) => (msg.id === botId ? { ...msg, ...fields } : msg))
+        : [...prev, { id: botId, sender: 'bot', text: '', extra_data: null, ...fields }]));
+    };
+    const handleEvent = (event, data) => {
+      if (event === 'answer') {
+        answered = true;
+        updateBot({ text: data.answer || 'Sorry, no answer.' });
+        setLoading(false);
+      } else if (event === 'extra_data') {
+        updateBot({ extra_data: data.extra_data || null });
+      } else if (event === 'alternatives') {
+        updateBot({ alternatives: data.alternatives || [] });
+      } else if (event === 'error') {
+        failed = true;
+        updateBot({ text: data.error || 'Error contacting chatbot API.' });
+      }
+    };
+
     try {
-      const response = await fetch('/api/chatbot/', {
+      const response = await fetch('/api/chatbot/stream/', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
         body: JSON.stringify({ question: input }),
       });
-      const data = await response.json();
-      const botMessage = { sender: 'bot', text: data.answer || 'Sorry, no answer.', extra_data: data.extra_data || null };
-      setMessages((prev) => [...prev, botMessage]);
+      if (!response.ok || !response.body) {
+        // Rejected requests (e.g. a 400) say why in a JSON body
+        const body = await response.json().catch(() => ({}));
+        if (body.error) handleEvent('error', body);
+        throw new Error(`HTTP ${response.status}`);
+      }
+
+      // Server-Sent Events: blocks separated by a blank line, each with "event:" and "data:" lines
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const block = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          let event = 'message';
+          let data = '';
+          for (const line of block.split('\n')) {
+            if (line.startsWith('event:')) event = line.slice(6).trim();
+            else if (line.startsWith('data:')) data += line.slice(5).trim();
+          }
+          if (data) handleEvent(event, JSON.parse(data));
+        }
+      }
+      if (!answered && !failed) throw new Error('Stream ended without an answer');
     } catch (error) {
-      const errorMessage = { sender: 'bot', text: 'Error contacting chatbot API.' };
-      setMessages((prev) => [...prev, errorMessage]);
+      if (!failed) updateBot({ text: 'Error contacting chatbot API.' });
     } finally {
       setLoading(false);
     }
@@ -206,6 +256,14 @@ const Chatbot = () => {
                         </ul>
                       </div>
                     )}
+                    {msg.alternatives && msg.alternatives.length > 0 && (
+                      <div style={{ ...styles.extraInfo, backgroundColor: 'rgba(0,0,0,0.05)' }}>
+                        <strong>Related questions</strong>
+                        <ul style={styles.extraInfoList}>
+                          {msg.alternatives.map((alt) => <li key={alt.faq_id}>{alt.question}</li>)}
+                        </ul>
+                      </div>
+                    )}
                   </div>
                 </div>
               ))}